@@ -0,0 +1,62 @@
+# compile_benchmark.py
+# Time and peak memory of generating the shader of synthetic scenes, no GPU needed.
+# Spheres and boxes are either one line each or one deep Union chain on a single line
+import random
+import sys
+import time
+import tracemalloc
+
+from marcher.march import *
+
+
+def synthetic(count, chain):
+    rng = random.Random(count)
+    name = 'Synthetic%d%s' % (count, 'Chain' if chain else 'Lines')
+
+    def scene(self):
+        shapes = []
+        for i in range(count):
+            at = vec3(*[round(rng.uniform(-50, 50), 3) for _ in range(3)])
+            size = round(rng.uniform(0.1, 1), 3)
+            shapes.append(Sphere(size).at(at) if i % 2 else Box(vec3(size, size, size)).at(at))
+        if chain:
+            tree = shapes[0]
+            for shape in shapes[1:]:
+                tree = Union(tree, shape)
+            self.res(Union, tree)
+        else:
+            for shape in shapes:
+                self.res(Union, shape)
+
+    scene.__name__ = scene.__qualname__ = name
+    Object.register()(scene)
+    obj = Function.registry[name]
+    # Building the scene is the user's code, not the compiler's
+    obj.evaluate()
+    return obj
+
+
+def measure(obj, optimize):
+    camera = Camera((640, 480), cache=False, optimize=optimize)
+    start = time.perf_counter()
+    source, _ = camera.generate_shader(obj)
+    seconds = time.perf_counter() - start
+
+    # Traced separately, tracemalloc slows everything down
+    Function.generation += 1
+    tracemalloc.start()
+    camera.generate_shader(obj)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, len(source)
+
+
+counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+print('%8s %6s %9s %9s %10s %10s' % ('prims', 'shape', 'optimize', 'seconds', 'peak MB', 'source KB'))
+for count in counts:
+    for chain in (False, True):
+        obj = synthetic(count, chain)
+        for optimize in (False, True):
+            seconds, peak, length = measure(obj, optimize)
+            print('%8d %6s %9s %9.3f %10.1f %10.1f' % (count, 'chain' if chain else 'lines', optimize,
+                                                        seconds, peak / 2**20, length / 2**10))
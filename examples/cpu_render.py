@@ -0,0 +1,42 @@
+# cpu_render.py
+# Renders a scene on the CPU with 1 to N worker processes and reports how the time scales,
+# every frame has to be the same whatever the number of workers
+import os
+import sys
+import time
+
+import numpy as np
+
+from marcher.march import *
+
+
+@Object.register()
+def MyObject(self):
+    self.res(Union, Box(vec3(1, 1, 1)))
+    self.res(Intersect, Sphere(1.3))
+    shape = vec2(0.5, 2)
+    self.res(Subtract, CylinderX(shape))
+    self.res(Subtract, CylinderY(shape))
+    self.res(Subtract, CylinderZ(shape))
+
+
+@Object.register()
+def MyScene(self):
+    mo = MyObject()
+    for i in range(-1, 2):
+        for j in range(-1, 2):
+            self.res(Union, mo.at(2 * vec3(i, j, 0)))
+
+
+cores = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+c = Camera((320, 240), AA=2)
+reference = None
+print('%8s %9s %8s' % ('workers', 'seconds', 'speedup'))
+for workers in range(1, cores + 1):
+    start = time.perf_counter()
+    frame = c.render_cpu(Object.MyScene, workers=workers)
+    seconds = time.perf_counter() - start
+    if reference is None:
+        reference, single = frame, seconds
+    assert np.array_equal(frame, reference), "Frames differ with %d workers" % workers
+    print('%8d %9.2f %8.2f' % (workers, seconds, single / seconds))
@@ -0,0 +1,34 @@
+# instances.py
+# 20000 spheres placed from NumPy arrays and swirled every frame without recompiling
+import numpy as np
+
+from marcher.march import *
+from marcher.instances import instances
+
+rng = np.random.default_rng(0)
+count = 20000
+radius = rng.uniform(2, 4, count)
+angle = rng.uniform(0, 2 * np.pi, count)
+height = rng.uniform(-2, 2, count)
+
+
+def positions(time):
+    # Inner rings turn faster
+    turn = angle + time * 3 / radius
+    return np.stack([radius * np.cos(turn), height, radius * np.sin(turn)], -1)
+
+
+particles = instances(Sphere, positions(0.0), r=rng.uniform(0.03, 0.1, count))
+
+
+@Object.register()
+def Swirl(self):
+    self.res(Union, particles())
+    self.res(Union, Plane(at=vec3(0, -2.5, 0)))
+
+
+def on_frame(params, time):
+    particles.update(positions(time))
+
+
+Camera((650, 380)).view(Object.Swirl, on_frame)
@@ -0,0 +1,64 @@
+# raycast.py
+# Batched ray queries against a pure Python loop over the same rays, no GPU needed
+import time
+
+import numpy as np
+
+from marcher.march import *
+from marcher.cpu import Scene
+
+
+@Object.register()
+def MyObject(self):
+    self.res(Union, Box(vec3(1, 1, 1)))
+    self.res(Intersect, Sphere(1.3))
+    shape = vec2(0.5, 2)
+    self.res(Subtract, CylinderX(shape))
+    self.res(Subtract, CylinderY(shape))
+    self.res(Subtract, CylinderZ(shape))
+
+
+@Object.register()
+def MyScene(self):
+    mo = MyObject()
+    for i in range(-1, 2):
+        for j in range(-1, 2):
+            self.res(Union, mo.at(2 * vec3(i, j, 0)))
+
+
+def loop(scene, origins, directions):
+    # One ray and one point at a time
+    hits = []
+    for ro, rd in zip(origins, directions):
+        rd = rd / np.linalg.norm(rd)
+        t = 0.0
+        for _ in range(scene.max_steps):
+            d = float(scene.distance(ro + rd * t))
+            t += d
+            if t > scene.max_distance or d < scene.min_distance:
+                break
+        hits.append(t)
+    return np.array(hits)
+
+
+scene = Scene(Object.MyScene)
+rng = np.random.default_rng(0)
+origins = np.array([0, 0, 10.0]) + rng.uniform(-3, 3, (4000, 3)) * [1, 1, 0]
+directions = np.array([0, 0, -1.0]) + rng.normal(0, 0.05, (4000, 3))
+
+start = time.perf_counter()
+t, steps = scene.raycast(origins, directions)
+batched = time.perf_counter() - start
+print('batched  %d rays %.3fs, %.0f%% hit, %.1f steps on average'
+      % (len(t), batched, 100 * (t < scene.max_distance).mean(), steps.mean()))
+
+count = 200
+start = time.perf_counter()
+reference = loop(scene, origins[:count], directions[:count])
+looped = (time.perf_counter() - start) * len(t) / count
+print('loop     %d rays %.3fs (from %d), %.0fx slower' % (len(t), looped, count, looped / batched))
+assert np.allclose(np.minimum(reference, 100), np.minimum(t[:count], 100))
+
+hits = t < scene.max_distance
+points = origins[hits] + directions[hits] / np.linalg.norm(directions[hits], axis=1)[:, None] * t[hits, None]
+print('normals  %d points, first %s' % (hits.sum(), scene.normals(points[:1])[0].round(3)))
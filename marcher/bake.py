@@ -0,0 +1,223 @@
+# bake.py
+# Static objects sampled once into a sparse 3D texture of distance bricks, the DE
+# then looks them up in constant time instead of evaluating every primitive
+import hashlib
+import os
+
+import numpy as np
+
+from . import cpu
+from .march import Function, Primitive, Object, Var, vec, vec3
+
+# Offset of the finite differences in normal(), bricks this close to the surface are kept
+NORMAL_OFFSET = 0.01
+
+
+# Samplers for the atlas and index textures are declared ahead of the function,
+# volumes holds their data by sampler name for the camera to upload
+class Baked(Primitive):
+    def __init__(self, fn, dependencies):
+        super().__init__(fn, dependencies)
+        self.volumes = {}
+
+    def read_body(self):
+        return self.fn.__doc__
+
+    def gen_source(self):
+        samplers = ''.join('uniform sampler3D %s;\n' % name for name in self.volumes)
+        return samplers + super().gen_source()
+
+    def fingerprint(self):
+        return ' '.join(sorted(self.volumes)) + '\n' + super().fingerprint()
+
+
+# Whether value reads a Var besides the names bound around it, eg. iTime. Scenes can
+# nest deeper than the recursion limit so the tree is walked with a stack
+def dynamic(value, bound):
+    stack = [(value, bound)]
+    objects = set()
+    while stack:
+        value, bound = stack.pop()
+        if isinstance(value, Var):
+            if value.name not in bound:
+                return True
+        elif isinstance(value, vec):
+            stack.extend((f, bound) for f in value.floats)
+        elif isinstance(value, Function.Call):
+            stack.extend((arg, bound) for arg in value.args)
+            # Combinators only have the methods of the same name
+            for part in (getattr(value, 'location', None), getattr(value, 'f', None)):
+                if isinstance(part, (Var, vec, Function.Call)):
+                    stack.append((part, bound))
+            fn = Function.registry[value.name]
+            if isinstance(fn, Object) and fn.name not in objects:
+                objects.add(fn.name)
+                fn.evaluate()
+                stack.extend((line, fn.params) for _, line in fn.lines)
+    return False
+
+
+def sample(call, points):
+    # Standalone as in the DE macro, whatever res the object is handed in the scene
+    d = cpu.Evaluator().value(call, {'p': points, 'res': 1e20})
+    return np.broadcast_to(d, points.shape[:-1])
+
+
+# Hash of the generated source of the subtree and everything it uses
+def subtree_key(call, settings):
+    names = set()
+    for name in call.get_usage():
+        names.update(Function.registry[name].resolve())
+    text = str(call) + ''.join(str(Function.registry[name]) for name in sorted(names)) + repr(settings)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def grid(lo, hi, resolution, brick):
+    h = (hi - lo).max() / resolution
+    # Room around the bounds so the distance is positive on every side of the grid
+    margin = 3 * h + NORMAL_OFFSET
+    counts = np.ceil((hi - lo + 2 * margin) / (h * brick)).astype(int)
+    origin = (lo + hi) / 2 - counts * brick * h / 2
+    return origin, h, counts
+
+
+def brick_indices(counts):
+    return np.stack(np.meshgrid(*[np.arange(c) for c in counts], indexing='ij'), -1).reshape(-1, 3)
+
+
+# Distances at the corners of the cells of every brick the surface can be near, packed
+# into an atlas, and an index of where each brick went or -1 with its center distance
+def build(call, lo, hi, resolution, brick, max_bytes):
+    side = brick + 1
+    while True:
+        origin, h, counts = grid(lo, hi, resolution, brick)
+        bricks = brick_indices(counts)
+        center = sample(call, origin + (bricks + 0.5) * brick * h)
+        reach = np.sqrt(3) / 2 * brick * h
+        active = np.abs(center) <= reach + 2 * h + NORMAL_OFFSET
+        # Half floats per corner
+        if active.sum() * side ** 3 * 2 <= max_bytes or resolution <= brick:
+            break
+        resolution //= 2
+
+    found = bricks[active]
+    count = len(found)
+    per = max(int(np.ceil(count ** (1 / 3))), 1)
+    shape = np.array([per, per, max(-(-count // per ** 2), 1)])
+    slots = np.stack([np.arange(count) % per, np.arange(count) // per % per, np.arange(count) // per ** 2], -1)
+
+    corners = brick_indices((side, side, side))
+    values = np.empty((count, side ** 3), np.float16)
+    # Bounded batches so fine grids don't hold every point at once
+    for start in range(0, count, 1024):
+        points = origin + ((found[start:start + 1024, None, :] * brick + corners[None]) * h)
+        values[start:start + 1024] = sample(call, points.reshape(-1, 3)).reshape(-1, side ** 3)
+    # Corners went x, y, z slowest first, textures want x fastest
+    values = values.reshape(count, side, side, side).transpose(0, 3, 2, 1)
+    atlas = np.zeros((shape[2], shape[1], shape[0], side, side, side), np.float16)
+    atlas[slots[:, 2], slots[:, 1], slots[:, 0]] = values
+    atlas = atlas.transpose(0, 3, 1, 4, 2, 5).reshape(shape[::-1] * side)
+
+    index = np.zeros((counts[2], counts[1], counts[0], 4), np.float32)
+    index[..., 0] = -1
+    index[..., 3] = center.reshape(counts).transpose(2, 1, 0)
+    index[found[:, 2], found[:, 1], found[:, 0], :3] = slots
+    return {'atlas': atlas, 'index': index, 'origin': origin, 'h': h, 'brick': brick,
+            'resolution': resolution}
+
+
+def glsl_vec3(values):
+    return 'vec3(%s)' % ','.join(repr(float(v)) for v in values)
+
+
+def body(name, baked):
+    origin, h, brick = baked['origin'], baked['h'], baked['brick']
+    counts = np.array(baked['index'].shape[2::-1])
+    return """
+    vec3 q = clamp(p, {lo}, {hi});
+    float outside = length(p - q);
+    // Cells from the corner of the grid and the brick they are in
+    vec3 u = (q - {lo}) / {h};
+    vec3 brick = min(floor(u / {brick}), {last});
+    vec4 entry = texture3D({name}_index, (brick + 0.5) / {counts});
+    float d;
+    if (entry.x < 0.0) {{
+        // Far from the surface, the center distance still bounds the whole brick
+        d = sign(entry.w) * (abs(entry.w) - length(q - ({lo} + (brick + 0.5) * {brick} * {h})));
+    }} else {{
+        vec3 texel = entry.xyz * {side} + u - brick * {brick} + 0.5;
+        d = texture3D({name}_atlas, texel / {atlas}).x;
+    }}
+    // The surface is inside the grid, so at least as far as it outside
+    return outside > 0.0 ? max(outside, d - outside) : d;
+""".format(lo=glsl_vec3(origin), hi=glsl_vec3(origin + counts * brick * h), h=repr(float(h)),
+           brick=repr(float(brick)), last=glsl_vec3(counts - 1), counts=glsl_vec3(counts),
+           side=repr(float(brick + 1)), name=name, atlas=glsl_vec3(baked['atlas'].shape[::-1]))
+
+
+def load(path):
+    try:
+        with np.load(path) as data:
+            baked = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+    os.utime(path)
+    baked['h'], baked['brick'], baked['resolution'] = float(baked['h']), int(baked['brick']), int(baked['resolution'])
+    return baked
+
+
+def store(path, baked):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename like the shader cache, np.savez adds the extension itself
+        tmp = path[:-len('.npz')] + '.%d' % os.getpid()
+        np.savez(tmp, **baked)
+        os.replace(tmp + '.npz', path)
+    except OSError as e:
+        print('Could not write bake cache:', e)
+
+
+# A primitive that samples call, a partial Object call, from a texture instead. resolution
+# is the number of cells along the longest side of bounds, halved until the bricks fit in
+# max_bytes, and brick the cells per brick side. Bounds are found for objects that combine
+# bounded primitives with Union, Intersect and Subtract. Bakes are kept next to the shader
+# cache, cache=False skips that and a path uses another directory. Objects that read a Var
+# such as iTime change over time and are returned as they were
+def bake(call, resolution=128, bounds=None, brick=8, max_bytes=32 * 2**20, cache=True):
+    # Baked around its own origin, the result goes where call was placed
+    source = call.__class__(call.name, call.args.copy(), None, None)(Var('p'))
+    if dynamic(source, ('p', 'res')):
+        return call
+    if bounds is None:
+        from .optimize import Optimizer, standalone_bounds
+        fn = Function.registry[call.name]
+        bounds = standalone_bounds(fn, Optimizer(fn))
+        assert bounds, "Could not find bounds for %r, pass bounds=(lo, hi)" % call.name
+    lo, hi = np.asarray(bounds[0], float), np.asarray(bounds[1], float)
+
+    key = subtree_key(source, (list(lo), list(hi), resolution, brick, max_bytes))
+    name = 'Baked_' + key[:16]
+    if name not in Function.registry:
+        if cache is True:
+            from .cache import default_directory
+            cache = default_directory()
+        path = os.path.join(cache, key + '.npz') if cache else None
+        baked = load(path) if path else None
+        if baked is None:
+            baked = build(source, lo, hi, resolution, brick, max_bytes)
+            if path:
+                store(path, baked)
+
+        def sampler(p: vec3): pass
+        sampler.__name__ = sampler.__qualname__ = name
+        sampler.__doc__ = body(name, baked)
+        Baked.register()(sampler)
+        fn = Function.registry[name]
+        fn.volumes = {name + '_atlas': baked['atlas'], name + '_index': baked['index']}
+        fn.resolution = baked['resolution']
+
+        # The CPU and the optimizer keep using the exact subtree
+        from .optimize import bounds as primitive_bounds
+        cpu.kernels[name] = lambda p: sample(source, p)
+        primitive_bounds[name] = lambda: (list(lo), list(hi))
+    return Function.registry[name]._call(at=call.location, f=call.f)
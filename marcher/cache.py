@@ -0,0 +1,188 @@
+# cache.py
+# Reuse generated shaders and linked program binaries across views and launches
+import ctypes
+import hashlib
+import os
+import struct
+import time
+
+
+def default_directory():
+    return os.environ.get('MARCHER_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'marcher'))
+
+
+def remove(path):
+    # Another process sharing the directory may have got there first
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_generator = None
+
+
+# Hash of the modules that generate sources, an upgrade invalidates everything
+# they wrote before
+def generator_version():
+    global _generator
+    if _generator is None:
+        package = os.path.dirname(__file__)
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(package)):
+            if name.endswith('.py'):
+                with open(os.path.join(package, name), 'rb') as f:
+                    digest.update(f.read())
+        _generator = digest.hexdigest()
+    return _generator
+
+
+class ShaderCache:
+    def __init__(self, directory=None, max_bytes=256 * 2**20, max_age=30 * 24 * 3600):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # In process only, object names can't be registered twice so a name and
+        # its camera settings always generate the same source
+        self.sources = {}
+        # Bytes of binaries stored since the directory was last evicted, None before
+        # the first eviction of the session
+        self.written = None
+
+    # Sources are also kept on disk so repeat launches skip generating them, keyed
+    # on everything they are generated from rather than on the object's name
+    def source(self, obj, settings, generate, persist=True):
+        key = (obj.name, settings)
+        if key not in self.sources:
+            path = self.path(self.source_key(obj, settings), '.glsl') if persist else None
+            shader = self.read(path) if path else None
+            if shader is not None:
+                self.sources[key] = (shader, None)
+            else:
+                self.sources[key] = generate()
+                if path:
+                    self.write(path, self.sources[key][0].encode())
+        return self.sources[key]
+
+    @staticmethod
+    def source_key(obj, settings):
+        from .march import Function
+        digest = hashlib.sha256((generator_version() + repr(settings)).encode())
+        for name in obj.resolve():
+            digest.update(Function.registry[name].fingerprint().encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def read(path):
+        try:
+            with open(path) as f:
+                data = f.read()
+        except OSError:
+            return None
+        os.utime(path)
+        return data
+
+    @staticmethod
+    def supported():
+        from . import gl
+        return gl.glGetIntegerv(gl.GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+    @staticmethod
+    def key(source):
+        # Binaries only load on the driver that produced them
+        from . import gl
+        driver = b''.join(gl.glGetString(name) or b'' for name in (gl.GL_VENDOR, gl.GL_RENDERER, gl.GL_VERSION))
+        return hashlib.sha256(driver + source.encode()).hexdigest()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def load_program(self, source):
+        from . import gl
+        if not self.supported():
+            return None
+        path = self.path(self.key(source), '.bin')
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        binary_format, = struct.unpack('<I', data[:4])
+
+        program = gl.glCreateProgram()
+        gl.glProgramBinary(program, binary_format, data[4:], len(data) - 4)
+        if not gl.glGetProgramiv(program, gl.GL_LINK_STATUS):
+            # Driver changed underneath us, relink from source
+            gl.glDeleteProgram(program)
+            remove(path)
+            return None
+        os.utime(path)
+        return program
+
+    def store_program(self, source, program):
+        from . import gl
+        if not self.supported():
+            return
+        length = gl.glGetProgramiv(program, gl.GL_PROGRAM_BINARY_LENGTH)
+        if not length:
+            return
+        binary = (ctypes.c_ubyte * length)()
+        written = gl.GLint()
+        binary_format = gl.GLenum()
+        gl.glGetProgramBinary(program, length, written, binary_format, binary)
+
+        data = struct.pack('<I', binary_format.value) + bytes(binary)[:written.value]
+        self.write(self.path(self.key(source), '.bin'), data)
+
+    def write(self, path, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write then rename so concurrent launches never read half a file
+            tmp = path + '.%d' % os.getpid()
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            # A read only cache shouldn't stop anything from rendering
+            print('Could not write shader cache:', e)
+            return
+        # Listing the directory is the slow part, do it once a session and again
+        # only after a sixteenth of the budget has been written
+        if self.written is None or self.written + len(data) > self.max_bytes // 16:
+            self.evict()
+            self.written = 0
+        else:
+            self.written += len(data)
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Least recently used go first
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            remove(path)
+            total -= size
+
+
+_default = None
+
+
+def default_cache():
+    global _default
+    if _default is None:
+        _default = ShaderCache()
+    return _default
@@ -0,0 +1,158 @@
+# cpu.py
+# Batched NumPy evaluation of compiled scenes, no GL context required
+import numpy as np
+
+from .march import Combinator, Function, Object, Var, vec
+
+# NumPy versions of registered functions, looked up by name
+kernels = {}
+
+
+def kernel(fn):
+    kernels[fn.__name__] = fn
+    return fn
+
+
+def stack(*components):
+    # Build an (..., n) vector out of scalars or per point arrays as in glsl
+    return np.stack(np.broadcast_arrays(*components), axis=-1)
+
+
+def length(v):
+    return np.sqrt(np.sum(v * v, axis=-1))
+
+
+# NumPy version of the registered function name, the one registered with kernel or
+# else its GLSL body translated once by glsl.py. None when the body can't be translated
+def find(name):
+    if name in kernels:
+        return kernels[name]
+    fn = Function.registry.get(name)
+    if fn is None:
+        return None
+    if fn.numpy is None:
+        from .glsl import translate
+        try:
+            fn.numpy = (translate(fn), None)
+        except AssertionError as error:
+            fn.numpy = (None, str(error))
+    return fn.numpy[0]
+
+
+# Names usable inside Var expressions such as 'sin(1.7 * iTime)'
+expression_namespace = {name: getattr(np, name) for name in
+                        ['sin', 'cos', 'tan', 'abs', 'sqrt', 'exp', 'floor', 'sign']}
+expression_namespace.update({'min': np.minimum, 'max': np.maximum, 'pow': np.power})
+
+
+class Evaluator:
+    def __init__(self, **uniforms):
+        self.uniforms = {'iTime': 0.0, 'iMouse': np.zeros(2), **uniforms}
+
+    def distance(self, obj, points):
+        points = np.asarray(points, dtype=float)
+        assert points.shape[-1] == 3, "Points must have shape (N, 3) not %r" % (points.shape,)
+        if isinstance(obj, Object):
+            # Same entry point as the DE macro in the generated shader
+            d = self.evaluate_object(obj, [points, 1e20])
+        else:
+            # Partial primitives and combinator trees still need the point, binding
+            # leaves that already have it leaves them as they are
+            if isinstance(obj, Combinator.Call) or getattr(obj, 'f', True) is None:
+                obj = obj(Var('p'))
+            d = self.value(obj, {'p': points})
+        return np.broadcast_to(d, points.shape[:-1])
+
+    # Calls nest as deep as the scene, so they are evaluated arguments first with a
+    # stack instead of recursing once per level
+    def value(self, arg, env):
+        values = {}
+        args = {}
+        stack = [arg]
+        while stack:
+            item = stack[-1]
+            if id(item) in values:
+                stack.pop()
+            elif not isinstance(item, Function.Call):
+                stack.pop()
+                values[id(item)] = self.leaf(item, env)
+            elif id(item) not in args:
+                # Kept so the calls get_args makes stay alive with their ids
+                args[id(item)] = item.get_args()
+                stack.extend(arg for arg in args[id(item)] if id(arg) not in values)
+            else:
+                stack.pop()
+                values[id(item)] = self.call(item, [values[id(arg)] for arg in args[id(item)]])
+        return values[id(arg)]
+
+    def leaf(self, arg, env):
+        if isinstance(arg, Var):
+            return self.var(arg, env)
+        elif isinstance(arg, vec):
+            return stack(*[self.leaf(f, env) for f in arg.floats])
+        return float(arg)
+
+    def call(self, call, args):
+        fn = Function.registry[call.name]
+        if isinstance(fn, Object):
+            return self.evaluate_object(fn, args)
+        kernel = find(call.name)
+        assert kernel, "%r has no NumPy kernel, register one with marcher.cpu.kernel: %s" % (call.name, fn.numpy[1])
+        return kernel(*args)
+
+    def evaluate_object(self, fn, args):
+        fn.evaluate()
+        env = dict(zip(fn.params, args))
+        for var, value in fn.lines:
+            env[var.name] = self.value(value, env)
+        return env['res']
+
+    def var(self, var, env):
+        if var.name in env:
+            return env[var.name]
+        # Anything else is an inline glsl expression over the uniforms
+        return eval(var.name, {'__builtins__': {}}, {**expression_namespace, **self.uniforms})
+
+
+def distance(obj, points, **uniforms):
+    return Evaluator(**uniforms).distance(obj, points)
+
+
+# Distance, ray and normal queries on whole arrays, same as raymarch and normal in the blueprint
+class Scene:
+    def __init__(self, obj, max_steps=100, max_distance=100.0, min_distance=0.001, **uniforms):
+        self.obj = obj
+        self.evaluator = Evaluator(**uniforms)
+        self.max_steps = max_steps
+        self.max_distance = max_distance
+        self.min_distance = min_distance
+
+    def distance(self, points):
+        return self.evaluator.distance(self.obj, points)
+
+    # Distance along every ray to its hit, at least max_distance for misses, and the steps
+    # it took. Rays that hit or left the scene drop out so later steps only evaluate the rest
+    def raycast(self, origins, directions):
+        origins, directions = np.broadcast_arrays(np.asarray(origins, float), np.asarray(directions, float))
+        origins, directions = origins.reshape(-1, 3), directions.reshape(-1, 3)
+        directions = directions / length(directions)[:, None]
+        t = np.zeros(len(origins))
+        steps = np.zeros(len(origins), int)
+        active = np.arange(len(origins))
+        for _ in range(self.max_steps):
+            if not len(active):
+                break
+            d = self.distance(origins[active] + directions[active] * t[active, None])
+            t[active] += d
+            steps[active] += 1
+            active = active[(t[active] <= self.max_distance) & (d >= self.min_distance)]
+        return t, steps
+
+    def normals(self, points):
+        points = np.asarray(points, float).reshape(-1, 3)
+        e = 0.01
+        # The point and its three offsets in one batch
+        offsets = np.array([[0, 0, 0], [e, 0, 0], [0, e, 0], [0, 0, e]])
+        d = self.distance((points[None] - offsets[:, None]).reshape(-1, 3)).reshape(4, -1)
+        n = d[0][:, None] - d[1:].T
+        return n / np.maximum(length(n), 1e-12)[:, None]
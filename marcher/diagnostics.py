@@ -0,0 +1,48 @@
+# diagnostics.py
+# Per pixel march cost of a scene, summarized and drawn as heatmaps
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(values):
+    summary = {'mean': float(values.mean()), 'max': float(values.max())}
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary['p%d' % q] = float(value)
+    return summary
+
+
+# Same ramp as the heatmap entry point of the blueprint, blue to red
+def heat(x):
+    x = np.clip(x, 0.0, 1.0)[..., None]
+    return np.clip(1.5 - np.abs(4.0 * x - np.array([3.0, 2.0, 1.0])), 0.0, 1.0)
+
+
+# (height, width, 3) uint8 image of counts on a log scale up to scale, the largest count by default
+def heatmap(values, scale=None):
+    scale = values.max() if scale is None else scale
+    x = np.log1p(values) / np.log1p(max(scale, 1))
+    return (heat(x) * 255).astype(np.uint8)
+
+
+class Cost:
+    def __init__(self, frame, max_steps, max_distance):
+        # Copied out of the camera's buffer so the next render doesn't overwrite them
+        self.steps = frame[:, :, 0].copy()
+        self.evaluations = frame[:, :, 1].copy()
+        self.distance = frame[:, :, 2].copy()
+        self.max_steps = max_steps
+        self.max_distance = max_distance
+
+    # Pixels whose ray ran out of steps before hitting or leaving the scene
+    def exhausted(self):
+        return self.steps >= self.max_steps
+
+    def summary(self):
+        return {'steps': summarize(self.steps),
+                'evaluations': summarize(self.evaluations),
+                'exhausted': float(self.exhausted().mean()),
+                'hits': float((self.distance < self.max_distance).mean())}
+
+    def heatmap(self, field='evaluations', scale=None):
+        return heatmap(getattr(self, field), scale)
@@ -0,0 +1,77 @@
+# gl.py
+# OpenGL for the backends that draw, the DSL and code generation never import it
+import os
+import sys
+from ctypes import byref, c_int, create_string_buffer
+
+# Without a display fall back to EGL so frames can still be rendered offscreen
+if sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+from OpenGL.GL import *
+
+
+def print_log(shader):
+    length = c_int()
+    glGetShaderiv(shader, GL_INFO_LOG_LENGTH, byref(length))
+
+    if length.value > 0:
+        log = create_string_buffer(length.value)
+        print(glGetShaderInfoLog(shader))
+
+
+# timed(stage) is a context manager around the driver's work, see Camera.timed
+def compile_shader(source, shader_type, timed):
+    shader = glCreateShader(shader_type)
+    glShaderSource(shader, source)
+    with timed('compile'):
+        glCompileShader(shader)
+
+    status = c_int()
+    glGetShaderiv(shader, GL_COMPILE_STATUS, byref(status))
+    if not status.value:
+        print_log(shader)
+        glDeleteShader(shader)
+        raise ValueError('Shader compilation failed')
+    return shader
+
+
+# retrievable asks the driver to keep the binary around for the shader cache
+def link_program(source, retrievable, timed):
+    program = glCreateProgram()
+    if retrievable:
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+
+    fragment_shader = compile_shader(source, GL_FRAGMENT_SHADER, timed)
+    glAttachShader(program, fragment_shader)
+
+    with timed('link'):
+        glLinkProgram(program)
+    glDeleteShader(fragment_shader)
+
+    status = c_int()
+    glGetProgramiv(program, GL_LINK_STATUS, byref(status))
+    if not status.value:
+        print(glGetProgramInfoLog(program))
+        glDeleteProgram(program)
+        raise ValueError('Program linking failed')
+    return program
+
+
+# Values of a Uniforms the program hasn't seen yet
+def upload(uniforms, program):
+    if program not in uniforms.locations:
+        uniforms.locations[program] = {name: glGetUniformLocation(program, name)
+                                       for name in list(uniforms.statics) + [uniforms.array]}
+    if uniforms.uploaded.get(program) == uniforms.version:
+        return
+    locations = uniforms.locations[program]
+    if uniforms.values:
+        glUniform1fv(locations[uniforms.array], len(uniforms.values), uniforms.values)
+    for name, value in uniforms.statics.items():
+        if hasattr(value, 'floats'):
+            [glUniform1fv, glUniform2fv, glUniform3fv, glUniform4fv][value.dim - 1](
+                locations[name], 1, value.floats)
+        else:
+            glUniform1f(locations[name], value)
+    uniforms.uploaded[program] = uniforms.version
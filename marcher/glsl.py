@@ -0,0 +1,340 @@
+# glsl.py
+# Registered GLSL bodies translated into NumPy functions over arrays of points. Floats
+# are arrays of any shape and vecs have their components in a last axis, as in cpu.py.
+# Covers straight line bodies: declarations, assignments and a return of arithmetic,
+# swizzles, constructors, calls to other registered functions and the builtins below.
+# Parser reads the bodies, gradient.py emits their derivatives from it as well
+import keyword
+import re
+
+import numpy as np
+
+from . import cpu
+from .march import Function, make_param
+
+WIDTHS = {'float': 1, 'int': 1, 'bool': 1, 'vec2': 2, 'vec3': 3, 'vec4': 4}
+SWIZZLES = ['xyzw', 'rgba', 'stpq']
+
+TOKEN = re.compile(r'\s*(?:(?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)[fF]?|(?P<name>[A-Za-z_]\w*)|'
+                   r'(?P<op>\+=|-=|\*=|/=|==|!=|<=|>=|&&|\|\||[-+*/<>=!?:;,.()\[\]{}]))')
+LITERAL = re.compile(r'[\d.]+(e[-+]?\d+)?$')
+COMMENT = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+
+# Binary operators from the loosest to the tightest
+BINARY = [['||'], ['&&'], ['==', '!='], ['<', '>', '<=', '>='], ['+', '-'], ['*', '/']]
+LOGICAL = {'||': 'np.logical_or', '&&': 'np.logical_and'}
+
+
+def widen(x):
+    # A float next to a vec applies to each component
+    return np.expand_dims(x, -1)
+
+
+def splat(x, n):
+    return np.repeat(widen(x), n, -1)
+
+
+def components(v):
+    return np.moveaxis(v, -1, 0)
+
+
+def clamp(x, lo, hi):
+    return np.minimum(np.maximum(x, lo), hi)
+
+
+def mix(a, b, t):
+    return a + (b - a) * t
+
+
+def step(edge, x):
+    return np.where(x < edge, 0.0, 1.0)
+
+
+def smoothstep(lo, hi, x):
+    t = clamp((x - lo) / (hi - lo), 0.0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+
+def fract(x):
+    return x - np.floor(x)
+
+
+def atan(y, x=None):
+    return np.arctan(y) if x is None else np.arctan2(y, x)
+
+
+# Builtins of components, the result is as wide as the widest argument
+ELEMENTWISE = {'abs': 'np.abs', 'sign': 'np.sign', 'floor': 'np.floor', 'ceil': 'np.ceil', 'fract': 'fract',
+               'sqrt': 'np.sqrt', 'exp': 'np.exp', 'log': 'np.log', 'sin': 'np.sin', 'cos': 'np.cos',
+               'tan': 'np.tan', 'asin': 'np.arcsin', 'acos': 'np.arccos', 'atan': 'atan',
+               'radians': 'np.radians', 'degrees': 'np.degrees', 'pow': 'np.power', 'mod': 'np.mod',
+               'min': 'np.minimum', 'max': 'np.maximum', 'clamp': 'clamp', 'mix': 'mix', 'step': 'step',
+               'smoothstep': 'smoothstep'}
+
+namespace = {'np': np, 'stack': cpu.stack, 'length': cpu.length, 'widen': widen, 'splat': splat,
+             'components': components, 'clamp': clamp, 'mix': mix, 'step': step, 'smoothstep': smoothstep,
+             'fract': fract, 'atan': atan}
+
+
+def tokenize(body):
+    body = COMMENT.sub(' ', body).strip()
+    tokens = []
+    at = 0
+    while at < len(body):
+        match = TOKEN.match(body, at)
+        assert match and match.end() > at, "Can't read %r" % body[at:at + 20]
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        at = match.end()
+        while at < len(body) and body[at].isspace():
+            at += 1
+    return tokens
+
+
+# Reads the statements and expressions of fn's body and hands every one of them to the
+# methods a subclass fills in. Values are (code, type) pairs whatever code is
+class Parser:
+    def __init__(self, fn):
+        self.fn = fn
+        self.tokens = tokenize(fn.body) + [(None, None)]
+        self.at = 0
+        # GLSL name to the value it holds
+        self.scope = {}
+        self.lines = []
+
+    def peek(self):
+        return self.tokens[self.at][1]
+
+    def take(self, expected=None):
+        kind, token = self.tokens[self.at]
+        assert expected is None or token == expected, "Expected %r, found %r" % (expected, token)
+        self.at += 1
+        return token
+
+    def unsupported(self, what):
+        assert False, "Unsupported GLSL %r" % what
+
+    def parse(self):
+        while self.peek() is not None:
+            self.statement()
+
+    def statement(self):
+        token = self.take()
+        if token == 'const':
+            token = self.take()
+        if token in WIDTHS:
+            kind = 'float' if token == 'int' else token
+            while True:
+                name = self.take()
+                value = None
+                if self.peek() == '=':
+                    self.take()
+                    value = self.cast(self.expression(), kind)
+                self.define(name, kind, value)
+                if self.take() != ',':
+                    break
+            self.at -= 1
+        elif token == 'return':
+            self.returns(self.cast(self.expression(), make_param(self.fn.return_type)))
+        elif token in self.scope and self.peek() in ('=', '+=', '-=', '*=', '/='):
+            kind = self.scope[token][1]
+            op = self.take()
+            value = self.expression()
+            if op != '=':
+                value = self.binary(op[0], self.scope[token], value)
+            self.assign(token, self.cast(value, kind))
+        else:
+            self.unsupported(token)
+        self.take(';')
+
+    def expression(self):
+        condition = self.binaries(0)
+        if self.peek() != '?':
+            return condition
+        self.take()
+        a = self.expression()
+        self.take(':')
+        b = self.expression()
+        return self.ternary(condition, a, b)
+
+    def binaries(self, level):
+        if level == len(BINARY):
+            return self.unary()
+        left = self.binaries(level + 1)
+        while self.peek() in BINARY[level]:
+            op = self.take()
+            left = self.binary(op, left, self.binaries(level + 1))
+        return left
+
+    def unary(self):
+        if self.peek() in ('-', '+', '!'):
+            op = self.take()
+            value = self.unary()
+            if op == '!':
+                return self.logical_not(value)
+            return self.negate(value) if op == '-' else value
+        return self.postfix()
+
+    def postfix(self):
+        value = self.primary()
+        while self.peek() in ('.', '['):
+            kind = value[1]
+            if self.take() == '.':
+                fields = self.take()
+                names = next((names for names in SWIZZLES if fields[0] in names), '')
+                index = [names.find(field) for field in fields]
+            else:
+                index = [int(self.take())]
+                self.take(']')
+            assert WIDTHS[kind] > 1 and 0 <= min(index) and max(index) < WIDTHS[kind], \
+                "No component %r in a %s" % (index, kind)
+            value = self.swizzle(value, index)
+        return value
+
+    def primary(self):
+        kind, token = self.tokens[self.at]
+        self.take()
+        if kind == 'number':
+            return self.number(token)
+        elif token in ('true', 'false'):
+            return self.boolean(token == 'true')
+        elif token == '(':
+            value = self.expression()
+            self.take(')')
+            return value
+        elif kind == 'name' and self.peek() == '(':
+            self.take()
+            args = []
+            while self.peek() != ')':
+                args.append(self.expression())
+                if self.peek() == ',':
+                    self.take()
+            self.take(')')
+            return self.call(token, args)
+        elif token in self.scope:
+            assert self.scope[token][0] is not None, "%r is read before it is set" % token
+            return self.scope[token]
+        self.unsupported(token)
+
+
+class Translator(Parser):
+    def __init__(self, fn):
+        super().__init__(fn)
+        # Registered functions the body calls, bound into the namespace of the kernel
+        self.calls = {}
+        # GLSL names to python names
+        self.names = {}
+
+    def declare(self, name, kind):
+        python = name
+        if keyword.iskeyword(name) or name in namespace or name in Function.registry:
+            python = name + '_'
+        self.names[name] = python
+        self.scope[name] = (python, kind)
+        return python
+
+    def translate(self):
+        params = [self.declare(name, make_param(kind)) for name, kind in self.fn.params.items()]
+        self.parse()
+        source = 'def %s(%s):\n' % (self.fn.name, ', '.join(params))
+        source += ''.join('    %s\n' % line for line in self.lines)
+        scope = dict(namespace, **self.calls)
+        exec(compile(source, '<glsl %s>' % self.fn.name, 'exec'), scope)
+        kernel = scope[self.fn.name]
+        kernel.source = source
+        return kernel
+
+    def define(self, name, kind, value):
+        python = self.declare(name, kind)
+        if value:
+            self.lines.append('%s = %s' % (python, value[0]))
+
+    def assign(self, name, value):
+        self.lines.append('%s = %s' % (self.names[name], value[0]))
+
+    def returns(self, value):
+        self.lines.append('return ' + value[0])
+
+    # value as a kind, floats are spread over the components of a vec
+    def cast(self, value, kind):
+        code, have = value
+        if have == kind:
+            return value
+        assert have == 'float', "Can't assign a %s to a %s" % (have, kind)
+        return 'splat(%s, %d)' % (code, WIDTHS[kind]), kind
+
+    def ternary(self, condition, a, b):
+        kind, (a, b) = self.promote([a, b])
+        # A float condition picks whole vecs
+        condition = condition[0] if WIDTHS[kind] == 1 else 'widen(%s)' % condition[0]
+        return 'np.where(%s, %s, %s)' % (condition, a, b), kind
+
+    def binary(self, op, left, right):
+        if op in LOGICAL:
+            return '%s(%s, %s)' % (LOGICAL[op], left[0], right[0]), 'bool'
+        kind, (a, b) = self.promote([left, right])
+        if op in BINARY[2] + BINARY[3]:
+            kind = 'bool'
+        return '(%s %s %s)' % (a, op, b), kind
+
+    # Widest type of values and their code with floats widened to it
+    def promote(self, values):
+        kind = max((value[1] for value in values), key=lambda kind: WIDTHS[kind])
+        if WIDTHS[kind] == 1:
+            return kind, [code for code, _ in values]
+        # Literals broadcast as they are
+        return kind, [code if have == kind or LITERAL.match(code) else 'widen(%s)' % code for code, have in values]
+
+    def negate(self, value):
+        return '(-%s)' % value[0], value[1]
+
+    def logical_not(self, value):
+        return 'np.logical_not(%s)' % value[0], 'bool'
+
+    def swizzle(self, value, index):
+        kind = 'float' if len(index) == 1 else 'vec%d' % len(index)
+        return '%s[..., %s]' % (value[0], index[0] if len(index) == 1 else index), kind
+
+    def number(self, token):
+        return repr(float(token)), 'float'
+
+    def boolean(self, value):
+        return str(value), 'bool'
+
+    def call(self, name, args):
+        codes = [code for code, _ in args]
+        if name in ('vec2', 'vec3', 'vec4'):
+            width = WIDTHS[name]
+            if len(args) == 1 and args[0][1] == 'float':
+                return 'splat(%s, %d)' % (codes[0], width), name
+            if len(args) == 1 and args[0][1] == name:
+                return codes[0], name
+            assert sum(WIDTHS[kind] for _, kind in args) == width, "Wrong number of components for %s" % name
+            parts = [code if kind == 'float' else '*components(%s)' % code for code, kind in args]
+            return 'stack(%s)' % ', '.join(parts), name
+        elif name in ('float', 'int'):
+            return codes[0], 'float'
+        elif name in ELEMENTWISE:
+            kind, codes = self.promote(args)
+            return '%s(%s)' % (ELEMENTWISE[name], ', '.join(codes)), kind
+        elif name == 'length':
+            return 'length(%s)' % codes[0], 'float'
+        elif name == 'distance':
+            return 'length(%s - %s)' % tuple(codes), 'float'
+        elif name == 'dot':
+            return 'np.sum(%s * %s, axis=-1)' % tuple(codes), 'float'
+        elif name == 'normalize':
+            return '(%s / widen(length(%s)))' % (codes[0], codes[0]), args[0][1]
+        elif name == 'cross':
+            return 'np.cross(%s, %s)' % tuple(codes), 'vec3'
+        elif name in Function.registry:
+            kernel = cpu.find(name)
+            assert kernel, "%r calls %r which has no NumPy kernel" % (self.fn.name, name)
+            self.calls[name] = kernel
+            return '%s(%s)' % (name, ', '.join(codes)), make_param(Function.registry[name].return_type)
+        self.unsupported(name)
+
+
+# NumPy function of the same arguments as fn's GLSL body, kernel.source holds its code
+def translate(fn):
+    return Translator(fn).translate()
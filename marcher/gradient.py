@@ -0,0 +1,389 @@
+# gradient.py
+# Forward mode derivatives of registered functions in GLSL, so DE_grad returns the
+# distance of a scene and its gradient from one evaluation instead of normal()
+# taking differences of four. A dual number is a vec4 of a value and its derivatives
+# along x, y and z, a dual vec is a mat4 with one component in each column.
+# Bodies the differentiator can't read, eg. with an if or a texture lookup, get a
+# version that takes finite differences of the original function instead
+from .glsl import BINARY, WIDTHS, Parser
+from .march import Combinator, Function, Object, Var, literal, make_param
+
+# Step of the finite differences for bodies that can't be differentiated
+STEP = 0.001
+
+# Dual versions of the builtins, derivatives are taken where the builtin is smooth
+HELPERS = """
+mat4 dpoint(vec3 p) { return mat4(vec4(p.x, 1.0, 0.0, 0.0), vec4(p.y, 0.0, 1.0, 0.0), vec4(p.z, 0.0, 0.0, 1.0), vec4(0.0)); }
+vec4 dmul(vec4 a, vec4 b) { return vec4(a.x * b.x, a.x * b.yzw + b.x * a.yzw); }
+vec4 ddiv(vec4 a, vec4 b) { return vec4(a.x / b.x, (a.yzw * b.x - a.x * b.yzw) / (b.x * b.x)); }
+vec4 dabs(vec4 a) { return a.x < 0.0 ? -a : a; }
+vec4 dsign(vec4 a) { return vec4(sign(a.x), 0.0, 0.0, 0.0); }
+vec4 dfloor(vec4 a) { return vec4(floor(a.x), 0.0, 0.0, 0.0); }
+vec4 dceil(vec4 a) { return vec4(ceil(a.x), 0.0, 0.0, 0.0); }
+vec4 dfract(vec4 a) { return vec4(fract(a.x), a.yzw); }
+vec4 dsqrt(vec4 a) { float s = sqrt(a.x); return vec4(s, s > 0.0 ? a.yzw / (2.0 * s) : vec3(0.0)); }
+vec4 dexp(vec4 a) { float e = exp(a.x); return vec4(e, e * a.yzw); }
+vec4 dlog(vec4 a) { return vec4(log(a.x), a.yzw / a.x); }
+vec4 dsin(vec4 a) { return vec4(sin(a.x), cos(a.x) * a.yzw); }
+vec4 dcos(vec4 a) { return vec4(cos(a.x), -sin(a.x) * a.yzw); }
+vec4 dtan(vec4 a) { float c = cos(a.x); return vec4(tan(a.x), a.yzw / (c * c)); }
+vec4 dasin(vec4 a) { return vec4(asin(a.x), a.yzw / sqrt(1.0 - a.x * a.x)); }
+vec4 dacos(vec4 a) { return vec4(acos(a.x), -a.yzw / sqrt(1.0 - a.x * a.x)); }
+vec4 datan(vec4 a) { return vec4(atan(a.x), a.yzw / (1.0 + a.x * a.x)); }
+vec4 datan(vec4 y, vec4 x) { return vec4(atan(y.x, x.x), (x.x * y.yzw - y.x * x.yzw) / (x.x * x.x + y.x * y.x)); }
+vec4 dpow(vec4 a, vec4 b) {
+    float p = pow(a.x, b.x);
+    return vec4(p, b.x * pow(a.x, b.x - 1.0) * a.yzw + (a.x > 0.0 ? p * log(a.x) * b.yzw : vec3(0.0)));
+}
+vec4 dmod(vec4 a, vec4 b) { float f = floor(a.x / b.x); return vec4(a.x - b.x * f, a.yzw - b.yzw * f); }
+// Ties keep the first argument, usually the one that varies, so a point on a face
+// still has the face's gradient
+vec4 dmin(vec4 a, vec4 b) { return a.x <= b.x ? a : b; }
+vec4 dmax(vec4 a, vec4 b) { return a.x >= b.x ? a : b; }
+vec4 dclamp(vec4 x, vec4 lo, vec4 hi) { return dmin(dmax(x, lo), hi); }
+vec4 dmix(vec4 a, vec4 b, vec4 t) { return a + dmul(b - a, t); }
+vec4 dstep(vec4 edge, vec4 x) { return vec4(step(edge.x, x.x), 0.0, 0.0, 0.0); }
+vec4 dsmoothstep(vec4 lo, vec4 hi, vec4 x) {
+    vec4 t = dclamp(ddiv(x - lo, hi - lo), vec4(0.0), vec4(1.0, 0.0, 0.0, 0.0));
+    return dmul(dmul(t, t), vec4(3.0, 0.0, 0.0, 0.0) - 2.0 * t);
+}
+// Scaled by the largest component so the derivatives survive when the squares underflow
+vec4 dlength(vec4 a, vec4 b) {
+    float m = max(abs(a.x), abs(b.x));
+    if (m == 0.0) return vec4(0.0);
+    vec2 u = vec2(a.x, b.x) / m;
+    float l = length(u);
+    return vec4(m * l, (u.x * a.yzw + u.y * b.yzw) / l);
+}
+vec4 dlength(vec4 a, vec4 b, vec4 c) {
+    float m = max(abs(a.x), max(abs(b.x), abs(c.x)));
+    if (m == 0.0) return vec4(0.0);
+    vec3 u = vec3(a.x, b.x, c.x) / m;
+    float l = length(u);
+    return vec4(m * l, (u.x * a.yzw + u.y * b.yzw + u.z * c.yzw) / l);
+}
+vec4 dlength(vec4 a, vec4 b, vec4 c, vec4 d) {
+    float m = max(max(abs(a.x), abs(b.x)), max(abs(c.x), abs(d.x)));
+    if (m == 0.0) return vec4(0.0);
+    vec4 u = vec4(a.x, b.x, c.x, d.x) / m;
+    float l = length(u);
+    return vec4(m * l, (u.x * a.yzw + u.y * b.yzw + u.z * c.yzw + u.w * d.yzw) / l);
+}
+"""
+
+# Builtins of components with a dual version above, radians and degrees are linear
+# so the builtin already scales a dual
+BUILTINS = ['abs', 'sign', 'floor', 'ceil', 'fract', 'sqrt', 'exp', 'log', 'sin', 'cos', 'tan', 'asin',
+            'acos', 'atan', 'pow', 'mod', 'min', 'max', 'clamp', 'mix', 'step', 'smoothstep']
+LINEAR = ['radians', 'degrees']
+
+
+# Names of fn's parameters that carry derivatives, the point of primitives, operators
+# and objects and both distances of combinators. The others are constants
+def dual_params(fn):
+    names = list(fn.params)
+    if isinstance(fn, Object):
+        return names[-2:]
+    return names[:2] if isinstance(fn, Combinator) else names[:1]
+
+
+def dual_type(kind):
+    return 'vec4' if WIDTHS[kind] == 1 else 'mat4'
+
+
+# Signature of fn's Name_grad, prefix goes in front of the names of dual parameters
+def signature(fn, prefix=''):
+    duals = dual_params(fn)
+    params = [dual_type(make_param(kind)) + ' ' + prefix + name if name in duals else make_param(kind) + ' ' + name
+              for name, kind in fn.params.items()]
+    return dual_type(make_param(fn.return_type)) + ' ' + fn.name + '_grad(' + ', '.join(params) + ')'
+
+
+# Components are (code, dual) pairs, constants become duals with no derivatives
+def lift(part):
+    return part[0] if part[1] else 'vec4(%s, 0.0, 0.0, 0.0)' % part[0]
+
+
+def value(part):
+    return part[0] + '.x' if part[1] else part[0]
+
+
+# Dual vec of components, padded to the four columns of a mat4
+def columns(parts):
+    return 'mat4(%s)' % ', '.join([lift(part) for part in parts] + ['vec4(0.0)'] * (4 - len(parts)))
+
+
+def arithmetic(op, a, b):
+    if not a[1] and not b[1]:
+        return '(%s %s %s)' % (a[0], op, b[0]), False
+    if op in ('+', '-'):
+        return '(%s %s %s)' % (lift(a), op, lift(b)), True
+    if op == '*':
+        return ('dmul(%s, %s)' if a[1] and b[1] else '(%s * %s)') % (a[0], b[0]), True
+    if not b[1]:
+        return '(%s / %s)' % (a[0], b[0]), True
+    return 'ddiv(%s, %s)' % (lift(a), b[0]), True
+
+
+def builtin(name, parts):
+    codes = [code for code, _ in parts]
+    if not any(dual for _, dual in parts):
+        return '%s(%s)' % (name, ', '.join(codes)), False
+    if name in LINEAR:
+        return '%s(%s)' % (name, codes[0]), True
+    return 'd%s(%s)' % (name, ', '.join(lift(part) for part in parts)), True
+
+
+# Emits GLSL for the dual version of fn's body. Values are split into their
+# components so constants stay floats and only what depends on a dual is a vec4,
+# every assignment gets a new local
+class Differentiator(Parser):
+    def __init__(self, fn):
+        super().__init__(fn)
+        self.count = 0
+
+    def differentiate(self):
+        duals = dual_params(self.fn)
+        for name, kind in self.fn.params.items():
+            kind = make_param(kind)
+            if WIDTHS[kind] == 1:
+                parts = [(name, name in duals)]
+            elif name in duals:
+                parts = [('%s[%d]' % (name, i), True) for i in range(WIDTHS[kind])]
+            else:
+                parts = [('%s.%s' % (name, 'xyzw'[i]), False) for i in range(WIDTHS[kind])]
+            self.scope[name] = (parts, kind)
+        self.parse()
+        return signature(self.fn) + '\n{\n' + ''.join('    %s\n' % line for line in self.lines) + '}'
+
+    def temporary(self, name, kind, parts):
+        names = []
+        for code, dual in parts:
+            self.count += 1
+            local = '_%s%d' % (name, self.count)
+            self.lines.append('%s %s = %s;' % ('vec4' if dual else 'bool' if kind == 'bool' else 'float', local, code))
+            names.append((local, dual))
+        return names
+
+    # Applies op to the components of values side by side, floats spread over vecs
+    @staticmethod
+    def map(op, values):
+        kind = max((kind for _, kind in values), key=WIDTHS.get)
+        spread = [parts * WIDTHS[kind] if len(parts) == 1 else parts for parts, _ in values]
+        return [op(*parts) for parts in zip(*spread)], kind
+
+    def define(self, name, kind, value):
+        self.scope[name] = (self.temporary(name, kind, value[0]) if value else None, kind)
+
+    def assign(self, name, value):
+        self.scope[name] = (self.temporary(name, value[1], value[0]), value[1])
+
+    def returns(self, value):
+        parts, kind = value
+        self.lines.append('return %s;' % (lift(parts[0]) if WIDTHS[kind] == 1 else columns(parts)))
+
+    def cast(self, value, kind):
+        parts, have = value
+        if have == kind:
+            return value
+        assert have == 'float', "Can't assign a %s to a %s" % (have, kind)
+        return parts * WIDTHS[kind], kind
+
+    def ternary(self, condition, a, b):
+        test = condition[0][0][0]
+
+        def select(a, b):
+            if a[1] or b[1]:
+                return '(%s ? %s : %s)' % (test, lift(a), lift(b)), True
+            return '(%s ? %s : %s)' % (test, a[0], b[0]), False
+        return self.map(select, [a, b])
+
+    def binary(self, op, left, right):
+        if op in BINARY[0] + BINARY[1] + BINARY[2] + BINARY[3]:
+            # Conditions compare values, derivatives don't flow through them
+            return [('(%s %s %s)' % (value(left[0][0]), op, value(right[0][0])), False)], 'bool'
+        return self.map(lambda a, b: arithmetic(op, a, b), [left, right])
+
+    def negate(self, value):
+        return [('(-%s)' % code, dual) for code, dual in value[0]], value[1]
+
+    def logical_not(self, value):
+        return [('(!%s)' % value[0][0][0], False)], 'bool'
+
+    def swizzle(self, value, index):
+        return [value[0][i] for i in index], 'float' if len(index) == 1 else 'vec%d' % len(index)
+
+    def number(self, token):
+        return [(repr(float(token)), False)], 'float'
+
+    def boolean(self, value):
+        return [('true' if value else 'false', False)], 'bool'
+
+    def length(self, parts):
+        if len(parts) == 1:
+            return builtin('abs', parts)
+        if not any(dual for _, dual in parts):
+            return 'length(vec%d(%s))' % (len(parts), ', '.join(code for code, _ in parts)), False
+        return 'dlength(%s)' % ', '.join(lift(part) for part in parts), True
+
+    def total(self, parts):
+        result = parts[0]
+        for part in parts[1:]:
+            result = arithmetic('+', result, part)
+        return result
+
+    def call(self, name, args):
+        if name in ('vec2', 'vec3', 'vec4'):
+            parts = [part for value in args for part in value[0]]
+            if len(parts) == 1:
+                parts = parts * WIDTHS[name]
+            assert len(parts) == WIDTHS[name], "Wrong number of components for %s" % name
+            return parts, name
+        elif name in ('float', 'int'):
+            return args[0][0][:1], 'float'
+        elif name in BUILTINS or name in LINEAR:
+            return self.map(lambda *parts: builtin(name, parts), args)
+        elif name == 'length':
+            return [self.length(args[0][0])], 'float'
+        elif name == 'distance':
+            return self.call('length', [self.binary('-', *args)])
+        elif name == 'dot':
+            return [self.total(self.map(lambda a, b: arithmetic('*', a, b), args)[0])], 'float'
+        elif name == 'normalize':
+            parts = self.temporary('v', args[0][1], args[0][0])
+            size = self.temporary('l', 'float', [self.length(parts)])
+            return [arithmetic('/', part, size[0]) for part in parts], args[0][1]
+        elif name == 'cross':
+            a, b = [self.temporary('c', 'vec3', value[0]) for value in args]
+            return [arithmetic('-', arithmetic('*', a[i], b[j]), arithmetic('*', a[j], b[i]))
+                    for i, j in ((1, 2), (2, 0), (0, 1))], 'vec3'
+        elif name in Function.registry:
+            return self.registered(Function.registry[name], args)
+        self.unsupported(name)
+
+    # Name_grad of a registered function, constants can't be passed anything with derivatives
+    def registered(self, fn, args):
+        duals = dual_params(fn)
+        codes = []
+        for (parts, _), (param, kind) in zip(args, fn.params.items()):
+            kind = make_param(kind)
+            parts = parts * WIDTHS[kind] if len(parts) == 1 else parts
+            if param in duals:
+                codes.append(lift(parts[0]) if len(parts) == 1 else columns(parts))
+            else:
+                assert not any(dual for _, dual in parts), \
+                    "%r passes a derivative to %s of %r" % (self.fn.name, param, fn.name)
+                codes.append(parts[0][0] if len(parts) == 1 else
+                             '%s(%s)' % (kind, ', '.join(code for code, _ in parts)))
+        kind = make_param(fn.return_type)
+        code = '%s_grad(%s)' % (fn.name, ', '.join(codes))
+        if WIDTHS[kind] == 1:
+            return [(code, True)], kind
+        self.count += 1
+        local = '_%s%d' % (fn.name, self.count)
+        self.lines.append('mat4 %s = %s;' % (local, code))
+        return [('%s[%d]' % (local, i), True) for i in range(WIDTHS[kind])], kind
+
+
+# Name_grad from finite differences of fn, every component of a dual parameter is
+# nudged on its own and its derivative chained with the ones the parameter carries
+def fallback(fn):
+    duals = dual_params(fn)
+    kind = make_param(fn.return_type)
+    width = WIDTHS[kind]
+    lines = []
+    inputs = []
+    for name, param in fn.params.items():
+        if name not in duals:
+            continue
+        param = make_param(param)
+        if WIDTHS[param] == 1:
+            lines.append('float %s = _d%s.x;' % (name, name))
+            inputs.append((name, '(%s + %r)' % (name, STEP), '_d%s.yzw' % name))
+            continue
+        axes = range(WIDTHS[param])
+        lines.append('%s %s = %s(%s);' % (param, name, param, ', '.join('_d%s[%d].x' % (name, i) for i in axes)))
+        for i in axes:
+            nudge = ', '.join(repr(STEP) if j == i else '0.0' for j in axes)
+            inputs.append((name, '(%s + %s(%s))' % (name, param, nudge), '_d%s[%d].yzw' % (name, i)))
+
+    def evaluate(nudged=None, to=None):
+        return '%s(%s)' % (fn.name, ', '.join(to if name == nudged else name for name in fn.params))
+    lines.append('%s _f = %s;' % (kind, evaluate()))
+    if width == 1:
+        lines.append('vec4 _g = vec4(_f, 0.0, 0.0, 0.0);')
+        for name, nudged, derivatives in inputs:
+            lines.append('_g.yzw += (%s - _f) / %r * %s;' % (evaluate(name, nudged), STEP, derivatives))
+    else:
+        lines.append('mat4 _g = %s;' % columns([('_f.%s' % 'xyzw'[i], False) for i in range(width)]))
+        lines.append('%s _k;' % kind)
+        for name, nudged, derivatives in inputs:
+            lines.append('_k = (%s - _f) / %r;' % (evaluate(name, nudged), STEP))
+            lines += ['_g[%d].yzw += _k.%s * %s;' % (i, 'xyzw'[i], derivatives) for i in range(width)]
+    lines.append('return _g;')
+    return signature(fn, '_d') + '\n{\n' + ''.join('    %s\n' % line for line in lines) + '}'
+
+
+# Appends the dual text of value, an argument of type kind that carries derivatives.
+# Calls in it are written as their Name_grad with a stack like Function.Call.write
+def write(value, kind, out):
+    stack = [(value, kind, True)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        value, kind, dual = item
+        if not dual:
+            out.append(str(value) if isinstance(value, (Function.Call, Var)) else literal(value, ''))
+        elif isinstance(value, Function.Call):
+            fn = Function.registry[value.name]
+            duals = dual_params(fn)
+            parts = [value.name + '_grad(']
+            for i, (arg, (param, param_kind)) in enumerate(zip(value.get_args(), fn.params.items())):
+                if i:
+                    parts.append(',')
+                parts.append((arg, make_param(param_kind), param in duals))
+            parts.append(')')
+            stack.extend(reversed(parts))
+        elif isinstance(value, Var) and value.name in ('p', 'res'):
+            out.append(value.name)
+        else:
+            # Constants and Var expressions such as 'sin(iTime)' have no derivatives
+            code = str(value) if isinstance(value, Var) else literal(value, '')
+            width = WIDTHS[kind]
+            out.append(lift((code, False)) if width == 1 else
+                       columns([('%s.%s' % (code, 'xyzw'[i]), False) for i in range(width)]))
+    return out
+
+
+# Name_grad of an object from its lines, where p and res are duals
+def object_source(obj):
+    obj.evaluate()
+    body = []
+    for var, value in obj.lines:
+        body.append(str(var) + '=')
+        write(value, make_param(obj.params[var.name]), body)
+        body.append(';\n')
+    body.append('return res;')
+    return signature(obj) + '\n{\n' + ''.join(body) + '\n}'
+
+
+# GLSL of fn's Name_grad, differentiated when the body allows it and from finite
+# differences of fn otherwise, with the reason in a comment
+def source(fn):
+    if not fn.gradient or fn.gradient[0] != Function.generation:
+        if isinstance(fn, Object):
+            text = object_source(fn)
+        else:
+            try:
+                text = Differentiator(fn).differentiate()
+            except AssertionError as error:
+                text = '// %s\n%s' % (str(error).replace('\n', ' '), fallback(fn))
+        fn.gradient = (Function.generation, text)
+    return fn.gradient[1]
+
+
+# Dual helpers and Name_grad of every function, in the order they are declared
+def gradients(functions):
+    return HELPERS + ''.join(source(fn) + '\n' for fn in functions)
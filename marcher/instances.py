@@ -0,0 +1,217 @@
+# instances.py
+# Many copies of one primitive placed by NumPy arrays. The copies live in textures next to
+# a uniform grid that lists the ones near every cell, so the DE only evaluates those, and
+# moving them uploads the textures again instead of compiling a new program
+import numpy as np
+
+from . import cpu
+from .bake import Baked
+from .march import Function, Primitive, Object, vec2, vec3
+
+# Row widths of the list and instance textures, powers of two so the shader's
+# divisions of texel indices are exact
+WIDTH = 1024
+ROW = 256
+# Most cells along a side of the grid
+MAX_CELLS = 256
+
+
+# Parameter arrays as a vec with a column per component, for the bounds in optimize.py
+class Columns:
+    def __init__(self, values):
+        self.floats = list(values.T)
+
+
+def next_power(n):
+    return 1 << max(int(np.ceil(np.log2(max(n, 1)))), 0)
+
+
+# values padded to fill rows of width texels of channels each, a power of two of rows
+def rows(values, width):
+    count = max(-(-len(values) // width), 1)
+    height = min(next_power(count), WIDTH)
+    depth = -(-count // height)
+    padded = np.zeros((depth * height * width,) + values.shape[1:], np.float32)
+    padded[:len(values)] = values
+    return padded.reshape((depth, height, width) + values.shape[1:])
+
+
+# Cells of side cell holding the instances whose bounds reach within margin of them, as
+# (start, count) into one list of instance indices sorted by cell
+def grid(lo, hi, cell):
+    margin = cell / 4
+    # Every surface is at least the margin inside the grid
+    origin = lo.min(axis=0) - margin
+    counts = np.maximum(np.ceil((hi.max(axis=0) + margin - origin) / cell), 1).astype(int)
+    first = np.clip(np.floor((lo - margin - origin) / cell).astype(int), 0, counts - 1)
+    last = np.clip(np.floor((hi + margin - origin) / cell).astype(int), 0, counts - 1)
+
+    # Every (instance, cell) pair, enumerated per instance
+    spans = last - first + 1
+    per = spans.prod(axis=1)
+    instance = np.repeat(np.arange(len(lo)), per)
+    offset = np.arange(per.sum()) - np.repeat(np.cumsum(per) - per, per)
+    span = spans[instance]
+    cells = first[instance] + np.stack([offset % span[:, 0], offset // span[:, 0] % span[:, 1],
+                                        offset // (span[:, 0] * span[:, 1])], -1)
+    index = (cells[:, 2] * counts[1] + cells[:, 1]) * counts[0] + cells[:, 0]
+    order = np.argsort(index, kind='stable')
+    count = np.bincount(index, minlength=counts.prod())
+    start = np.cumsum(count) - count
+    return origin, margin, counts, start, count, instance[order]
+
+
+# Sides of the cells when none is given, about one instance per cell but no smaller
+# than most instances so they each land in a few of them
+def cell_size(lo, hi):
+    extent = np.maximum(hi.max(axis=0) - lo.min(axis=0), 1e-6)
+    spacing = (np.prod(extent) / len(lo)) ** (1 / 3)
+    return max(spacing, np.median((hi - lo).max(axis=1)), extent.max() / MAX_CELLS)
+
+
+# Floats of every parameter of kind after p, and the texels an instance takes with its
+# position and scale in the first
+def layout(kind):
+    widths = [{float: 1, vec2: 2, vec3: 3}[t] for t in list(kind.params.values())[1:]]
+    return widths, 1 + -(-sum(widths) // 4)
+
+
+class Instanced(Baked):
+    def __init__(self, fn, dependencies):
+        super().__init__(fn, dependencies)
+        self.version = 0
+        self.positions = None
+        # Scale and parameters as they were given, arrays or a value for all
+        self.given = {'scale': 1.0}
+
+    def __call__(self, at=None, f=None):
+        return self._call(at=at, f=f)
+
+    # New positions, scales or parameters, anything left out stays as it was. Programs
+    # keep running, the pipeline uploads the textures again before its next frame
+    def update(self, positions=None, scale=None, **params):
+        names = list(self.kind.params)[1:]
+        assert set(params) <= set(names), "%r takes %s" % (self.kind.name, ', '.join(names))
+        if positions is not None:
+            self.positions = np.asarray(positions, float).reshape(-1, 3)
+        if scale is not None:
+            self.given['scale'] = np.asarray(scale, float)
+        for name, width in zip(names, self.widths):
+            if name in params:
+                value = np.asarray(params[name], float)
+                self.given[name] = value[..., None] if width == 1 else value
+        assert set(names) <= set(self.given), "%r needs %s" % (self.kind.name, ', '.join(names))
+
+        count = len(self.positions)
+        self.scale = np.broadcast_to(self.given['scale'], (count,))
+        self.values = {name: np.broadcast_to(self.given[name], (count, width)) for name, width in zip(names, self.widths)}
+        self.build()
+        self.version += 1
+
+    def build(self):
+        from .optimize import bounds
+        lo, hi = bounds[self.kind.name](*[value[:, 0] if value.shape[1] == 1 else Columns(value)
+                                          for value in self.values.values()])
+        lo = np.stack(np.broadcast_arrays(*lo), -1) * self.scale[:, None] + self.positions
+        hi = np.stack(np.broadcast_arrays(*hi), -1) * self.scale[:, None] + self.positions
+        cell = self.cell or cell_size(lo, hi)
+        origin, margin, counts, start, count, lists = grid(lo, hi, cell)
+        self.grid = origin, cell, margin, counts, start, count, lists
+
+        data = np.zeros((len(self.positions), self.texels * 4), np.float32)
+        data[:, :3] = self.positions
+        data[:, 3] = self.scale
+        data[:, 4:4 + sum(self.widths)] = np.concatenate(list(self.values.values()), axis=1)
+        data = rows(data.reshape(-1, self.texels, 4), ROW)
+        data = data.reshape(data.shape[:2] + (ROW * self.texels, 4))
+        lists = rows(lists.astype(np.float32), WIDTH)
+        cells = np.zeros((counts[2], counts[1], counts[0], 4), np.float32)
+        cells[..., 0] = start.reshape(counts[::-1])
+        cells[..., 1] = count.reshape(counts[::-1])
+        meta = np.zeros((1, 1, 4, 4), np.float32)
+        meta[0, 0] = [list(origin) + [cell], list(counts) + [margin],
+                      [lists.shape[2], lists.shape[1], lists.shape[0], 0],
+                      [data.shape[2], data.shape[1], data.shape[0], ROW]]
+        self.volumes = {self.name + '_grid': meta, self.name + '_cells': cells,
+                        self.name + '_lists': lists, self.name + '_data': data}
+
+    # Same estimate as the shader for an (N, 3) array of points
+    def distance(self, p):
+        origin, cell, margin, counts, start, count, lists = self.grid
+        shape = p.shape[:-1]
+        p = p.reshape(-1, 3)
+        q = np.clip(p, origin, origin + counts * cell)
+        outside = cpu.length(p - q)
+        c = np.minimum(np.floor((q - origin) / cell), counts - 1).astype(int)
+        corner = origin + c * cell
+        wall = np.minimum(p - corner, corner + cell - p).min(axis=1)
+        d = np.where(outside > 0, outside, wall) + margin
+        index = (c[:, 2] * counts[1] + c[:, 1]) * counts[0] + c[:, 0]
+        first, n = start[index], np.where(outside > 0, 0, count[index])
+        kernel = cpu.find(self.kind.name)
+        for j in range(int(n.max(initial=0))):
+            near = np.nonzero(n > j)[0]
+            i = lists[first[near] + j]
+            s = self.scale[i]
+            args = [value[i, 0] if value.shape[1] == 1 else value[i] for value in self.values.values()]
+            d[near] = np.minimum(d[near], kernel((p[near] - self.positions[i]) / s[:, None], *args) * s)
+        return d.reshape(shape)
+
+
+def body(name, kind, widths, texels):
+    # Components of every parameter after the position and scale texel
+    fields = []
+    offset = 4
+    for width in widths:
+        parts = ['t%d.%s' % (f // 4, 'xyzw'[f % 4]) for f in range(offset, offset + width)]
+        fields.append(parts[0] if width == 1 else 'vec%d(%s)' % (width, ','.join(parts)))
+        offset += width
+    fetches = ''.join('        vec4 t{i} = texture3D({name}_data, (row + vec3({x}, 0.5, 0.5)) / g3.xyz);\n'
+                      .format(i=i, x=i + 0.5, name=name) for i in range(texels))
+    return """
+    vec4 g0 = texture3D({name}_grid, vec3(0.125, 0.5, 0.5));
+    vec4 g1 = texture3D({name}_grid, vec3(0.375, 0.5, 0.5));
+    vec4 g2 = texture3D({name}_grid, vec3(0.625, 0.5, 0.5));
+    vec4 g3 = texture3D({name}_grid, vec3(0.875, 0.5, 0.5));
+    vec3 q = clamp(p, g0.xyz, g0.xyz + g1.xyz * g0.w);
+    float outside = length(p - q);
+    vec3 c = min(floor((q - g0.xyz) / g0.w), g1.xyz - 1.0);
+    vec3 corner = g0.xyz + c * g0.w;
+    vec3 wall = min(p - corner, corner + g0.w - p);
+    // Instances that aren't listed in the cell are further than the margin outside it
+    float d = (outside > 0.0 ? outside : min(min(wall.x, wall.y), wall.z)) + g1.w;
+    if (outside > 0.0) return d;
+    vec4 entry = texture3D({name}_cells, (c + 0.5) / g1.xyz);
+    for (int i = 0; i < int(entry.y); i++) {{
+        float k = entry.x + float(i);
+        vec3 at = vec3(mod(k, g2.x), mod(floor(k / g2.x), g2.y), floor(k / (g2.x * g2.y)));
+        float j = texture3D({name}_lists, (at + 0.5) / g2.xyz).x;
+        vec3 row = vec3(mod(j, g3.w) * {texels}.0, mod(floor(j / g3.w), g3.y), floor(j / (g3.w * g3.y)));
+{fetches}        d = min(d, {kind}((p - t0.xyz) / t0.w{args}) * t0.w);
+    }}
+    return d;
+""".format(name=name, kind=kind.name, texels=texels, fetches=fetches, args=''.join(',' + f for f in fields))
+
+
+# A primitive of count copies of kind, eg. Sphere, at positions (count, 3) with an optional
+# scale each and an array or a value for every parameter of kind, eg. r=radii. Call it to
+# place it in an object, update moves the copies without compiling the scene again. cell
+# is the side of the grid's cells, found from the instances when left out
+def instances(kind, positions, scale=None, cell=None, name=None, **params):
+    from .optimize import bounds
+    # The call a primitive was registered as
+    kind = getattr(kind, '__self__', kind)
+    assert isinstance(kind, Primitive) and not isinstance(kind, Object), "Only primitives can be instanced"
+    assert kind.name in bounds, "%r has no bounds, see optimize.bound" % kind.name
+    widths, texels = layout(kind)
+    name = name or 'Instances%d' % sum(isinstance(fn, Instanced) for fn in Function.registry.values())
+
+    def instanced(p: vec3): pass
+    instanced.__name__ = instanced.__qualname__ = name
+    instanced.__doc__ = body(name, kind, widths, texels)
+    Instanced.register(kind.name)(instanced)
+    fn = Function.registry[name]
+    fn.kind, fn.widths, fn.texels, fn.cell = kind, widths, texels, cell
+    fn.update(positions, scale, **params)
+    cpu.kernels[name] = fn.distance
+    return fn
@@ -2,30 +2,76 @@ uniform vec2 iResolution;
 uniform float iTime;
 uniform vec2 iMouse;
 
+// [variant]
+
 // [statics]
 
 // [functions]
 
 //---Rendering Code---
 
-float raymarch(vec3 ro, vec3 rd) {
-	float dO = 0.0;
+#ifdef COUNT_DE
+// Every distance evaluation, for the cost diagnostics
+int de_count = 0;
+
+float scene_distance(vec3 p) {
+    return DE(p);
+}
+
+float counted_distance(vec3 p) {
+    de_count++;
+    return scene_distance(p);
+}
+
+#undef DE
+#define DE(x) counted_distance(x)
+#endif
+
+#ifndef MARCH_DE
+// Distance the rays march through, drawn in tiles it leaves out what a tile can't hit
+#define MARCH_DE(x) DE(x)
+#endif
+
+// Safe distance to start marching from, left by a cone marching prepass if there was one
+uniform sampler2D iStart;
+// Texel size of the prepass in pixels of this pass, prepass width and height
+uniform vec3 iStartTexel;
 
-    for (int i = 0; i < MAX_STEPS; i++) {
-    	vec3 p = ro + rd*dO;
-        float dS = DE(p);
-        dO += dS;
-        if(dO > MAX_DISTANCE || dS < MIN_DISTANCE) break;
+float march_start() {
+    if (iStartTexel.x == 0.0) {
+        return 0.0;
     }
+    vec2 texel = floor(gl_FragCoord.xy / iStartTexel.x);
+    return texture2D(iStart, (texel + 0.5) / iStartTexel.yz).x;
+}
 
-    return dO;
+// Closest a ray gets before it counts as a hit
+float surface_epsilon(float t) {
+#ifdef FOOTPRINT
+    // Size of a pixel at distance t, the screen is 2 units high at a focal length of 2
+    return max(MIN_DISTANCE, FOOTPRINT * t / iResolution.y);
+#else
+    return MIN_DISTANCE;
+#endif
 }
 
+// Steps taken by the last call to raymarch
+int march_steps = 0;
+
+// [raymarch]
+
 vec3 normal(in vec3 p) {
+#ifdef GRADIENT
+#ifdef COUNT_DE
+    de_count++;
+#endif
+    return normalize(DE_grad(p).yzw);
+#else
     float d = DE(p);
     vec2 e = vec2(1., 0) * 0.01;
     vec3 n = d - vec3(DE(p-e.xyy),DE(p-e.yxy), DE(p-e.yyx));
     return normalize(n);
+#endif
 }
 
 
@@ -68,15 +114,11 @@ float calcSoftshadow( in vec3 ro, in vec3 rd, in float mint, in float tmax )
     return clamp( res, 0.0, 1.0 );
 }
 
-vec3 render(in vec3 ro, in vec3 rd) {
+vec3 shade(in vec3 ro, in vec3 rd, in float t, in vec3 nor) {
     vec3 col = BACKGROUND +rd.y*0.8;
 
-    float t = raymarch(ro, rd);
-
-
     if (t < MAX_DISTANCE) {
         vec3 pos = ro + rd * t;
-        vec3 nor = normal(pos);
         vec3 ref = reflect(rd, nor);
         col = MATERIAL;
         float occ = calcAO( pos, nor );
@@ -111,27 +153,39 @@ vec3 render(in vec3 ro, in vec3 rd) {
     return vec3( clamp(col,0.0,1.0) );
 }
 
-void main()
-{
+vec3 surface_normal(in vec3 ro, in vec3 rd, in float t) {
+    return t < MAX_DISTANCE ? normal(ro + rd * t) : vec3(0.0);
+}
 
+vec3 render(in vec3 ro, in vec3 rd) {
+    float t = raymarch(ro, rd);
+    return shade(ro, rd, t, surface_normal(ro, rd, t));
+}
+
+// Ray through a point on the screen, in pixels
+void camera_ray(in vec2 coord, out vec3 ro, out vec3 rd) {
     vec2 mouse = iMouse.xy/iResolution.xy;
-    float time = 15.0 + iTime;
 
-	vec3 ray_origin = vec3(10.*sin(10.*mouse.x), 2. + 20.*(mouse.y - 0.5), 10.*cos(10.*mouse.x));
+	ro = vec3(10.*sin(10.*mouse.x), 2. + 20.*(mouse.y - 0.5), 10.*cos(10.*mouse.x));
     vec3 ta = TA;
-	mat3 ca = setCamera(ray_origin, ta, 0.0);
+	mat3 ca = setCamera(ro, ta, 0.0);
 
+    vec2 p = (2.0*coord - iResolution.xy)/iResolution.y;
+    rd = ca * normalize(vec3(p.x, p.y, 2.0));
+}
+
+vec3 supersample(in vec2 coord) {
+    vec3 ro, rd;
     vec3 tot = vec3(0.0);
 #if AA > 1
     for (int i = 0; i < AA; i++) {
         for (int j = 0; j < AA; j++) {
             vec2 o = vec2(float(i), float(j)) / float(AA) - 0.5;
-    		vec2 p = (2.0*(gl_FragCoord.xy + o) - iResolution.xy)/iResolution.y;
+            camera_ray(coord + o, ro, rd);
 #else
-            vec2 p = (2.0*gl_FragCoord.xy - iResolution.xy)/iResolution.y;
+            camera_ray(coord, ro, rd);
 #endif
-            vec3 ray_direction = ca * normalize(vec3(p.x, p.y, 2.0));
-            vec3 col = render(ray_origin, ray_direction);
+            vec3 col = render(ro, rd);
 
 			tot += col;
 #if AA > 1
@@ -139,6 +193,7 @@ void main()
 	}
 	tot /= float(AA * AA);
 #endif
+    return tot;
+}
 
-    gl_FragColor = vec4(tot, 0);
-}
\ No newline at end of file
+// [main]
@@ -1,45 +1,85 @@
 # marcher.py
+import collections
+import contextlib
+import importlib
 import inspect
-
 import os
-from _ctypes import byref
-from ctypes import create_string_buffer
-
-import pygame
-import sys
-from OpenGL.GL import *
-from pygame.locals import *
-from pygame.time import get_ticks
 
 frag_blueprint = """
 uniform vec2 iResolution;
 uniform float iTime;
 uniform vec2 iMouse;
 
+// [variant]
+
 // [statics]
 
 // [functions]
 
 //---Rendering Code---
 
-float raymarch(vec3 ro, vec3 rd) {
-	float dO = 0.0;
+#ifdef COUNT_DE
+// Every distance evaluation, for the cost diagnostics
+int de_count = 0;
 
-    for (int i = 0; i < MAX_STEPS; i++) {
-    	vec3 p = ro + rd*dO;
-        float dS = DE(p);
-        dO += dS;
-        if(dO > MAX_DISTANCE || dS < MIN_DISTANCE) break;
+float scene_distance(vec3 p) {
+    return DE(p);
+}
+
+float counted_distance(vec3 p) {
+    de_count++;
+    return scene_distance(p);
+}
+
+#undef DE
+#define DE(x) counted_distance(x)
+#endif
+
+#ifndef MARCH_DE
+// Distance the rays march through, drawn in tiles it leaves out what a tile can't hit
+#define MARCH_DE(x) DE(x)
+#endif
+
+// Safe distance to start marching from, left by a cone marching prepass if there was one
+uniform sampler2D iStart;
+// Texel size of the prepass in pixels of this pass, prepass width and height
+uniform vec3 iStartTexel;
+
+float march_start() {
+    if (iStartTexel.x == 0.0) {
+        return 0.0;
     }
+    vec2 texel = floor(gl_FragCoord.xy / iStartTexel.x);
+    return texture2D(iStart, (texel + 0.5) / iStartTexel.yz).x;
+}
 
-    return dO;
+// Closest a ray gets before it counts as a hit
+float surface_epsilon(float t) {
+#ifdef FOOTPRINT
+    // Size of a pixel at distance t, the screen is 2 units high at a focal length of 2
+    return max(MIN_DISTANCE, FOOTPRINT * t / iResolution.y);
+#else
+    return MIN_DISTANCE;
+#endif
 }
 
+// Steps taken by the last call to raymarch
+int march_steps = 0;
+
+// [raymarch]
+
 vec3 normal(in vec3 p) {
+#ifdef GRADIENT
+#ifdef COUNT_DE
+    de_count++;
+#endif
+    return normalize(DE_grad(p).yzw);
+#else
     float d = DE(p);
     vec2 e = vec2(1., 0) * 0.01;
     vec3 n = d - vec3(DE(p-e.xyy),DE(p-e.yxy), DE(p-e.yyx));
     return normalize(n);
+#endif
 }
 
 
@@ -82,15 +122,11 @@ float calcSoftshadow( in vec3 ro, in vec3 rd, in float mint, in float tmax )
     return clamp( res, 0.0, 1.0 );
 }
 
-vec3 render(in vec3 ro, in vec3 rd) {
+vec3 shade(in vec3 ro, in vec3 rd, in float t, in vec3 nor) {
     vec3 col = BACKGROUND +rd.y*0.8;
 
-    float t = raymarch(ro, rd);
-
-
     if (t < MAX_DISTANCE) {
         vec3 pos = ro + rd * t;
-        vec3 nor = normal(pos);
         vec3 ref = reflect(rd, nor);
         col = MATERIAL;
         float occ = calcAO( pos, nor );
@@ -125,27 +161,39 @@ vec3 render(in vec3 ro, in vec3 rd) {
     return vec3( clamp(col,0.0,1.0) );
 }
 
-void main()
-{
+vec3 surface_normal(in vec3 ro, in vec3 rd, in float t) {
+    return t < MAX_DISTANCE ? normal(ro + rd * t) : vec3(0.0);
+}
+
+vec3 render(in vec3 ro, in vec3 rd) {
+    float t = raymarch(ro, rd);
+    return shade(ro, rd, t, surface_normal(ro, rd, t));
+}
 
+// Ray through a point on the screen, in pixels
+void camera_ray(in vec2 coord, out vec3 ro, out vec3 rd) {
     vec2 mouse = iMouse.xy/iResolution.xy;
-    float time = 15.0 + iTime;
 
-	vec3 ray_origin = vec3(10.*sin(10.*mouse.x), 2. + 20.*(mouse.y - 0.5), 10.*cos(10.*mouse.x));
+	ro = vec3(10.*sin(10.*mouse.x), 2. + 20.*(mouse.y - 0.5), 10.*cos(10.*mouse.x));
     vec3 ta = TA;
-	mat3 ca = setCamera(ray_origin, ta, 0.0);
+	mat3 ca = setCamera(ro, ta, 0.0);
+
+    vec2 p = (2.0*coord - iResolution.xy)/iResolution.y;
+    rd = ca * normalize(vec3(p.x, p.y, 2.0));
+}
 
+vec3 supersample(in vec2 coord) {
+    vec3 ro, rd;
     vec3 tot = vec3(0.0);
 #if AA > 1
     for (int i = 0; i < AA; i++) {
         for (int j = 0; j < AA; j++) {
             vec2 o = vec2(float(i), float(j)) / float(AA) - 0.5;
-    		vec2 p = (2.0*(gl_FragCoord.xy + o) - iResolution.xy)/iResolution.y;
+            camera_ray(coord + o, ro, rd);
 #else
-            vec2 p = (2.0*gl_FragCoord.xy - iResolution.xy)/iResolution.y;
+            camera_ray(coord, ro, rd);
 #endif
-            vec3 ray_direction = ca * normalize(vec3(p.x, p.y, 2.0));
-            vec3 col = render(ray_origin, ray_direction);
+            vec3 col = render(ro, rd);
 
 			tot += col;
 #if AA > 1
@@ -153,10 +201,236 @@ void main()
 	}
 	tot /= float(AA * AA);
 #endif
+    return tot;
+}
+
+// [main]
+"""
+
+# Modules that draw or evaluate compiled scenes, imported the first time a camera
+# uses them so generating source needs neither OpenGL nor pygame
+backends = {'gl': '.gl',
+            'window': '.window',
+            'offscreen': '.offscreen',
+            'cpu': '.cpu',
+            'software': '.software'}
+
+
+def backend(name):
+    return importlib.import_module(backends[name], __package__)
+
+
+# Entry points for the blueprint, Camera.compile picks one by name
+mains = {}
+
+mains['default'] = """
+void main()
+{
+    gl_FragColor = vec4(supersample(gl_FragCoord.xy), 0);
+}"""
+
+# Adaptive anti aliasing, one sample per pixel that also keeps the normal and distance
+mains['gbuffer'] = """
+void main()
+{
+    vec3 ro, rd;
+    camera_ray(gl_FragCoord.xy, ro, rd);
+    float t = raymarch(ro, rd);
+    vec3 nor = surface_normal(ro, rd, t);
+    gl_FragData[0] = vec4(shade(ro, rd, t, nor), 0);
+    gl_FragData[1] = vec4(nor, min(t, MAX_DISTANCE));
+}"""
+
+# Low resolution prepass, marches a cone around every texel that is never closer to the
+# scene than its distance so any ray inside it can start from there
+mains['cone'] = """
+// Pixels of the final frame per texel
+uniform float iConeScale;
+
+void main()
+{
+    vec3 ro, rd;
+    camera_ray(gl_FragCoord.xy * iConeScale, ro, rd);
+    // Half the texel diagonal plus the supersampling offsets over the focal length of 2
+    float k = (0.5*iConeScale + 1.0) * 1.4142 / iResolution.y;
+    float t = march_start();
+    for (int i = 0; i < MAX_STEPS; i++) {
+        float d = DE(ro + rd*t) - k*t;
+        if (d < MIN_DISTANCE || t > MAX_DISTANCE) break;
+        t += d;
+    }
+    t = min(t, MAX_DISTANCE);
+
+    float steps = 0.0;
+#ifdef CONE_STATS
+    // Steps a ray from the camera would have taken to get there, marches the whole
+    // way again so only profiling cameras measure it
+    float s = 0.0;
+    for (int i = 0; i < MAX_STEPS; i++) {
+        if (s >= t) break;
+        s += DE(ro + rd*s);
+        steps += 1.0;
+    }
+#endif
+    gl_FragColor = vec4(t, steps, 0, 0);
+}"""
+# Same prepass that also measures the steps it saves
+mains['cone_stats'] = mains['cone']
+
+# Primary ray steps and distance of every pixel, drawn into a float target
+mains['steps'] = """
+void main()
+{
+    vec3 ro, rd;
+    camera_ray(gl_FragCoord.xy, ro, rd);
+    float t = raymarch(ro, rd);
+    gl_FragColor = vec4(float(march_steps), t, 0, 0);
+}"""
+
+# Steps of the pixel's center ray, distance evaluations for the whole pixel including
+# normals, AO, shadows and supersampling, and distance
+mains['cost'] = """
+void main()
+{
+    supersample(gl_FragCoord.xy);
+    float evaluations = float(de_count);
+    vec3 ro, rd;
+    camera_ray(gl_FragCoord.xy, ro, rd);
+    float t = raymarch(ro, rd);
+    gl_FragColor = vec4(float(march_steps), evaluations, t, 0);
+}"""
+
+# Distance evaluations on a log scale up to the most a pixel can take
+mains['heatmap'] = """
+vec3 heat(float x) {
+    return clamp(vec3(1.5 - abs(4.0*x - vec3(3.0, 2.0, 1.0))), 0.0, 1.0);
+}
 
-    gl_FragColor = vec4(tot, 0);
+void main()
+{
+    supersample(gl_FragCoord.xy);
+    float budget = float(AA*AA*(MAX_STEPS + 4 + 5 + 2*16));
+    gl_FragColor = vec4(heat(log(1.0 + float(de_count)) / log(1.0 + budget)), 0);
 }"""
 
+# One sample per pixel at an offset that changes every frame, the pipeline adds them up
+mains['progressive'] = """
+// Offset of this frame's sample from the center of the pixel, in pixels
+uniform vec2 iJitter;
+
+void main()
+{
+    vec3 ro, rd;
+    camera_ray(gl_FragCoord.xy + iJitter, ro, rd);
+    gl_FragColor = vec4(render(ro, rd), 1.0);
+}"""
+
+# Defines an entry point needs ahead of the rest of the blueprint
+variants = {'cost': '#define COUNT_DE\n',
+            'heatmap': '#define COUNT_DE\n',
+            'cone_stats': '#define CONE_STATS\n'}
+
+# Then mark where a neighbour's distance or normal differs, the default entry
+# point only runs on the marked pixels
+mains['edges'] = """
+uniform sampler2D iGeometry;
+
+vec4 geometry(vec2 offset) {
+    return texture2D(iGeometry, (gl_FragCoord.xy + offset) / iResolution.xy);
+}
+
+// Silhouettes, creases and depth steps between a pixel and its neighbours on one axis
+bool edge(vec4 g, vec4 a, vec4 b) {
+    bool miss = g.w >= MAX_DISTANCE;
+    if (miss != (a.w >= MAX_DISTANCE) || miss != (b.w >= MAX_DISTANCE)) {
+        return true;
+    }
+    if (miss) {
+        return false;
+    }
+    // Second difference so smooth slopes such as a floor at a grazing angle don't count
+    return abs(a.w + b.w - 2.0*g.w) > EDGE_DEPTH*g.w ||
+           min(dot(g.xyz, a.xyz), dot(g.xyz, b.xyz)) < EDGE_NORMAL;
+}
+
+void main()
+{
+    vec4 g = geometry(vec2(0.0));
+    if (!edge(g, geometry(vec2(-1.0, 0.0)), geometry(vec2(1.0, 0.0))) &&
+        !edge(g, geometry(vec2(0.0, -1.0)), geometry(vec2(0.0, 1.0)))) {
+        discard;
+    }
+    gl_FragColor = vec4(1.0);
+}"""
+
+
+# Marching strategies for the raymarch function of the blueprint
+marches = {}
+
+marches['sphere'] = """
+float raymarch(vec3 ro, vec3 rd) {
+	float dO = march_start();
+
+    march_steps = 0;
+    for (int i = 0; i < MAX_STEPS; i++) {
+    	vec3 p = ro + rd*dO;
+        float dS = MARCH_DE(p);
+        dO += dS;
+        march_steps++;
+        if(dO > MAX_DISTANCE || dS < surface_epsilon(dO)) break;
+    }
+
+    return dO;
+}"""
+
+# Over relaxed sphere tracing, steps RELAXATION times further than the distance and
+# falls back to plain steps the first time the spheres stop overlapping
+marches['relaxed'] = """
+float raymarch(vec3 ro, vec3 rd) {
+    float omega = RELAXATION;
+    float t = march_start();
+    float previous = 0.0;
+    float stride = 0.0;
+
+    march_steps = 0;
+    for (int i = 0; i < MAX_STEPS; i++) {
+        float d = MARCH_DE(ro + rd*t);
+        march_steps++;
+        bool overshot = omega > 1.0 && d + previous < stride;
+        if (overshot) {
+            // Back to where a plain step would have ended
+            stride -= omega * stride;
+            omega = 1.0;
+        } else {
+            stride = d * omega;
+        }
+        previous = d;
+        if (!overshot && d < surface_epsilon(t) || t > MAX_DISTANCE) break;
+        t += stride;
+    }
+
+    return t;
+}"""
+
+# For distance functions that overestimate, eg. with non uniform scales or
+# bent space, takes STEP_SCALE of the distance and never more than MAX_STEP
+marches['capped'] = """
+float raymarch(vec3 ro, vec3 rd) {
+	float dO = march_start();
+
+    march_steps = 0;
+    for (int i = 0; i < MAX_STEPS; i++) {
+        float dS = MARCH_DE(ro + rd*dO);
+        march_steps++;
+        if(dS < surface_epsilon(dO)) break;
+        dO += min(dS * STEP_SCALE, MAX_STEP);
+        if(dO > MAX_DISTANCE) break;
+    }
+
+    return dO;
+}"""
+
+
 class vec:
     def __init__(self, *floats):
         self.floats = []
@@ -175,7 +449,7 @@ class vec:
         return'vec' + str(self.dim)
 
     def __str__(self):
-        return self.get_type() + '(' + ','.join([str(f) for f in self.floats]) + ')'
+        return literal(self, self.get_type())
 
     def __mul__(self, scalar):
         # Make sure its a float
@@ -203,6 +477,92 @@ def make_param(arg_type):
         return 'vec2'
 
 
+def is_constant(value):
+    if isinstance(value, vec):
+        return all(type(f) is float for f in value.floats)
+    return type(value) is float
+
+
+# Settings of the camera that is currently generating source
+class Compilation:
+    active = None
+
+    def __init__(self, uniforms=None, optimize=True, guards=False, margin=0.1):
+        self.uniforms = uniforms
+        self.optimize = optimize
+        self.guards = guards
+        self.margin = margin
+
+    # Generated sources can be reused between compilations with the same key. The
+    # uniforms themselves, not their id, so a memoized source keeps them alive and a
+    # later compilation can't get one that indexes constants it never hoisted
+    def key(self):
+        return self.optimize, self.guards, self.margin, self.uniforms
+
+
+# Collects the numeric constants of a scene into uniforms so they can be
+# changed per frame without regenerating or relinking the program
+class Uniforms:
+    array = 'iParams'
+
+    def __init__(self):
+        self.values = []
+        self.names = []
+        self.statics = {}
+        # Bumped on every change, programs remember the version they last saw
+        self.version = 0
+        self.uploaded = {}
+        self.locations = {}
+
+    def hoist(self, value, name):
+        self.values.append(float(value))
+        self.names.append(name)
+        return '%s[%d]' % (self.array, len(self.values) - 1)
+
+    def declare(self):
+        if not self.values:
+            return ''
+        return 'uniform float %s[%d];\n' % (self.array, len(self.values))
+
+    def copy(self, statics):
+        uniforms = Uniforms()
+        uniforms.values = self.values.copy()
+        uniforms.names = self.names
+        uniforms.statics = {name: statics[name] for name in self.statics}
+        return uniforms
+
+    # Indices of hoisted constants, names look like 'Sphere.r' or 'Box.b.x'
+    def find(self, name):
+        return [i for i, n in enumerate(self.names) if n == name or n.startswith(name + '.')]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.statics[key]
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            assert key in self.statics, "%r is not a uniform" % key
+            self.statics[key] = value
+        else:
+            self.values[key] = float(value)
+        self.version += 1
+
+    def upload(self, program):
+        if self.uploaded.get(program) != self.version:
+            backend('gl').upload(self, program)
+
+
+def literal(value, name):
+    if isinstance(value, vec):
+        fields = [literal(f, name + '.' + 'xyzw'[i]) for i, f in enumerate(value.floats)]
+        return value.get_type() + '(' + ','.join(fields) + ')'
+    compilation = Compilation.active
+    if compilation and compilation.uniforms and type(value) in (float, int):
+        return compilation.uniforms.hoist(value, name)
+    return str(value)
+
+
 # Base case for recursive compilation
 class Var:
     def __init__(self, name):
@@ -219,6 +579,8 @@ class Function:
 
     registry = {}
     partials = {}
+    # Bumped on every registration, memoized sources are only valid for one generation
+    generation = 0
 
     class Call:
         def __init__(self, name, args):
@@ -228,16 +590,54 @@ class Function:
         def get_args(self):
             return self.args
 
+        # Names of every function the call uses, scenes can nest deeper than the
+        # recursion limit so the tree is walked with a stack
         def get_usage(self):
-            usage = set([self.name])
-            for arg in self.get_args():
-                if isinstance(arg, Function.Call):
-                    usage |= arg.get_usage()
+            usage = set()
+            seen = set()
+            stack = [self]
+            while stack:
+                call = stack.pop()
+                usage.add(call.name)
+                for arg in call.get_args():
+                    if isinstance(arg, Function.Call) and id(arg) not in seen:
+                        seen.add(id(arg))
+                        stack.append(arg)
             return usage
 
+        # Appends the text of the call to out. Constants after an argument that is a
+        # call wait for it, so hoisted uniforms keep the order they are written in
+        def write(self, out):
+            stack = [self]
+            while stack:
+                item = stack.pop()
+                if isinstance(item, str):
+                    out.append(item)
+                elif isinstance(item, Function.Call):
+                    params = Function.registry[item.name].params
+                    parts = [item.name + '(']
+                    nested = False
+                    for i, (arg, param) in enumerate(zip(item.get_args(), params)):
+                        if i:
+                            parts.append(',')
+                        if isinstance(arg, Function.Call):
+                            parts.append(arg)
+                            nested = True
+                        elif nested:
+                            parts.append((arg, item.name + '.' + param))
+                        else:
+                            parts.append(literal(arg, item.name + '.' + param))
+                    parts.append(')')
+                    if nested:
+                        stack.extend(reversed(parts))
+                    else:
+                        out.extend(parts)
+                else:
+                    out.append(literal(*item))
+            return out
+
         def __str__(self):
-            args_list = ','.join([str(arg) for arg in self.get_args()])
-            return self.name + '(' + args_list + ')'
+            return ''.join(self.write([]))
 
     def _call(self, *args):
         return self.__class__.Call(self.name, args)
@@ -259,6 +659,7 @@ class Function:
             setattr(cls, fun.name, fun)
             cls.registry[fun.name] = fun
             cls.partials[fun._call] = fun._partial_call
+            Function.generation += 1
             return fun._call
         return decorator
 
@@ -274,34 +675,79 @@ class Function:
 
         self.fn = fn
         self.dependencies = set(dependencies)
-
-    def get_body(self):
+        # Read the source once here instead of on every compile
+        self.body = self.read_body()
+        self.signature = None
+        self.source = None
+        self.resolved = None
+        # NumPy version of the body, translated the first time the CPU needs it, see cpu.find
+        self.numpy = None
+        # GLSL of the version with derivatives, see gradient.py
+        self.gradient = None
+
+    def read_body(self):
         split = inspect.getsource(self.fn).split('"""')
         assert (len(split) == 3), "%r has no body" % self.name
         return split[1].strip()
 
+    def get_body(self):
+        return self.body
+
+    def get_signature(self):
+        if not self.signature:
+            self.signature = make_param(self.return_type)+' '+self.name
+            self.signature += '('+','.join([make_param(arg_type)+' '+arg for arg, arg_type in self.params.items()])+')'
+        return self.signature
+
     def get_dependencies(self):
         return self.dependencies
 
-    def toposort(self, visited, cycle, stack):
-        visited.add(self.name)
-        cycle.add(self.name)
-        for dep in self.get_dependencies():
-            if dep not in visited:
-                self.registry[dep].toposort(visited, cycle, stack)
+    # Text that determines the generated source, cheap enough to hash on every
+    # launch so the shader cache can skip generating it, see cache.py
+    def fingerprint(self):
+        return self.get_signature() + '\n' + self.get_body()
+
+    # Names of this function and everything it uses, dependencies first. Depth
+    # first with a stack of the dependencies each function has left to visit
+    def toposort(self):
+        order = []
+        visited = {self.name}
+        cycle = {self.name}
+        # Sorted so the generated source, and its cache key, is the same every launch
+        stack = [(self.name, iter(sorted(self.get_dependencies())))]
+        while stack:
+            name, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                stack.pop()
+                cycle.remove(name)
+                order.append(name)
+            elif dep not in visited:
+                visited.add(dep)
+                cycle.add(dep)
+                stack.append((dep, iter(sorted(self.registry[dep].get_dependencies()))))
             elif dep in cycle:
                 assert False, "Cycle detected, recursion is not supported"
-        stack.insert(0, self.name)
-        cycle.remove(self.name)
+        return order
 
-    def __str__(self):
-        fun = make_param(self.return_type)+' '+self.name
-        fun += '('+','.join([make_param(arg_type)+' '+arg for arg, arg_type in self.params.items()])+')\n'
+    def resolve(self):
+        if not self.resolved or self.resolved[0] != Function.generation:
+            self.resolved = (Function.generation, self.toposort())
+        return self.resolved[1]
+
+    def gen_source(self):
+        fun = self.get_signature()+'\n'
         fun += '{\n'
         fun += self.get_body()
         fun += '\n}'
         return fun
 
+    def __str__(self):
+        key = (Function.generation, Compilation.active.key() if Compilation.active else None)
+        if not self.source or self.source[0] != key:
+            self.source = (key, self.gen_source())
+        return self.source[1]
+
 
 class Primitive(Function):
 
@@ -343,13 +789,31 @@ class Combinator(Function):
     class Call(Function.Call):
 
         def at(self, location: vec3):
-            return self.__class__(self.name, [arg.at(location) if isinstance(arg, Function.Call) else arg for arg in self.args])
+            return self.map(lambda arg: arg.at(location))
 
         def f(self, f):
-            return self.__class__(self.name, [arg.f(f) if isinstance(arg, Function.Call) else arg for arg in self.args])
+            return self.map(lambda arg: arg.f(f))
 
         def __call__(self, f):
-            return self.__class__(self.name, [arg(f) if isinstance(arg, Function.Call) else arg for arg in self.args])
+            return self.map(lambda arg: arg(f))
+
+        # Copy of the tree with leaf applied to every call below that isn't a
+        # combinator, combinators are copied children first with a stack
+        def map(self, leaf):
+            copies = {}
+            stack = [self]
+            while stack:
+                call = stack[-1]
+                pending = [arg for arg in call.args
+                           if isinstance(arg, Combinator.Call) and id(arg) not in copies]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                args = [copies[id(arg)] if isinstance(arg, Combinator.Call) else
+                        leaf(arg) if isinstance(arg, Function.Call) else arg for arg in call.args]
+                copies[id(call)] = call.__class__(call.name, args)
+            return copies[id(self)]
 
     @staticmethod
     def _default_return():
@@ -392,6 +856,11 @@ class Object(Primitive):
             assert self.f, "Compiling a partial"
             return self.args + [self.wrap_location(), Var('res')]
 
+        # Samples the object into a 3D texture that the DE looks up instead, see bake.py
+        def bake(self, resolution=128, bounds=None, brick=8, max_bytes=32 * 2**20, cache=True):
+            from .bake import bake
+            return bake(self, resolution, bounds, brick, max_bytes, cache)
+
     def __init__(self, fn, dependencies):
         super().__init__(fn, dependencies)
         # Need to make sure the p and res args come at the beginning
@@ -402,6 +871,7 @@ class Object(Primitive):
         # for arg, arg_type in tmp.items():
         #     self.params[arg] = arg_type
         self.lines = []
+        self.evaluated = False
         # self.usages = set()
 
     def _call(self, *args, at=None, f=None):
@@ -425,21 +895,49 @@ class Object(Primitive):
 
     # Lazy evaluation of function for body and dependencies
     def evaluate(self):
-        if not self.lines:
+        if not self.evaluated:
             dummy_args = (len(self.fn.__annotations__)) * [None]
             self.fn(*([self] + dummy_args))
+            self.evaluated = True
+
+    def read_body(self):
+        # Generated from the lines instead
+        return None
 
     def gen_body(self):
-        body = ''
+        body = []
         for var, value in self.lines:
-            body += str(var)+'='+str(value)+';\n'
-        body += 'return '+str(Var('res'))+';'
-        return body
+            body.append(str(var) + '=')
+            if isinstance(value, Function.Call):
+                value.write(body)
+            else:
+                body.append(str(value))
+            body.append(';\n')
+        body.append('return ' + str(Var('res')) + ';')
+        return ''.join(body)
 
     def get_body(self):
         self.evaluate()
         return self.gen_body()
 
+    def fingerprint(self):
+        # The lines before optimizing, outside of a compilation constants are written inline
+        active, Compilation.active = Compilation.active, None
+        try:
+            return super().fingerprint()
+        finally:
+            Compilation.active = active
+
+    def gen_source(self):
+        compilation = Compilation.active
+        if compilation and compilation.optimize:
+            from .optimize import Optimizer
+            self.evaluate()
+            helpers, body = Optimizer(self, compilation.guards, compilation.margin,
+                                      bool(compilation.uniforms)).compile()
+            return helpers + self.get_signature() + '\n{\n' + body + '\n}'
+        return super().gen_source()
+
     def get_dependencies(self):
         self.evaluate()
         return self.dependencies
@@ -513,7 +1011,10 @@ def Mirror(p: vec3): """
 """
 
 class Camera:
-    def __init__(self, size, **kwargs):
+    def __init__(self, size, cache=True, uniforms=False, optimize=True, bounds=False, bound_margin=0.1,
+                 adaptive=False, prepass=None, march='sphere', footprint=0.0, heatmap=False,
+                 profile=False, fps=60, tiles=None, tile_programs=8, target_ms=None, min_scale=0.25,
+                 sharpen=0.3, progressive=None, gradient=False, **kwargs):
         default = {"MAX_STEPS": 100,
                    "MAX_DISTANCE": 100.0,
                    "MIN_DISTANCE": 0.001,
@@ -523,126 +1024,432 @@ class Camera:
                    "RO": vec3(1, 1, 1),
                    "TA": vec3(0, 0, 0),
                    "LIGHT_POS": vec3(1, 4, 1),
-                   "LOOK": 1}
+                   "LOOK": 1,
+                   "EDGE_DEPTH": 0.02,
+                   "EDGE_NORMAL": 0.9,
+                   "RELAXATION": 1.6,
+                   "STEP_SCALE": 0.5,
+                   "MAX_STEP": 5.0}
 
         self.params = {**default, **kwargs}
         self.size = size
-
-    def get_statics(self):
+        self.offscreen = None
+        self.pipelines = {}
+        self.stats = {}
+        # Hoist scene constants and float/vec settings into uniforms
+        self.uniform_mode = uniforms
+        self.parameters = {}
+        # Share repeated subtrees and fold transforms in generated objects
+        self.optimize = optimize
+        # Skip subtrees further than bound_margin from their bounding box
+        self.bounds = bounds
+        self.bound_margin = bound_margin
+        # Render one sample per pixel and only supersample edges
+        self.adaptive = adaptive
+        assert not adaptive or self.params['AA'] > 1, "Adaptive anti aliasing needs AA > 1"
+        # Texel sizes in pixels of low resolution passes that find where marching can start,
+        # eg. 8 or (32, 8) to refine a coarser level
+        if isinstance(prepass, int):
+            prepass = (prepass,)
+        self.prepass = tuple(prepass or ())
+        # Strategy from marches, and how many pixels wide a surface hit may be at any
+        # distance, 0 keeps MIN_DISTANCE everywhere
+        assert march in marches, "Unknown march %r, pick one of %s" % (march, ', '.join(marches))
+        self.march = march
+        self.footprint = footprint
+        # Draw the number of distance evaluations of every pixel instead of the scene
+        self.heatmap = heatmap
+        # Time frames with GPU queries and time compiling, a path also saves them as
+        # JSON when the window closes. fps=None runs the window uncapped without vsync
+        self.profile = profile
+        self.profiler = None
+        if profile:
+            from .profiling import Profiler
+            self.profiler = Profiler()
+        self.fps = fps
+        # Draw tiles of this many pixels with programs that only march through the part of
+        # the scene they can see, grouped into at most tile_programs programs per view
+        assert not tiles or not (uniforms or adaptive or prepass or heatmap), \
+            "Tiles can't be combined with uniforms, adaptive, prepass or heatmap"
+        self.tiles = tiles
+        self.tile_programs = tile_programs
+        # Programs of the pruned objects of recent views, least recently used first and
+        # deleted past tile_cache. A window only prunes again once the mouse has been
+        # still for tile_settle frames and draws the whole scene in between
+        self.programs = collections.OrderedDict()
+        self.tile_cache = 4 * tile_programs
+        self.tile_views = {}
+        self.tile_settle = 10
+        # Draw at a fraction of size that keeps the scene under target_ms and upscale it
+        # with sharpen, see pipeline.ResolutionControl for the controller and its history
+        assert not target_ms or not (adaptive or prepass or tiles), \
+            "Dynamic resolution can't be combined with adaptive, prepass or tiles"
+        self.target_ms = target_ms
+        self.min_scale = min_scale
+        self.sharpen = sharpen
+        self.resolution = None
+        # Add one jittered sample per pixel every frame while the view stays the same,
+        # up to this many, instead of drawing AA*AA samples every frame
+        assert not progressive or not (adaptive or tiles or heatmap or target_ms), \
+            "Progressive can't be combined with adaptive, tiles, heatmap or target_ms"
+        self.progressive = progressive
+        # Normals from the derivatives of the scene in one evaluation instead of finite
+        # differences of four, see gradient.py
+        assert not gradient or not uniforms, "Gradient normals can't be combined with uniforms"
+        self.gradient = gradient
+
+        # Shared by default so every camera reuses the same sources and disk store
+        if cache is True:
+            from .cache import default_cache
+            cache = default_cache()
+        self.cache = cache
+
+    def get_statics(self, uniforms=None):
         s = ''
         for param, value in self.params.items():
-            s += '#define ' + param + ' ' + str(value) + '\n'
+            if self.uniform_mode and is_constant(value):
+                s += 'uniform ' + (value.get_type() if isinstance(value, vec) else 'float') + ' ' + param + ';\n'
+                if uniforms:
+                    uniforms.statics[param] = value
+            else:
+                s += '#define ' + param + ' ' + str(value) + '\n'
         return s
 
-    @staticmethod
-    def print_log(shader):
-        length = c_int()
-        glGetShaderiv(shader, GL_INFO_LOG_LENGTH, byref(length))
-
-        if length.value > 0:
-            log = create_string_buffer(length.value)
-            print(glGetShaderInfoLog(shader))
-
-    def compile_shader(self, source, shader_type):
-        shader = glCreateShader(shader_type)
-        glShaderSource(shader, source)
-        glCompileShader(shader)
-
-        status = c_int()
-        glGetShaderiv(shader, GL_COMPILE_STATUS, byref(status))
-        if not status.value:
-            self.print_log(shader)
-            glDeleteShader(shader)
-            raise ValueError('Shader compilation failed')
-        return shader
+    def timed(self, stage):
+        return self.profiler.timed(stage) if self.profiler else contextlib.nullcontext()
 
+    # outside with every marker in parts replaced by its text, joined once
     @staticmethod
-    def insert(into, outside, at):
-
-        split = outside.split(at)
-        assert len(split) == 2, "Can only split at one location not %r" % str(len(split) - 1)
-        return split[0] + into + split[1]
-
-    def compile(self, obj):
-        statics = self.get_statics()
+    def insert(outside, parts):
+        found = []
+        for at, into in parts.items():
+            count = outside.count(at)
+            assert count == 1, "Can only split at one location not %r" % str(count)
+            found.append((outside.index(at), at, into))
+        pieces = []
+        start = 0
+        for index, at, into in sorted(found):
+            pieces += [outside[start:index], into]
+            start = index + len(at)
+        pieces.append(outside[start:])
+        return ''.join(pieces)
+
+    # main picks the entry point from mains and march the strategy from marches,
+    # they all share the same uniforms. Rays march through pruned instead of obj if given
+    def compile(self, obj, main='default', march=None, pruned=None):
+        # Pruned sources come and go with the view, their binaries are still found on disk
+        if self.cache and not pruned:
+            settings = (self.get_statics(), self.optimize, self.bounds, self.bound_margin, self.footprint,
+                        self.gradient)
+            # Hoisted uniforms only live in this process, their sources aren't kept on disk
+            shader, uniforms = self.cache.source(obj, settings, lambda: self.generate(obj, pruned),
+                                                 persist=not self.uniform_mode)
+        else:
+            shader, uniforms = self.generate(obj, pruned)
+        if uniforms and obj.name not in self.parameters:
+            # Cached sources are shared, values are per camera
+            self.parameters[obj.name] = uniforms.copy(self.params)
+        return self.insert(shader, {'// [variant]': variants.get(main, ''),
+                                    '// [raymarch]': marches[march or self.march],
+                                    '// [main]': mains[main]})
+
+    # Handle for changing the uniforms of an object compiled in uniform mode
+    def get_parameters(self, obj):
+        assert self.uniform_mode, "Camera was not created with uniforms=True"
+        if obj.name not in self.parameters:
+            self.compile(obj)
+        return self.parameters[obj.name]
+
+    def generate(self, obj, pruned=None):
+        with self.timed('generate'):
+            return self.generate_shader(obj, pruned)
+
+    def generate_shader(self, obj, pruned=None):
+        uniforms = Uniforms() if self.uniform_mode else None
+        # Bounds are computed from the constants so can't follow uniform changes
+        guards = self.optimize and self.bounds and not uniforms
+        if guards:
+            from .optimize import guardable
+            guards = guardable(obj)
+        Compilation.active = Compilation(uniforms, self.optimize, guards, self.bound_margin)
+        try:
+            names = obj.resolve()
+            if pruned:
+                # Pruned objects aren't registered, they come after everything they use
+                names = names + [name for name in pruned.resolve()[:-1] if name not in names]
+            functions = ''.join(str(Function.registry[fn]) + '\n' for fn in names)
+            if pruned:
+                functions += str(pruned) + '\n'
+            if self.gradient:
+                from .gradient import gradients
+                functions += gradients(Function.registry[fn] for fn in obj.resolve())
+            statics = self.get_statics(uniforms)
+        finally:
+            Compilation.active = None
+        if uniforms:
+            statics += uniforms.declare()
+        if self.footprint:
+            statics += '#define FOOTPRINT ' + str(float(self.footprint)) + '\n'
+        if pruned:
+            statics += '#define MARCH_DE(x) ' + pruned.name + '((x),1e20)\n'
+        if self.gradient:
+            statics += '#define GRADIENT\n#define DE_grad(x) ' + obj.name + '_grad(dpoint(x),vec4(1e20,0.0,0.0,0.0))\n'
         statics += '#define DE(x) '+obj.name+'((x),1e20)'
-        stack = []
-        obj.toposort(set(), set(), stack)
-        functions = ''
-        for fn in reversed(stack):
-            functions += str(Function.registry[fn]) + '\n'
         frag_dir = os.path.join(os.path.dirname(__file__), 'march.glsl')
         # f_shader = open(frag_dir).read()
-        f_shader = frag_blueprint
-        f_shader = self.insert(statics, f_shader, '// [statics]')
-        f_shader = self.insert(functions, f_shader, '// [functions]')
+        f_shader = self.insert(frag_blueprint, {'// [statics]': statics, '// [functions]': functions})
 
-        return f_shader
+        return f_shader, uniforms
 
-    def view(self, obj):
-        shader = self.compile(obj)
-        self.render(shader)
+    # on_frame(uniforms, time) is called before every frame, eg. to animate parameters
+    def view(self, obj, on_frame=None):
+        # Generate first so the uniforms exist before the window opens
+        self.compile(obj)
+        self.render(obj, self.parameters.get(obj.name), on_frame)
 
     def save(self, obj, file):
         shader = self.compile(obj)
         open(file, 'w').write(shader)
 
-    def render(self, shader):
-        pygame.init()
-        size = width, height = self.size
-        screen_center = (size[0] / 2, size[1] / 2)
-        fps = 60
-        timer = 0
-        screen = pygame.display.set_mode(size, DOUBLEBUF | OPENGL)
-        pygame.mouse.set_visible(False)
-        pygame.mouse.set_pos(screen_center)
-
-        clock = pygame.time.Clock()
-
-        program = glCreateProgram()
-
-        fragment_shader = None
-
-        fragment_shader = self.compile_shader(shader, GL_FRAGMENT_SHADER)
-        glAttachShader(program, fragment_shader)
-
-        glLinkProgram(program)
-
-        if fragment_shader:
-            glDeleteShader(fragment_shader)
-
-        resID = glGetUniformLocation(program, "iResolution")
-        mouseID = glGetUniformLocation(program, "iMouse")
-        timeID = glGetUniformLocation(program, "iTime")
-
-        glUseProgram(program)
-        glUniform2fv(resID, 1, size)
-
-        running = True
-        pause = False
-        while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    sys.exit()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_p:
-                        pause = not pause
-                    elif event.key == pygame.K_s:
-                        pygame.image.save(screen, 'screenshot.png')
-                    elif event.key == pygame.K_ESCAPE:
-                        sys.exit(0)
-            if not pause:
-                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-                glUniform1f(timeID, get_ticks() / 1000)
-                m = pygame.mouse.get_pos()
-                glUniform2fv(mouseID, 1, (m[0], height - m[1]))
-                if get_ticks() - timer > 1000:
-                    print('fps', round(clock.get_fps()))
-                    timer = get_ticks()
-                glRecti(-1, -1, 1, 1)
-                clock.tick(fps)
-
-                pygame.display.flip()
+    def link_program(self, shader):
+        return backend('gl').link_program(shader, bool(self.cache), self.timed)
+
+    def load_program(self, shader):
+        with self.timed('load_binary'):
+            program = self.cache.load_program(shader) if self.cache else None
+        if program is None:
+            program = self.link_program(shader)
+            if self.cache:
+                self.cache.store_program(shader, program)
+        return program
+
+    # Programs belong to the current context so pipelines are built after it exists
+    # A measuring main such as 'steps' draws a single pass into a float target instead.
+    # Interactive pipelines wait for the view to settle before pruning tiles again
+    def build_pipeline(self, obj, main=None, march=None, interactive=False):
+        from .pipeline import SinglePass, AdaptiveAA, Prepass, FloatTarget, Tiled, Volumes, Scaled
+        if main == 'progressive' or not main and self.progressive:
+            from .pipeline import Progressive, RESOLVE
+            # Headless renders ask for their number of samples
+            limit = None if main else self.progressive
+            pipeline = Progressive(self.load_program(self.compile(obj, 'progressive')), self.load_program(RESOLVE),
+                                   self.size, self.animated(obj), limit)
+        elif main:
+            pipeline = FloatTarget(self.load_program(self.compile(obj, main, march)), self.size)
+        elif self.heatmap:
+            pipeline = SinglePass(self.load_program(self.compile(obj, 'heatmap')), self.size)
+        elif self.adaptive:
+            pipeline = AdaptiveAA(self.load_program(self.compile(obj, 'gbuffer')),
+                                  self.load_program(self.compile(obj, 'edges')),
+                                  self.load_program(self.compile(obj)), self.size)
+        elif self.tiles:
+            pipeline = Tiled(lambda mouse: self.tile_groups(obj, mouse), self.load_program(self.compile(obj)),
+                             self.default_mouse(), self.size, self.tile_settle if interactive else 0)
+        else:
+            pipeline = SinglePass(self.load_program(self.compile(obj)), self.size)
+        if self.prepass:
+            cone = 'cone_stats' if self.profile else 'cone'
+            pipeline = Prepass(self.load_program(self.compile(obj, cone, march)), self.prepass,
+                               pipeline, self.size, self.profile)
+        if self.target_ms and not main:
+            from .pipeline import ResolutionControl, UPSCALE
+            if not self.resolution:
+                self.resolution = ResolutionControl(self.target_ms, self.min_scale)
+            pipeline = Scaled(pipeline, self.load_program(UPSCALE), self.resolution, self.size, self.sharpen)
+        volumes = self.volumes(obj)
+        if volumes:
+            volumes = Volumes(volumes)
+            for draw_pass in pipeline.passes:
+                draw_pass.volumes = volumes
+        return pipeline
+
+    # Programs and tiles for the view from mouse, see tiles.py. Views that prune the
+    # same way share programs
+    def tile_groups(self, obj, mouse):
+        from .tiles import specialize
+        groups = []
+        for pruned, rects in specialize(obj, self.size, self.params, mouse, self.tiles,
+                                        self.tile_programs, self.stats):
+            if pruned.name in self.programs:
+                self.programs.move_to_end(pruned.name)
+            else:
+                self.programs[pruned.name] = self.load_program(self.compile(obj, pruned=pruned))
+            groups.append((self.programs[pruned.name], rects))
+        # Programs the latest view of any object draws with are kept whatever their age
+        self.tile_views[obj.name] = {program for program, _ in groups}
+        in_use = set().union(*self.tile_views.values())
+        stale = [name for name, program in self.programs.items() if program not in in_use]
+        for name in stale[:max(0, len(self.programs) - self.tile_cache)]:
+            backend('gl').glDeleteProgram(self.programs.pop(name))
+        return groups
+
+    # Whether obj reads iTime or another Var, progressive frames then start over when it changes
+    @staticmethod
+    def animated(obj):
+        from .bake import dynamic
+        obj.evaluate()
+        return any(dynamic(line, obj.params) for _, line in obj.lines)
+
+    # Functions obj uses that sample 3D textures, baked objects and instances
+    @staticmethod
+    def volumes(obj):
+        return [Function.registry[name] for name in obj.resolve() if getattr(Function.registry[name], 'volumes', None)]
+
+    def offscreen_pipeline(self, obj, main=None, march=None):
+        if not self.offscreen:
+            self.offscreen = backend('offscreen').Offscreen(self.size)
+        self.offscreen.bind()
+        key = (obj.name, main, march)
+        if key not in self.pipelines:
+            self.pipelines[key] = self.build_pipeline(obj, main, march)
+        return self.pipelines[key]
+
+    def default_mouse(self):
+        # Same starting view as the interactive window, which centers the mouse
+        return self.size[0] / 2, self.size[1] / 2
+
+    def draw(self, pipeline, time, mouse, uniforms=None):
+        if self.profiler:
+            self.profiler.begin_frame()
+        pipeline.draw(time, mouse, uniforms)
+        if self.profiler:
+            self.profiler.end_frame()
+
+    def draw_offscreen(self, pipeline, time, mouse, uniforms=None):
+        self.draw(pipeline, time, self.default_mouse() if mouse is None else mouse, uniforms)
+        frame = self.offscreen.read()
+        pipeline.report(self.stats, wait=True)
+        return frame
+
+    # Frames are (height, width, 3) uint8 views into a buffer that is reused
+    # by the next render, copy them to keep them around
+    def render_to_array(self, obj, time=0.0, mouse=None):
+        pipeline = self.offscreen_pipeline(obj)
+        return self.draw_offscreen(pipeline, time, mouse, self.parameters.get(obj.name))
+
+    # Average of samples jittered samples of every pixel, drawn one per pass like a
+    # progressive camera does while the view is still. Reused like render_to_array
+    def render_samples(self, obj, samples, time=0.0, mouse=None):
+        pipeline = self.offscreen_pipeline(obj, 'progressive')
+        uniforms = self.parameters.get(obj.name)
+        mouse = self.default_mouse() if mouse is None else mouse
+        assert samples >= 1, "Needs at least one sample"
+        pipeline.reset()
+        for _ in range(samples - 1):
+            self.draw(pipeline, time, mouse, uniforms)
+        return self.draw_offscreen(pipeline, time, mouse, uniforms)
+
+    def render_frames(self, obj, times, mouse=None, on_frame=None):
+        pipeline = self.offscreen_pipeline(obj)
+        uniforms = self.parameters.get(obj.name)
+        for time in times:
+            if on_frame:
+                on_frame(uniforms, time)
+            yield self.draw_offscreen(pipeline, time, mouse, uniforms)
+
+    # (height, width, 4) float32 frame of a measuring main, reused like render_to_array
+    def measure(self, obj, main, time=0.0, mouse=None, march=None):
+        pipeline = self.offscreen_pipeline(obj, main, march)
+        pipeline.draw(time, self.default_mouse() if mouse is None else mouse, self.parameters.get(obj.name))
+        return pipeline.read()
+
+    # Renders duration seconds at fps into a video through ffmpeg, or into PNGs for a path
+    # with a % or no extension. Frames stream to the writer as they come back
+    def export_video(self, obj, duration, fps, path, start=0.0, mouse=None, on_frame=None, buffers=3):
+        from .video import open_writer
+        pipeline = self.offscreen_pipeline(obj)
+        uniforms = self.parameters.get(obj.name)
+        mouse = self.default_mouse() if mouse is None else mouse
+        readback = backend('offscreen').Readback(self.size, buffers)
+        writer = open_writer(path, self.size, fps)
+        try:
+            for i in range(int(round(duration * fps))):
+                # Frame times come from the frame number, never the clock
+                time = start + i / fps
+                if on_frame:
+                    on_frame(uniforms, time)
+                self.draw(pipeline, time, mouse, uniforms)
+                if readback.full():
+                    writer.write(readback.take())
+                readback.queue()
+            while not readback.empty():
+                writer.write(readback.take())
+        finally:
+            writer.close()
+
+    # Steps and distance of the primary ray of every pixel
+    def march_steps(self, obj, time=0.0, mouse=None, march=None):
+        frame = self.measure(obj, 'steps', time, mouse, march)
+        return frame[:, :, 0], frame[:, :, 1]
+
+    # Average and worst steps of every strategy in marches, with the fraction of pixels
+    # whose hit or miss differs from sphere tracing and the mean distance error on hits
+    def compare_marches(self, obj, time=0.0, mouse=None):
+        _, reference = self.march_steps(obj, time, mouse, 'sphere')
+        reference = reference.copy()
+        hits = reference < self.params['MAX_DISTANCE']
+        report = {}
+        for march in marches:
+            steps, distance = self.march_steps(obj, time, mouse, march)
+            hit = distance < self.params['MAX_DISTANCE']
+            both = hits & hit
+            report[march] = {'steps': float(steps.mean()),
+                             'max_steps': int(steps.max()),
+                             'mismatch': float((hit != hits).mean()),
+                             'error': float(abs(distance - reference)[both].mean()) if both.any() else 0.0}
+        return report
+
+    # Steps, distance evaluations and distance of every pixel, see diagnostics.Cost
+    def cost(self, obj, time=0.0, mouse=None):
+        from .diagnostics import Cost
+        frame = self.measure(obj, 'cost', time, mouse)
+        return Cost(frame, self.params['MAX_STEPS'], self.params['MAX_DISTANCE'])
+
+    # Draws frames offscreen without reading them and returns the profiler's summary,
+    # also saved as JSON with the scene and settings when a path is given. Every frame
+    # is finished before the next so frame times hold on drivers that defer drawing
+    def benchmark(self, obj, frames=100, time=0.0, mouse=None, path=None):
+        if not self.profiler:
+            from .profiling import Profiler
+            self.profiler = Profiler()
+        pipeline = self.offscreen_pipeline(obj)
+        uniforms = self.parameters.get(obj.name)
+        mouse = self.default_mouse() if mouse is None else mouse
+        # Leave out the first frame, drivers often finish compiling on first use
+        self.draw(pipeline, time, mouse, uniforms)
+        self.profiler.reset()
+        for _ in range(frames + 1):
+            self.draw(pipeline, time, mouse, uniforms)
+            backend('gl').glFinish()
+        self.profiler.finish()
+        if path:
+            self.profiler.export(path, **self.settings(obj))
+        return self.profiler.summary()
+
+    # What a benchmark ran, to tell exported runs apart
+    def settings(self, obj):
+        return {'scene': obj.name, 'size': list(self.size), 'march': self.march,
+                'adaptive': self.adaptive, 'prepass': list(self.prepass), 'optimize': self.optimize,
+                'bounds': self.bounds, 'uniforms': self.uniform_mode, 'footprint': self.footprint,
+                'gradient': self.gradient,
+                'params': {name: str(value) for name, value in self.params.items()}}
+
+    # shader is an Object or the source of a single pass program, eg. from save
+    def render(self, shader, uniforms=None, on_frame=None):
+        backend('window').render(self, shader, uniforms, on_frame)
+
+    # Same queries as the shader on the CPU, with this camera's march settings
+    def scene(self, obj, **uniforms):
+        return backend('cpu').Scene(obj, self.params['MAX_STEPS'], self.params['MAX_DISTANCE'],
+                                    self.params['MIN_DISTANCE'], **uniforms)
+
+    # The frame render_to_array draws, rendered with NumPy by workers processes for
+    # machines without a GPU, see software.py
+    def render_cpu(self, obj, time=0.0, mouse=None, workers=None, tile=32):
+        assert self.march == 'sphere' and not self.footprint, "The CPU renderer only sphere traces with MIN_DISTANCE"
+        software = backend('software')
+        mouse = self.default_mouse() if mouse is None else mouse
+        return software.render(software.Renderer(obj, self.size, self.params, time, mouse), workers, tile)
 
 
 def main():
@@ -0,0 +1,163 @@
+# mesh.py
+# Triangle meshes of a scene, from surface nets over the leaves of an octree that
+# only subdivides where the distance says the surface can pass
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import cpu
+from .march import Function
+
+# Corners of a unit cell, bit i of the index is the offset along axis i
+CORNERS = np.array([[(c >> 0) & 1, (c >> 1) & 1, (c >> 2) & 1] for c in range(8)])
+# Pairs of corners along the 12 edges of a cell
+EDGES = np.array([(a, b) for a in range(8) for b in range(a + 1, 8)
+                  if bin(a ^ b).count('1') == 1])
+# Level of the octree the branches are handed to workers at, up to 8**SPLIT of them
+SPLIT = 2
+
+
+class Grid:
+    # A cube around the bounds split into 2**depth cells per side
+    def __init__(self, bounds, depth):
+        lo, hi = np.asarray(bounds[0], float), np.asarray(bounds[1], float)
+        side = (hi - lo).max()
+        # A little room so surfaces on the bounds still close
+        side *= 1 + 4.0 / 2 ** depth
+        self.origin = (lo + hi) / 2 - side / 2
+        self.depth = depth
+        self.cells = 2 ** depth
+        self.h = side / self.cells
+
+    def position(self, corners):
+        return self.origin + corners * self.h
+
+    # Integer corner coordinates as one number each, for sorting and lookups
+    def key(self, corners):
+        n = self.cells + 1
+        return (corners[..., 0] * n + corners[..., 1]) * n + corners[..., 2]
+
+
+# Cells of a level, in units of finest cells, whose distance from the center is
+# within the half diagonal so the surface can pass through them
+def subdivide(obj, grid, cells, size, uniforms):
+    children = (cells[:, None, :] + CORNERS[None, :, :] * (size // 2)).reshape(-1, 3)
+    size //= 2
+    centers = grid.position(children + size / 2)
+    d = cpu.distance(obj, centers, **uniforms)
+    reach = np.sqrt(3) / 2 * size * grid.h
+    return children[np.abs(d) <= reach * 1.01], size
+
+
+# Finest cells under the given cells of side size and the distance at their corners
+def leaves(obj, grid, cells, size, uniforms):
+    while size > 1 and len(cells):
+        cells, size = subdivide(obj, grid, cells, size, uniforms)
+    corners = (cells[:, None, :] + CORNERS[None, :, :]).reshape(-1, 3)
+    keys, index = np.unique(grid.key(corners), return_inverse=True)
+    first = np.unique(index, return_index=True)[1]
+    d = cpu.distance(obj, grid.position(corners[first]), **uniforms)
+    return cells, d[index].reshape(-1, 8)
+
+
+def branch(name, grid, cells, size, uniforms):
+    # Runs in a worker, which finds the scene in the registry it forked with
+    return leaves(Function.registry[name], grid, cells, size, uniforms)
+
+
+def octree(obj, grid, workers, uniforms):
+    cells, size = np.zeros((1, 3), int), grid.cells
+    for _ in range(min(SPLIT, grid.depth)):
+        cells, size = subdivide(obj, grid, cells, size, uniforms)
+    if workers == 1 or len(cells) < 2:
+        return leaves(obj, grid, cells, size, uniforms)
+
+    # Branches don't depend on each other, give every worker a few
+    chunks = [chunk for chunk in np.array_split(cells, workers * 4) if len(chunk)]
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        results = list(pool.map(branch, *zip(*[(obj.name, grid, chunk, size, uniforms) for chunk in chunks])))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+# One vertex per cell the surface crosses, the average of where it crosses the cell's edges
+def vertices(grid, cells, d):
+    inside = d < 0
+    crossing = inside[:, EDGES[:, 0]] != inside[:, EDGES[:, 1]]
+    active = crossing.any(axis=1)
+    cells, d, crossing = cells[active], d[active], crossing[active]
+
+    a, b = d[:, EDGES[:, 0]], d[:, EDGES[:, 1]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(crossing, a / (a - b), 0.0)
+    points = CORNERS[EDGES[:, 0]] + t[..., None] * (CORNERS[EDGES[:, 1]] - CORNERS[EDGES[:, 0]])
+    local = (points * crossing[..., None]).sum(axis=1) / crossing.sum(axis=1)[:, None]
+    return cells, d, grid.position(cells + local)
+
+
+# A quad between the four cells around every edge the surface crosses
+def faces(grid, cells, d):
+    keys = grid.key(cells)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    quads = []
+    for axis in range(3):
+        u, v = [i for i in range(3) if i != axis]
+        # The edge along axis from each cell's lowest corner, owned by that cell
+        end = 1 << axis
+        crossing = (d[:, 0] < 0) != (d[:, end] < 0)
+        # (u, v) is right handed around the axis except for y, where it's (x, z)
+        start, flip = cells[crossing], (d[crossing, 0] < 0) == (axis == 1)
+        around = []
+        for du, dv in ((0, 0), (1, 0), (1, 1), (0, 1)):
+            offset = np.zeros(3, int)
+            offset[u], offset[v] = du, dv
+            around.append(grid.key(start - offset))
+        around = np.stack(around, axis=1)
+        found = np.searchsorted(sorted_keys, around).clip(0, len(keys) - 1)
+        complete = (sorted_keys[found] == around).all(axis=1)
+        quad = order[found[complete]]
+        # Wind them so normals point out of the surface
+        quad[flip[complete]] = quad[flip[complete]][:, ::-1]
+        quads.append(quad)
+    quads = np.concatenate(quads)
+    return np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]]).astype(np.int32)
+
+
+# (vertices, faces) of obj inside bounds=(lo, hi) with 2**depth cells per side.
+# Bounds are found for objects built from unions of bounded primitives. Scenes
+# need NumPy versions of their functions, see cpu.find, and uniforms such as
+# iTime are passed to the evaluator. workers > 1 forks a process per worker
+def mesh(obj, bounds=None, depth=7, workers=None, **uniforms):
+    if bounds is None:
+        from .optimize import Optimizer, object_bounds
+        bounds = object_bounds(obj, Optimizer(obj))
+        assert bounds, "Could not find bounds for %r, pass bounds=(lo, hi)" % obj.name
+    grid = Grid(bounds, depth)
+    cells, d = octree(obj, grid, workers or os.cpu_count(), uniforms)
+    cells, d, points = vertices(grid, cells, d)
+    return points.astype(np.float32), faces(grid, cells, d)
+
+
+def write_ply(path, vertices, faces):
+    with open(path, 'wb') as f:
+        f.write(('ply\nformat binary_little_endian 1.0\n'
+                 'element vertex %d\nproperty float x\nproperty float y\nproperty float z\n'
+                 'element face %d\nproperty list uchar int vertex_indices\nend_header\n'
+                 % (len(vertices), len(faces))).encode())
+        f.write(vertices.astype('<f4').tobytes())
+        face_records = np.empty(len(faces), dtype=[('n', 'u1'), ('v', '<i4', 3)])
+        face_records['n'] = 3
+        face_records['v'] = faces
+        f.write(face_records.tobytes())
+
+
+def write_obj(path, vertices, faces):
+    with open(path, 'w') as f:
+        for x, y, z in vertices:
+            f.write('v %g %g %g\n' % (x, y, z))
+        # OBJ counts from 1
+        for a, b, c in faces + 1:
+            f.write('f %d %d %d\n' % (a, b, c))
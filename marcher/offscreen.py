@@ -0,0 +1,132 @@
+# offscreen.py
+# Windowless GL context and framebuffer for rendering frames into NumPy arrays
+import ctypes
+import os
+
+import numpy as np
+from .gl import *
+
+
+def create_context():
+    platform = os.environ.get('PYOPENGL_PLATFORM')
+    if platform == 'osmesa':
+        return OSMesaContext()
+    assert platform == 'egl', \
+        "Offscreen rendering needs PYOPENGL_PLATFORM set to 'egl' or 'osmesa' before OpenGL is imported"
+    return EGLContext()
+
+
+class EGLContext:
+    def __init__(self):
+        from OpenGL import EGL
+        # Mesa can create contexts without any window system, eg. llvmpipe on a server
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        assert EGL.eglInitialize(self.display, None, None), "Could not initialize EGL"
+
+        attributes = (EGL.EGLint * 5)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                      EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                      EGL.EGL_NONE)
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count))
+        assert count.value, "No EGL config supports desktop OpenGL"
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, None)
+        assert self.context, "Could not create EGL context"
+        self.make_current()
+
+    def make_current(self):
+        from OpenGL import EGL
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+
+
+class OSMesaContext:
+    def __init__(self):
+        from OpenGL import osmesa
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        assert self.context, "Could not create OSMesa context"
+        # OSMesa needs a default buffer even though we only draw into framebuffers
+        self.buffer = np.zeros((1, 1, 4), np.uint8)
+        self.make_current()
+
+    def make_current(self):
+        from OpenGL import osmesa
+        osmesa.OSMesaMakeCurrent(self.context, self.buffer.ctypes.data, GL_UNSIGNED_BYTE, 1, 1)
+
+
+class Offscreen:
+    def __init__(self, size):
+        self.size = width, height = size
+        self.context = create_context()
+
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        self.renderbuffer = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.renderbuffer)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.renderbuffer)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE, "Incomplete framebuffer"
+        glViewport(0, 0, width, height)
+
+        # Reused for every frame, callers copy if they want to keep one
+        self.pixels = np.empty((height, width, 4), np.uint8)
+
+    def bind(self):
+        self.context.make_current()
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glViewport(0, 0, *self.size)
+
+    def read(self):
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, *self.size, GL_RGBA, GL_UNSIGNED_BYTE, self.pixels)
+        # GL rows start at the bottom
+        return self.pixels[::-1, :, :3]
+
+
+# Reads frames back through a ring of pixel buffers, each frame is only mapped once
+# the ones after it have been queued so the GPU never waits on the CPU
+class Readback:
+    def __init__(self, size, count=3):
+        self.size = width, height = size
+        self.nbytes = width * height * 4
+        self.buffers = [int(buffer) for buffer in glGenBuffers(count)]
+        for buffer in self.buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.nbytes, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.fences = [None] * count
+        self.queued = 0
+        self.done = 0
+        self.pixels = np.empty((height, width, 4), np.uint8)
+
+    def full(self):
+        return self.queued - self.done == len(self.buffers)
+
+    def empty(self):
+        return self.queued == self.done
+
+    # Copies the bound framebuffer into the next buffer without waiting for it
+    def queue(self):
+        assert not self.full(), "Take a frame out before queueing another"
+        slot = self.queued % len(self.buffers)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[slot])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, *self.size, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.fences[slot] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.queued += 1
+
+    # Oldest queued frame as a (height, width, 4) view of a reused array, rows top first
+    def take(self):
+        assert not self.empty(), "No frame was queued"
+        slot = self.done % len(self.buffers)
+        glClientWaitSync(self.fences[slot], GL_SYNC_FLUSH_COMMANDS_BIT, GL_TIMEOUT_IGNORED)
+        glDeleteSync(self.fences[slot])
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[slot])
+        glGetBufferSubData(GL_PIXEL_PACK_BUFFER, 0, self.nbytes, self.pixels)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.done += 1
+        # GL rows start at the bottom
+        return self.pixels[::-1]
@@ -0,0 +1,706 @@
+# optimize.py
+# Compiler pass over the lines of an Object: hash-conses Call trees so every
+# distinct subexpression is emitted once, folds chained Translates, pulls
+# subtrees that only differ in their point into shared helper functions and
+# skips expensive subtrees when the point is far from their bounding box
+import re
+
+from .march import Function, Primitive, Combinator, Object, Var, vec, make_param, literal, is_constant
+
+# Combinators that only take the min, max or negation of their arguments
+MINMAX = {'Union', 'Intersect', 'Subtract'}
+
+# Axis aligned bounds (lo, hi) of a primitive around its point, given its other arguments
+bounds = {}
+
+
+def bound(fn):
+    bounds[fn.__name__] = fn
+    return fn
+
+
+@bound
+def Sphere(r):
+    return [-r] * 3, [r] * 3
+
+
+@bound
+def Box(b):
+    return [-f for f in b.floats], b.floats
+
+
+@bound
+def CylinderY(h):
+    r, y = h.floats
+    return [-r, -y, -r], [r, y, r]
+
+
+@bound
+def CylinderZ(h):
+    r, z = h.floats
+    return [-r, -r, -z], [r, r, z]
+
+
+@bound
+def CylinderX(h):
+    r, x = h.floats
+    return [-x, -r, -r], [x, r, r]
+
+
+class Node:
+    def __init__(self, name, args, uid):
+        self.name = name
+        self.args = args
+        self.uid = uid
+
+
+# Nodes reachable from roots once, children before parents and left to right,
+# skipping known(node) and everything below it. Walked with a stack, scenes can
+# nest far deeper than the recursion limit
+def postorder(roots, known=lambda node: False):
+    seen = set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+        elif isinstance(node, Node) and id(node) not in seen and not known(node):
+            seen.add(id(node))
+            stack.append((node, True))
+            stack.extend((arg, False) for arg in reversed(node.args))
+
+
+# memo[key(node)] for node and everything below it, computed children first so
+# compute never finds more than one level missing
+def fill(memo, node, compute, key=lambda node: node.uid,
+         below=lambda node: [arg for arg in node.args if isinstance(arg, Node)]):
+    if key(node) in memo:
+        return memo[key(node)]
+    stack = [node]
+    while stack:
+        top = stack[-1]
+        missing = [arg for arg in below(top) if key(arg) not in memo]
+        if missing:
+            stack.extend(missing)
+            continue
+        stack.pop()
+        memo[key(top)] = compute(top)
+    return memo[key(node)]
+
+
+# Copy of node in interner with every argument that matches replaced
+def substitute(interner, node, matches, replacement):
+    copies = {}
+
+    def copy(arg):
+        if matches(arg):
+            return replacement
+        return copies[id(arg)] if isinstance(arg, Node) else arg
+
+    for child in postorder([node], matches):
+        copies[id(child)] = interner.intern(child.name, [copy(arg) for arg in child.args])
+    return copy(node)
+
+
+# A variable as it was when read, p before and after 'p = Mirror(p)' differ
+class Symbol(Var):
+    def __init__(self, name, version):
+        super().__init__(name)
+        self.version = version
+
+
+class Interner:
+    # Hoisted constants are uniforms of their own placement, so they never make two
+    # nodes equal and Translates by them are kept as written
+    def __init__(self, hoisted=False):
+        self.nodes = {}
+        # Version of each variable, bumped when a line assigns to it
+        self.versions = {}
+        self.hoisted = hoisted
+        self.constants = 0
+
+    def key(self, arg):
+        if isinstance(arg, Node):
+            return 'n', arg.uid
+        elif isinstance(arg, Var):
+            return 'var', arg.name, getattr(arg, 'version', 0)
+        elif isinstance(arg, vec):
+            return ('v',) + tuple(self.key(f) for f in arg.floats)
+        if self.hoisted:
+            self.constants += 1
+            return 'f', self.constants
+        return 'f', float(arg)
+
+    def intern(self, name, args):
+        key = (name,) + tuple(self.key(arg) for arg in args)
+        if key not in self.nodes:
+            self.nodes[key] = Node(name, args, len(self.nodes))
+        return self.nodes[key]
+
+    def lower(self, value):
+        if isinstance(value, Var):
+            return Symbol(value.name, self.versions.get(value.name, 0))
+        elif isinstance(value, vec):
+            return vec(*[self.lower(f) for f in value.floats])
+        elif not isinstance(value, Function.Call):
+            return value
+        # Calls children first with a stack. get_args makes new Translates every
+        # time, so each call is asked once and kept alive while its id is in use
+        lowered = {}
+        stack = [(value, value.get_args())]
+        while stack:
+            call, args = stack[-1]
+            pending = [(arg, arg.get_args()) for arg in args
+                       if isinstance(arg, Function.Call) and id(arg) not in lowered]
+            if pending:
+                stack.extend(reversed(pending))
+                continue
+            stack.pop()
+            if id(call) in lowered:
+                continue
+            args = [lowered[id(arg)][1] if isinstance(arg, Function.Call) else self.lower(arg) for arg in args]
+            node = self.translate(*args) if call.name == 'Translate' else self.intern(call.name, args)
+            lowered[id(call)] = (call, node)
+        return lowered[id(value)][1]
+
+    def translate(self, p, t):
+        if is_constant(t) and not self.hoisted:
+            # Translating by nothing is a no-op
+            if not any(t.floats):
+                return p
+            if isinstance(p, Node) and p.name == 'Translate' and is_constant(p.args[1]):
+                inner = p.args[1]
+                return self.translate(p.args[0], vec(*[a + b for a, b in zip(inner.floats, t.floats)]))
+        return self.intern('Translate', [p, t])
+
+
+class Optimizer:
+    def __init__(self, obj, guards=False, margin=0.1, hoisted=False):
+        self.obj = obj
+        self.guards = guards
+        self.hoisted = hoisted
+        self.interner = Interner(hoisted)
+        # Return type and parameter names of generated helpers
+        self.helpers = {}
+        self.helper_bounds = {}
+        self.margin = margin
+        # Object parameters, inline Vars naming one of these aren't constant
+        self.variables = re.compile(r'\b(%s)\b' % '|'.join(obj.params))
+
+    def signature(self, name):
+        if name in self.helpers:
+            return self.helpers[name]
+        fn = Function.registry[name]
+        return fn.return_type, list(fn.params)
+
+    def compile(self):
+        interner = self.interner
+        lines = []
+        for var, value in self.obj.lines:
+            node = interner.lower(value)
+            lines.append((var, node))
+            interner.versions[var.name] = interner.versions.get(var.name, 0) + 1
+
+        source = ''
+        # Helpers are shared between placements, hoisted constants aren't
+        if not self.hoisted:
+            helpers = Helpers(self, [node for _, node in lines])
+            lines = [(var, helpers.rebuild(node)) for var, node in lines]
+            source = helpers.source
+
+        if self.guards:
+            guards = Guards(self, [node for _, node in lines])
+            lines = [(var, guards.rebuild(node)) for var, node in lines]
+            source += guards.source
+
+        body = Emitter(self).emit(lines)
+        return source, body
+
+
+class Helpers:
+    # Finds the largest Primitive/Combinator subtrees that only depend on a
+    # single point, and gives each shape that occurs more than once a helper
+    # function of that point
+    def __init__(self, optimizer, roots):
+        self.optimizer = optimizer
+        self.interner = optimizer.interner
+        self.points = {}
+        self.sizes = {}
+        self.shapes = {}
+        self.replace = {}
+        self.rebuilt = {}
+        self.source = ''
+
+        # Children before parents, so each node only looks up its arguments
+        for node in postorder(roots):
+            self.points[node.uid] = self.find_point(node)
+            self.sizes[node.uid] = self.find_size(node)
+            self.shapes[node.uid] = self.find_shape(node)
+
+        # Distinct nodes of every shape worth a function call
+        groups = {}
+        for node in self.walk(roots):
+            if self.size(node) >= 2:
+                groups.setdefault(self.shape(node), []).append(node)
+
+        names = {}
+        for node in self.walk(roots, lambda node: len(groups.get(self.shape(node), [])) > 1):
+            shape = self.shape(node)
+            if len(groups.get(shape, [])) < 2:
+                continue
+            if shape not in names:
+                names[shape] = '%s_s%d' % (optimizer.obj.name, len(optimizer.helpers))
+                optimizer.helpers[names[shape]] = (float, ['p'])
+                self.source += self.helper(names[shape], node)
+            self.replace[node.uid] = self.interner.intern(names[shape], [self.point(node)])
+        self.rebuilt.update(self.replace)
+
+    # Every node reachable from roots once, without descending below stop(node)
+    @staticmethod
+    def walk(roots, stop=lambda node: False):
+        seen = set()
+        stack = list(roots)
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, Node) or node.uid in seen:
+                continue
+            seen.add(node.uid)
+            yield node
+            if not stop(node):
+                stack.extend(node.args)
+
+    def closed(self, arg):
+        if isinstance(arg, Node):
+            return False
+        if isinstance(arg, Var):
+            return not self.optimizer.variables.search(arg.name)
+        if isinstance(arg, vec):
+            return all(self.closed(f) for f in arg.floats)
+        return True
+
+    # The single point a float subtree is evaluated at, or None
+    def point(self, node):
+        return self.points[node.uid]
+
+    def find_point(self, node):
+        fn = Function.registry.get(node.name)
+        point = None
+        if isinstance(fn, Primitive) and not isinstance(fn, Object):
+            if not is_constant(node.args[0]) and all(self.closed(arg) for arg in node.args[1:]):
+                point = node.args[0]
+        elif isinstance(fn, Combinator):
+            points = set()
+            for arg in node.args:
+                if isinstance(arg, Node):
+                    child = self.point(arg)
+                    if child is None:
+                        points.add(None)
+                    else:
+                        points.add(self.interner.key(child))
+                        point = child
+                elif not self.closed(arg):
+                    points.add(None)
+            if len(points) != 1 or None in points:
+                point = None
+        return point
+
+    def size(self, node):
+        return self.sizes[node.uid]
+
+    def find_size(self, node):
+        if self.point(node) is None:
+            return 0
+        return 1 + sum(self.size(arg) for arg in node.args if isinstance(arg, Node) and arg is not self.point(node))
+
+    # Structural key of a subtree with its point left out
+    def shape(self, node):
+        return self.shapes[node.uid]
+
+    def find_shape(self, node):
+        if self.point(node) is None:
+            return None
+        point = self.interner.key(self.point(node))
+        key = [node.name]
+        for arg in node.args:
+            arg_key = self.interner.key(arg)
+            if arg_key == point:
+                key.append('p')
+            elif isinstance(arg, Node):
+                key.append(self.shape(arg))
+            else:
+                key.append(arg_key)
+        return tuple(key)
+
+    def helper(self, name, node):
+        point = self.interner.key(self.point(node))
+        body = substitute(Interner(), node, lambda arg: self.interner.key(arg) == point, Var('p'))
+        # Call sites get guarded instead of the helper itself
+        self.optimizer.helper_bounds[name] = Bounds(self.optimizer).find(body)
+        return 'float ' + name + '(vec3 p)\n{\n' + Emitter(self.optimizer).emit([(None, body)]) + '\n}\n'
+
+    # Replaced subtrees are already in rebuilt
+    def rebuild(self, node):
+        if not isinstance(node, Node):
+            return node
+        return fill(self.rebuilt, node, self.copy)
+
+    def copy(self, node):
+        return self.interner.intern(node.name, [self.rebuild(arg) for arg in node.args])
+
+
+class Bounds:
+    # Bounding boxes of float subtrees around the point they are evaluated at,
+    # looking through constant Translates
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+        self.found = {}
+        self.costs = {}
+
+    @staticmethod
+    def key(point):
+        if isinstance(point, Node):
+            return 'n', id(point)
+        return 'var', point.name, getattr(point, 'version', 0)
+
+    def base(self, point):
+        offset = [0.0] * 3
+        while isinstance(point, Node) and point.name == 'Translate' and is_constant(point.args[1]):
+            offset = [o + t for o, t in zip(offset, point.args[1].floats)]
+            point = point.args[0]
+        return point, offset
+
+    # (point, lo, hi) or None when unbounded
+    def find(self, node):
+        if not isinstance(node, Node):
+            return None
+        # Nodes of helper bodies come from other interners, ids don't clash
+        return fill(self.found, node, self.compute, id)
+
+    def compute(self, node):
+        fn = Function.registry.get(node.name)
+        if isinstance(fn, Object):
+            local = object_bounds(fn, self.optimizer)
+            if local is None:
+                return None
+            point, offset = self.base(node.args[-2])
+            lo, hi = local
+            return point, [l + o for l, o in zip(lo, offset)], [h + o for h, o in zip(hi, offset)]
+
+        if node.name in bounds or node.name in self.optimizer.helper_bounds:
+            if not all(is_constant(arg) for arg in node.args[1:]):
+                return None
+            if node.name in bounds:
+                local = bounds[node.name](*node.args[1:])
+            else:
+                local = self.optimizer.helper_bounds[node.name]
+                if local is None:
+                    return None
+                local = local[1:]
+            point, offset = self.base(node.args[0])
+            lo, hi = local
+            return point, [l + o for l, o in zip(lo, offset)], [h + o for h, o in zip(hi, offset)]
+
+        if node.name not in MINMAX:
+            return None
+        children = [self.find(arg) for arg in node.args]
+        if node.name == 'Subtract':
+            children = children[:1]
+        elif node.name == 'Intersect':
+            # The intersection is inside any one of them
+            children = [child for child in children if child] or [None]
+        if None in children or len(set(self.key(child[0]) for child in children)) != 1:
+            return None
+
+        point = children[0][0]
+        if node.name == 'Intersect':
+            lo = [max(c) for c in zip(*[child[1] for child in children])]
+            hi = [min(c) for c in zip(*[child[2] for child in children])]
+        else:
+            lo = [min(c) for c in zip(*[child[1] for child in children])]
+            hi = [max(c) for c in zip(*[child[2] for child in children])]
+        return point, lo, hi
+
+    # Number of primitives evaluated by a subtree, below 2 a guard costs more than it saves
+    def cost(self, node):
+        if not isinstance(node, Node):
+            return 0
+        return fill(self.costs, node, self.count, id)
+
+    def count(self, node):
+        if node.name == 'Translate':
+            return 0
+        fn = Function.registry.get(node.name)
+        if isinstance(fn, Object):
+            return len(fn.lines)
+        if node.name in self.optimizer.helpers or node.name in bounds:
+            return 2 if node.name in self.optimizer.helpers else 1
+        return sum(self.cost(arg) for arg in node.args)
+
+
+# Bounds of an object that only adds to res, ie. every line is res=Union(res,...)
+# so that far from its bounding box it returns the res it was passed
+def object_bounds(fn, optimizer):
+    fn.evaluate()
+    interner = Interner()
+    finder = Bounds(optimizer)
+    found = []
+    for var, value in fn.lines:
+        node = interner.lower(value)
+        if var.name != 'res' or not isinstance(node, Node) or node.name != 'Union':
+            return None
+        res, other = node.args
+        if not isinstance(res, Var) or res.name != 'res':
+            return None
+        other = finder.find(other)
+        if not other or Bounds.key(other[0]) != ('var', 'p', 0):
+            return None
+        found.append(other)
+    if not found:
+        return None
+    return [min(c) for c in zip(*[f[1] for f in found])], [max(c) for c in zip(*[f[2] for f in found])]
+
+
+# Bounds of an object on its own, as the DE evaluates it with nothing in res, for any
+# mix of Union, Intersect and Subtract of bounded primitives around the original p
+def standalone_bounds(fn, optimizer):
+    fn.evaluate()
+    interner = Interner()
+    finder = Bounds(optimizer)
+    # Value of every version of res, the first is empty
+    values = [None]
+    for var, value in fn.lines:
+        node = interner.lower(value)
+        if var.name == 'res':
+            values.append(node)
+        interner.versions[var.name] = interner.versions.get(var.name, 0) + 1
+
+    # Each version of res is below the Symbols that read it
+    def below(node):
+        if isinstance(node, Symbol) and node.name == 'res':
+            return [values[node.version]] if node.version else []
+        if isinstance(node, Node) and node.name in MINMAX:
+            return node.args
+        return []
+
+    extents = {}
+
+    def extent(node):
+        if isinstance(node, Symbol) and node.name == 'res':
+            return extents[id(values[node.version])] if node.version else 'empty'
+        if isinstance(node, Node) and node.name in MINMAX:
+            children = [extents[id(arg)] for arg in node.args]
+            if node.name == 'Subtract':
+                return children[0]
+            if node.name == 'Intersect':
+                if 'empty' in children:
+                    return 'empty'
+                children = [child for child in children if child]
+                if not children:
+                    return None
+                return [max(c) for c in zip(*[child[0] for child in children])], \
+                       [min(c) for c in zip(*[child[1] for child in children])]
+            if None in children:
+                return None
+            children = [child for child in children if child != 'empty']
+            if not children:
+                return 'empty'
+            return [min(c) for c in zip(*[child[0] for child in children])], \
+                   [max(c) for c in zip(*[child[1] for child in children])]
+        found = finder.find(node)
+        if not found or Bounds.key(found[0]) != ('var', 'p', 0):
+            return None
+        return found[1], found[2]
+
+    # Children first with a stack, Union chains nest far deeper than the recursion limit
+    found = fill(extents, values[-1], extent, id, below)
+    return found if found != 'empty' else None
+
+
+# Guards are only sound if every value they replace reaches the DE through
+# Union, Intersect and Subtract. A guard only changes values that are already
+# larger than the margin into smaller positive ones, which keeps the sign, and
+# the surface, of any min/max/negation of them and never overestimates the
+# distance outside. Anything else, eg. a smooth union, can move the surface.
+def guardable(obj):
+    for name in obj.resolve():
+        fn = Function.registry[name]
+        if isinstance(fn, Object):
+            fn.evaluate()
+            if not all(safe_tree(value, True) for _, value in fn.lines):
+                return False
+    return True
+
+
+def safe_tree(value, safe):
+    stack = [(value, safe)]
+    while stack:
+        value, safe = stack.pop()
+        if isinstance(value, Var):
+            if not safe and value.name == 'res':
+                return False
+        elif isinstance(value, Function.Call):
+            fn = Function.registry[value.name]
+            if isinstance(fn, Object) and not safe:
+                return False
+            # The res passed into an object is checked with that object
+            safe = safe and (value.name in MINMAX or isinstance(fn, Object))
+            stack.extend((arg, safe) for arg in value.get_args())
+    return True
+
+
+class Guards:
+    # Replaces bounded subtrees that are in a safe position with a call to a
+    # function that returns the distance to their bounding box when the
+    # point is further away than the margin
+    def __init__(self, optimizer, roots):
+        self.optimizer = optimizer
+        self.interner = optimizer.interner
+        self.bounds = Bounds(optimizer)
+        self.replace = {}
+        self.rebuilt = {}
+        self.source = ''
+
+        # A node is in a safe position when every use reaches its line
+        # through Union, Intersect or Subtract, parents are visited first
+        order = list(postorder(roots))
+        safe = {root.uid: True for root in roots if isinstance(root, Node)}
+        for node in reversed(order):
+            for arg in node.args:
+                if isinstance(arg, Node):
+                    arg_safe = safe.get(node.uid, False) and node.name in MINMAX
+                    safe[arg.uid] = safe.get(arg.uid, True) and arg_safe
+
+        for node in Helpers.walk(roots, lambda node: node.uid in self.replace):
+            if safe.get(node.uid) and self.bounds.cost(node) >= 2 and self.bounds.find(node):
+                self.replace[node.uid] = self.guard(node)
+        self.rebuilt.update(self.replace)
+
+    def guard(self, node):
+        point, lo, hi = self.bounds.find(node)
+        center = vec(*[(l + h) * 0.5 for l, h in zip(lo, hi)])
+        size = vec(*[(h - l) * 0.5 for l, h in zip(lo, hi)])
+        interner = Interner()
+        key = Bounds.key(point)
+        body = substitute(interner, node, lambda arg: isinstance(arg, (Node, Var)) and Bounds.key(arg) == key, Var('p'))
+
+        name = '%s_b%d' % (self.optimizer.obj.name, len(self.optimizer.helpers))
+        # Far away an object returns the res it was given
+        far = '_b'
+        args = [point]
+        if isinstance(Function.registry.get(node.name), Object):
+            body = interner.intern(body.name, body.args[:-1] + [Var('res')])
+            far = 'min(res,_b)'
+            args.append(node.args[-1])
+        self.optimizer.helpers[name] = (float, ['p', 'res'][:len(args)])
+
+        # Bounds are baked in, never hoisted into uniforms
+        self.source += 'float ' + name + '(vec3 p' + (',float res' if len(args) > 1 else '') + ')\n{\n'
+        self.source += 'vec3 _q=abs(p-' + repr_vec(center) + ')-' + repr_vec(size) + ';\n'
+        self.source += 'float _b=length(max(_q,0.0));\n'
+        self.source += 'if(_b>' + str(float(self.optimizer.margin)) + ') return ' + far + ';\n'
+        self.source += Emitter(self.optimizer).emit([(None, body)]) + '\n}\n'
+        return self.interner.intern(name, args)
+
+    rebuild = Helpers.rebuild
+    copy = Helpers.copy
+
+
+def repr_vec(v):
+    return v.get_type() + '(' + ','.join(str(f) for f in v.floats) + ')'
+
+
+class Emitter:
+    # Writes lines of Node trees, anything used more than once becomes a local.
+    # Trees are walked with stacks and written piece by piece into out, so the
+    # time and memory it takes grow with the number of nodes however deep they nest
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+        self.uses = {}
+        self.locals = {}
+        # Text of the constant arguments of every node until it's written, None for nodes
+        self.parts = {}
+        self.out = []
+
+    def count(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Node):
+                self.uses[node.uid] = self.uses.get(node.uid, 0) + 1
+                if self.uses[node.uid] == 1:
+                    stack.extend(node.args)
+
+    # Visits node like a recursive descent would, so constants are hoisted in the
+    # order they are written, and declares the locals below it before anything uses them
+    def declare(self, node):
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, Node):
+                if item.uid in self.locals or item.uid in self.parts:
+                    continue
+                _, params = self.optimizer.signature(item.name)
+                parts = self.parts[item.uid] = []
+                below = []
+                for arg, param in zip(item.args, params):
+                    if isinstance(arg, Node):
+                        parts.append(None)
+                        below.append(arg)
+                    elif below:
+                        # Hoisted after the nodes before it
+                        parts.append(None)
+                        below.append(('constant', parts, len(parts) - 1, arg, item.name + '.' + param))
+                    else:
+                        parts.append(literal(arg, item.name + '.' + param))
+                if self.uses[item.uid] > 1:
+                    stack.append(('local', item))
+                stack.extend(reversed(below))
+            elif item[0] == 'constant':
+                _, parts, i, arg, name = item
+                parts[i] = literal(arg, name)
+            else:
+                # Everything below is declared, written once here and named after
+                node = item[1]
+                name = '_t%d' % len(self.locals)
+                return_type, _ = self.optimizer.signature(node.name)
+                self.out.append(make_param(return_type) + ' ' + name + '=')
+                self.write(node)
+                self.out.append(';\n')
+                self.locals[node.uid] = name
+
+    def write(self, node):
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                self.out.append(item)
+            elif item.uid in self.locals:
+                self.out.append(self.locals[item.uid])
+            else:
+                parts = self.parts.pop(item.uid)
+                if None not in parts:
+                    self.out.append(item.name + '(' + ','.join(parts) + ')')
+                    continue
+                pieces = [item.name + '(']
+                for i, (arg, text) in enumerate(zip(item.args, parts)):
+                    if i:
+                        pieces.append(',')
+                    pieces.append(arg if text is None else text)
+                pieces.append(')')
+                stack.extend(reversed(pieces))
+
+    def emit(self, lines):
+        for _, node in lines:
+            self.count(node)
+        for var, node in lines:
+            if isinstance(node, Node):
+                self.declare(node)
+            self.out.append('return ' if var is None else str(var) + '=')
+            if isinstance(node, Node):
+                self.write(node)
+            else:
+                self.out.append(str(node))
+            self.out.append(';' if var is None else ';\n')
+        if not lines or lines[-1][0] is not None:
+            self.out.append('return ' + str(Var('res')) + ';')
+        return ''.join(self.out)
@@ -0,0 +1,581 @@
+# pipeline.py
+# Passes that draw a compiled object into whichever framebuffer is bound
+import ctypes
+from time import perf_counter
+
+import numpy as np
+from .gl import *
+
+
+class Pass:
+    def __init__(self, program, size):
+        self.program = program
+        self.size = size
+        self.resolution = glGetUniformLocation(program, "iResolution")
+        self.time = glGetUniformLocation(program, "iTime")
+        self.mouse = glGetUniformLocation(program, "iMouse")
+        self.locations = {}
+        # Textures of baked objects, shared by the passes of a pipeline
+        self.volumes = None
+        # (x0, y0, x1, y1) in pixels to draw instead of the whole frame
+        self.rects = None
+
+    def location(self, name):
+        if name not in self.locations:
+            self.locations[name] = glGetUniformLocation(self.program, name)
+        return self.locations[name]
+
+    def draw(self, time, mouse, uniforms=None):
+        glUseProgram(self.program)
+        if self.volumes:
+            self.volumes.bind(self)
+        if uniforms:
+            uniforms.upload(self.program)
+        glUniform2fv(self.resolution, 1, self.size)
+        glUniform1f(self.time, time)
+        glUniform2fv(self.mouse, 1, mouse)
+        if self.rects is None:
+            glRecti(-1, -1, 1, 1)
+        else:
+            for x0, y0, x1, y1 in self.rects:
+                glRectf(2 * x0 / self.size[0] - 1, 2 * y0 / self.size[1] - 1,
+                        2 * x1 / self.size[0] - 1, 2 * y1 / self.size[1] - 1)
+
+
+class SinglePass:
+    def __init__(self, program, size):
+        self.main = Pass(program, size)
+        self.passes = [self.main]
+
+    def draw(self, time, mouse, uniforms=None):
+        self.main.draw(time, mouse, uniforms)
+
+    def report(self, stats, wait=False):
+        pass
+
+
+# Tiles of the frame drawn with the programs groups(mouse) returns as [(program, rects)],
+# asked again when the mouse moves since what a tile can see changes with the view.
+# Pruning only holds for the view it was done for, so while the mouse moves the whole
+# program draws the frame and the tiles are pruned again once the mouse has stayed
+# put for settle frames, 0 prunes for every new view straight away
+class Tiled:
+    def __init__(self, groups, program, mouse, size, settle=0):
+        self.size = size
+        self.groups = groups
+        self.whole = Pass(program, size)
+        self.settle = settle
+        self.still = 0
+        self.passes = [self.whole]
+        self.update(mouse)
+
+    def update(self, mouse):
+        self.mouse = self.pruned = tuple(mouse)
+        self.tiles = []
+        for program, rects in self.groups(mouse):
+            draw_pass = Pass(program, self.size)
+            draw_pass.rects = rects
+            draw_pass.volumes = self.whole.volumes
+            self.tiles.append(draw_pass)
+        self.passes = [self.whole] + self.tiles
+
+    def draw(self, time, mouse, uniforms=None):
+        mouse = tuple(mouse)
+        self.still = self.still + 1 if mouse == self.mouse else 0
+        self.mouse = mouse
+        if mouse != self.pruned and self.still >= self.settle:
+            self.update(mouse)
+        for draw_pass in self.tiles if mouse == self.pruned else [self.whole]:
+            draw_pass.draw(time, mouse, uniforms)
+
+    def report(self, stats, wait=False):
+        pass
+
+
+def texture(size, internal_format, pixel_type):
+    name = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, name)
+    glTexImage2D(GL_TEXTURE_2D, 0, internal_format, size[0], size[1], 0, GL_RGBA, pixel_type, None)
+    # Neighbours are read texel by texel
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    return name
+
+
+# 3D textures of the functions that sample them, by sampler name. Half floats are filtered
+# and anything else is read texel by texel. Bound on the units after the ones the pipelines
+# use for their own textures, and uploaded again whenever a function's version changes
+class Volumes:
+    first_unit = 2
+
+    def __init__(self, owners):
+        self.owners = owners
+        self.versions = {}
+        self.textures = {}
+
+    def upload(self, owner):
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for name, data in owner.volumes.items():
+            depth, height, width = data.shape[:3]
+            channels = data.shape[3] if data.ndim == 4 else 1
+            linear = data.dtype == np.float16
+            internal_format = {(1, True): GL_R16F, (1, False): GL_R32F, (4, False): GL_RGBA32F}[channels, linear]
+            if name not in self.textures:
+                self.textures[name] = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_3D, self.textures[name])
+            glTexImage3D(GL_TEXTURE_3D, 0, internal_format, width, height, depth, 0,
+                         GL_RED if channels == 1 else GL_RGBA, GL_HALF_FLOAT if linear else GL_FLOAT,
+                         np.ascontiguousarray(data))
+            for parameter in (GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER):
+                glTexParameteri(GL_TEXTURE_3D, parameter, GL_LINEAR if linear else GL_NEAREST)
+            for parameter in (GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_TEXTURE_WRAP_R):
+                glTexParameteri(GL_TEXTURE_3D, parameter, GL_CLAMP_TO_EDGE)
+        glBindTexture(GL_TEXTURE_3D, 0)
+        self.versions[owner.name] = getattr(owner, 'version', 0)
+
+    def bind(self, draw_pass):
+        for owner in self.owners:
+            if self.versions.get(owner.name) != getattr(owner, 'version', 0):
+                self.upload(owner)
+        # Passes can be drawn in between binding textures of their own
+        active = glGetIntegerv(GL_ACTIVE_TEXTURE)
+        for unit, (name, texture) in enumerate(self.textures.items(), self.first_unit):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            glBindTexture(GL_TEXTURE_3D, texture)
+            glUniform1i(draw_pass.location(name), unit)
+        glActiveTexture(active)
+
+
+# Upscales the part of iSource the scene was drawn into to the whole target, sharpened
+# with an unsharp mask over the neighbouring source texels
+UPSCALE = """
+uniform sampler2D iSource;
+uniform vec2 iResolution;
+// Fraction of iSource that was drawn into and the size of one of its texels
+uniform vec2 iScale;
+uniform vec2 iTexel;
+uniform float iSharpen;
+
+vec3 source(vec2 uv) {
+    return texture2D(iSource, clamp(uv, 0.5 * iTexel, iScale - 0.5 * iTexel)).rgb;
+}
+
+void main()
+{
+    vec2 uv = gl_FragCoord.xy / iResolution * iScale;
+    vec3 col = source(uv);
+    vec3 blur = 0.25 * (source(uv + vec2(iTexel.x, 0.0)) + source(uv - vec2(iTexel.x, 0.0)) +
+                        source(uv + vec2(0.0, iTexel.y)) + source(uv - vec2(0.0, iTexel.y)));
+    gl_FragColor = vec4(clamp(col + iSharpen * (col - blur), 0.0, 1.0), 0);
+}"""
+
+
+# Picks the fraction of the window's width and height to draw the scene at. Pixels cost
+# about the same so frame times are taken to follow the area, the cost of the whole
+# window is averaged over the last frames and the scale set to fit it into target_ms.
+# Changes under step are ignored so the scale doesn't flicker, and once the view has
+# been still for idle_frames it goes back to max_scale. history keeps (ms, scale) of
+# every timed frame for tuning these per scene
+class ResolutionControl:
+    def __init__(self, target_ms, min_scale=0.25, max_scale=1.0, smoothing=0.2, step=0.05, idle_frames=30):
+        self.target_ms = target_ms
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.smoothing = smoothing
+        self.step = step
+        self.idle_frames = idle_frames
+        self.scale = max_scale
+        self.moving_scale = max_scale
+        # Milliseconds for the whole window at a scale of 1
+        self.full_ms = None
+        self.still = 0
+        self.history = []
+
+    def measured(self, ms, scale):
+        self.history.append((ms, scale))
+        full_ms = ms / scale ** 2
+        if self.full_ms is None:
+            self.full_ms = full_ms
+        else:
+            self.full_ms += self.smoothing * (full_ms - self.full_ms)
+        wanted = min(max((self.target_ms / self.full_ms) ** 0.5, self.min_scale), self.max_scale)
+        if abs(wanted - self.moving_scale) >= self.step or wanted in (self.min_scale, self.max_scale):
+            self.moving_scale = wanted
+
+    def update(self, moving):
+        self.still = 0 if moving else self.still + 1
+        self.scale = self.max_scale if self.still >= self.idle_frames else self.moving_scale
+        return self.scale
+
+
+# Draws another pipeline's passes into a texture at the scale control picks and
+# upscales it into the target. The passes are timed with queries that are read
+# once they are done, so the scale follows the GPU a few frames behind
+class Scaled:
+    def __init__(self, pipeline, upscale_program, control, size, sharpen=0.3, ring=4):
+        self.size = width, height = size
+        self.pipeline = pipeline
+        self.passes = pipeline.passes
+        self.control = control
+        self.sharpen = sharpen
+        self.upscale = Pass(upscale_program, size)
+        self.color = texture(size, GL_RGBA8, GL_UNSIGNED_BYTE)
+        glBindTexture(GL_TEXTURE_2D, self.color)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.color, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE, "Incomplete framebuffer"
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+
+        self.queries = [int(query) for query in glGenQueries(ring)]
+        # (query, scale, start) of the frames still in flight
+        self.pending = []
+        self.frame = 0
+        self.last_ms = None
+        self.inputs = None
+
+    def collect(self):
+        while self.pending and glGetQueryObjectuiv(self.pending[0][0], GL_QUERY_RESULT_AVAILABLE):
+            query, scale, start = self.pending.pop(0)
+            elapsed = ctypes.c_uint64()
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+            # Some drivers miss the start of the very first query, as in the profiler
+            if elapsed.value / 1e9 <= perf_counter() - start:
+                self.last_ms = elapsed.value / 1e6
+                self.control.measured(self.last_ms, scale)
+
+    def draw(self, time, mouse, uniforms=None):
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        self.collect()
+        # The view is still while the mouse and uniforms are, time alone doesn't count
+        inputs = (tuple(mouse), uniforms.version if uniforms else None)
+        scale = self.control.update(inputs != self.inputs)
+        self.inputs = inputs
+        width, height = self.size
+        scaled = max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
+        for draw_pass in self.passes:
+            draw_pass.size = scaled
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glViewport(0, 0, *scaled)
+        query = self.queries[self.frame % len(self.queries)]
+        self.frame += 1
+        timed = all(query != pending for pending, _, _ in self.pending)
+        start = perf_counter()
+        if timed:
+            glBeginQuery(GL_TIME_ELAPSED, query)
+        # The camera ray follows the mouse as a fraction of the frame
+        self.pipeline.draw(time, (mouse[0] * scaled[0] / width, mouse[1] * scaled[1] / height), uniforms)
+        if timed:
+            glEndQuery(GL_TIME_ELAPSED)
+            self.pending.append((query, scaled[0] / width, start))
+
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+        glViewport(0, 0, width, height)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.color)
+        glUseProgram(self.upscale.program)
+        glUniform1i(self.upscale.location("iSource"), 0)
+        glUniform2f(self.upscale.location("iScale"), scaled[0] / width, scaled[1] / height)
+        glUniform2f(self.upscale.location("iTexel"), 1 / width, 1 / height)
+        # Full size frames are copied as they are
+        glUniform1f(self.upscale.location("iSharpen"), self.sharpen if scaled != (width, height) else 0.0)
+        self.upscale.draw(time, mouse)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def report(self, stats, wait=False):
+        if wait:
+            glFinish()
+            self.collect()
+        self.pipeline.report(stats, wait)
+        stats['scale'] = self.control.scale
+        if self.last_ms is not None:
+            stats['scene_ms'] = self.last_ms
+
+
+# Average of the samples added up in iAccumulation
+RESOLVE = """
+uniform sampler2D iAccumulation;
+uniform vec2 iResolution;
+uniform float iSamples;
+
+void main()
+{
+    gl_FragColor = vec4(texture2D(iAccumulation, gl_FragCoord.xy / iResolution).rgb / iSamples, 0);
+}"""
+
+
+# Point index of the Halton sequence in base, in [0, 1)
+def halton(index, base):
+    result, fraction = 0.0, 1.0
+    while index:
+        fraction /= base
+        result += fraction * (index % base)
+        index //= base
+    return result
+
+
+# Adds one sample per pixel to a float target every frame, the first at the center of
+# the pixel and the rest spread over it by a Halton sequence, and draws their average.
+# Starts over whenever the mouse, the uniforms, the textures or, for animated scenes,
+# the time change. Stops adding once there are limit samples
+class Progressive:
+    def __init__(self, program, resolve_program, size, animated, limit=None):
+        self.size = size
+        self.main = Pass(program, size)
+        self.passes = [self.main]
+        self.resolve = Pass(resolve_program, size)
+        self.animated = animated
+        self.limit = limit
+        self.accumulation = texture(size, GL_RGBA32F, GL_FLOAT)
+
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.accumulation, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE, "Incomplete framebuffer"
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+        self.samples = 0
+        self.inputs = None
+
+    def reset(self):
+        self.inputs = None
+
+    def jitter(self):
+        if not self.samples:
+            return 0.0, 0.0
+        return halton(self.samples, 2) - 0.5, halton(self.samples, 3) - 0.5
+
+    def draw(self, time, mouse, uniforms=None):
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        volumes = self.main.volumes
+        inputs = (tuple(mouse), uniforms.version if uniforms else None, time if self.animated else None,
+                  tuple(getattr(owner, 'version', 0) for owner in volumes.owners) if volumes else None)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        if inputs != self.inputs:
+            self.inputs = inputs
+            self.samples = 0
+            glClearColor(0, 0, 0, 0)
+            glClear(GL_COLOR_BUFFER_BIT)
+        if self.limit is None or self.samples < self.limit:
+            glUseProgram(self.main.program)
+            glUniform2f(self.main.location("iJitter"), *self.jitter())
+            glEnable(GL_BLEND)
+            glBlendFunc(GL_ONE, GL_ONE)
+            self.main.draw(time, mouse, uniforms)
+            glDisable(GL_BLEND)
+            self.samples += 1
+
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.accumulation)
+        glUseProgram(self.resolve.program)
+        glUniform1i(self.resolve.location("iAccumulation"), 0)
+        glUniform1f(self.resolve.location("iSamples"), self.samples)
+        self.resolve.draw(time, mouse)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def report(self, stats, wait=False):
+        stats['samples'] = self.samples
+
+
+# A single pass into a float framebuffer that is read back, for measuring the scene
+class FloatTarget:
+    def __init__(self, program, size):
+        self.size = width, height = size
+        self.main = Pass(program, size)
+        self.passes = [self.main]
+        self.texture = texture(size, GL_RGBA32F, GL_FLOAT)
+
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE, "Incomplete framebuffer"
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+        self.pixels = np.empty((height, width, 4), np.float32)
+
+    def draw(self, time, mouse, uniforms=None):
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        self.main.draw(time, mouse, uniforms)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, *self.size, GL_RGBA, GL_FLOAT, self.pixels)
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+
+    def report(self, stats, wait=False):
+        pass
+
+    def read(self):
+        # GL rows start at the bottom
+        return self.pixels[::-1]
+
+
+# One sample per pixel into a colour and a normal/distance target, mark the pixels
+# on an edge in the stencil buffer and supersample again only those
+class AdaptiveAA:
+    def __init__(self, gbuffer_program, edges_program, supersample_program, size):
+        self.size = width, height = size
+        self.gbuffer = Pass(gbuffer_program, size)
+        self.edges = Pass(edges_program, size)
+        self.supersample = Pass(supersample_program, size)
+        self.passes = [self.gbuffer, self.edges, self.supersample]
+        self.geometry_sampler = glGetUniformLocation(edges_program, "iGeometry")
+
+        self.color = texture(size, GL_RGBA8, GL_UNSIGNED_BYTE)
+        # Distances need more than 8 bits to find depth steps
+        self.geometry = texture(size, GL_RGBA32F, GL_FLOAT)
+        self.stencil = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.stencil)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
+
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.color, 0)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT1, GL_TEXTURE_2D, self.geometry, 0)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, self.stencil)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE, "Incomplete framebuffer"
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+
+        # Counts the pixels marked as edges
+        self.query = glGenQueries(1)[0]
+        self.pending = False
+        self.refined = 0.0
+
+    def draw(self, time, mouse, uniforms=None):
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        width, height = self.size
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glDrawBuffers(2, [GL_COLOR_ATTACHMENT0, GL_COLOR_ATTACHMENT1])
+        glClear(GL_STENCIL_BUFFER_BIT)
+        self.gbuffer.draw(time, mouse, uniforms)
+
+        glDrawBuffers(1, [GL_NONE])
+        glEnable(GL_STENCIL_TEST)
+        glStencilFunc(GL_ALWAYS, 1, 0xff)
+        glStencilOp(GL_KEEP, GL_KEEP, GL_REPLACE)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.geometry)
+        glUseProgram(self.edges.program)
+        glUniform1i(self.geometry_sampler, 0)
+        # Only start another count once the last one has been read
+        counting = not self.pending
+        if counting:
+            glBeginQuery(GL_SAMPLES_PASSED, self.query)
+        self.edges.draw(time, mouse, uniforms)
+        if counting:
+            glEndQuery(GL_SAMPLES_PASSED)
+            self.pending = True
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        # Blocks without a marked pixel are skipped before shading
+        glDrawBuffers(1, [GL_COLOR_ATTACHMENT0])
+        glStencilFunc(GL_EQUAL, 1, 0xff)
+        glStencilOp(GL_KEEP, GL_KEEP, GL_KEEP)
+        self.supersample.draw(time, mouse, uniforms)
+        glDisable(GL_STENCIL_TEST)
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer)
+        glReadBuffer(GL_COLOR_ATTACHMENT0)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, target)
+        glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+
+    # Fraction of pixels that were supersampled, the window doesn't wait on the
+    # GPU for it so it can lag a few frames behind
+    def report(self, stats, wait=False):
+        if self.pending and (wait or glGetQueryObjectuiv(self.query, GL_QUERY_RESULT_AVAILABLE)):
+            samples = glGetQueryObjectuiv(self.query, GL_QUERY_RESULT)
+            self.refined = int(samples) / (self.size[0] * self.size[1])
+            self.pending = False
+        stats['refined'] = self.refined
+
+
+# Cone marches the scene at one or more lower resolutions, coarsest first, and
+# hands the finest start distances on to the passes of another pipeline
+class Prepass:
+    # Only a cone program compiled with stats measures the steps it saves
+    def __init__(self, cone_program, texels, pipeline, size, stats=False):
+        self.size = size
+        self.pipeline = pipeline
+        self.stats = stats
+        self.cone = Pass(cone_program, size)
+        self.passes = [self.cone] + pipeline.passes
+        self.texels = texels
+        for coarse, fine in zip(texels, texels[1:]):
+            assert coarse % fine == 0, "Prepass texel sizes must divide the ones before them"
+
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        self.levels = []
+        for texel in texels:
+            level_size = (-(-size[0] // texel), -(-size[1] // texel))
+            start = texture(level_size, GL_RGBA32F, GL_FLOAT)
+            framebuffer = glGenFramebuffers(1)
+            glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, start, 0)
+            assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE, "Incomplete framebuffer"
+            self.levels.append((texel, level_size, start, framebuffer))
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+        self.start = np.empty((level_size[1], level_size[0], 4), np.float32)
+
+    @staticmethod
+    def start_from(draw_pass, level, scale):
+        texel, level_size, start, _ = level
+        glUseProgram(draw_pass.program)
+        glUniform1i(draw_pass.location("iStart"), 1)
+        glUniform3f(draw_pass.location("iStartTexel"), texel / scale, *level_size)
+
+    def draw(self, time, mouse, uniforms=None):
+        target = int(glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING))
+        previous = None
+        glActiveTexture(GL_TEXTURE1)
+        for level in self.levels:
+            texel, level_size, start, framebuffer = level
+            glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+            glViewport(0, 0, *level_size)
+            glUseProgram(self.cone.program)
+            glUniform1f(self.cone.location("iConeScale"), texel)
+            if previous:
+                glBindTexture(GL_TEXTURE_2D, previous[2])
+                self.start_from(self.cone, previous, texel)
+            else:
+                glUniform3f(self.cone.location("iStartTexel"), 0, 0, 0)
+            self.cone.draw(time, mouse, uniforms)
+            previous = level
+
+        glBindTexture(GL_TEXTURE_2D, previous[2])
+        glActiveTexture(GL_TEXTURE0)
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+        glViewport(0, 0, *self.size)
+        for draw_pass in self.pipeline.passes:
+            self.start_from(draw_pass, previous, 1)
+        self.pipeline.draw(time, mouse, uniforms)
+
+    def read(self):
+        return self.pipeline.read()
+
+    # Starting points are drawn again every frame, only the inner pipeline keeps anything
+    def reset(self):
+        self.pipeline.reset()
+
+    # Average over the finest level of the steps every ray skips, reading it back
+    # waits for the GPU
+    def report(self, stats, wait=False):
+        self.pipeline.report(stats, wait)
+        if not self.stats:
+            return
+        texel, level_size, start, framebuffer = self.levels[-1]
+        glBindTexture(GL_TEXTURE_2D, start)
+        glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT, self.start)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        stats['steps_saved'] = float(self.start[:, :, 1].mean())
@@ -0,0 +1,125 @@
+# profiling.py
+# GPU and CPU frame times from timer queries, and how long compiling a scene took
+import ctypes
+import json
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from .gl import *
+
+from . import diagnostics
+
+
+def summarize(values):
+    if not len(values):
+        return {}
+    return diagnostics.summarize(np.asarray(values, np.float64))
+
+
+def histogram(values, bins=20):
+    if not len(values):
+        return []
+    counts, edges = np.histogram(values, bins)
+    return [[float(edge), int(count)] for edge, count in zip(edges, counts)]
+
+
+class Profiler:
+    # Enough queries in flight that results are back before one is reused
+    def __init__(self, ring=4):
+        self.ring = ring
+        # Made with the first frame, once there is a context
+        self.queries = None
+        self.pending = []
+        self.frame = 0
+        self.active = None
+        self.start = None
+        # Milliseconds, GPU time, CPU time spent submitting and wall time between frames.
+        # Software rasterizers such as llvmpipe don't report usable GPU times, go by frame
+        # times with them
+        self.gpu = []
+        self.cpu = []
+        self.frames = []
+        # Frames that went untimed because every query was still in flight
+        self.dropped = 0
+        # Seconds per stage, eg. 'compile' or 'link'
+        self.stages = {}
+
+    def collect(self):
+        # Results come back in order, stop at the first that isn't ready
+        while self.pending and glGetQueryObjectuiv(self.pending[0][0], GL_QUERY_RESULT_AVAILABLE):
+            query, start = self.pending.pop(0)
+            elapsed = ctypes.c_uint64()
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+            # Some drivers miss the start of the very first query
+            if elapsed.value / 1e9 <= time.perf_counter() - start:
+                self.gpu.append(elapsed.value / 1e6)
+
+    def begin_frame(self):
+        if self.queries is None:
+            self.queries = [int(query) for query in glGenQueries(self.ring)]
+        self.collect()
+        query = self.queries[self.frame % len(self.queries)]
+        self.frame += 1
+        if any(query == pending for pending, _ in self.pending):
+            self.dropped += 1
+            self.active = None
+        else:
+            self.active = query
+            glBeginQuery(GL_TIME_ELAPSED, query)
+        start = time.perf_counter()
+        if self.start is not None:
+            self.frames.append((start - self.start) * 1000)
+        self.start = start
+
+    def end_frame(self):
+        self.cpu.append((time.perf_counter() - self.start) * 1000)
+        if self.active:
+            glEndQuery(GL_TIME_ELAPSED)
+            self.pending.append((self.active, self.start))
+            self.active = None
+
+    # Starts over, eg. after warming up
+    def reset(self):
+        self.finish()
+        self.gpu, self.cpu, self.frames = [], [], []
+        self.start = None
+        self.dropped = 0
+
+    # Waits for the frames still in flight
+    def finish(self):
+        glFinish()
+        self.collect()
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.setdefault(stage, []).append(time.perf_counter() - start)
+
+    # Medians of the last frames, for printing while the window runs
+    def report(self, stats, frames=120):
+        if self.gpu:
+            stats['gpu_ms'] = float(np.median(self.gpu[-frames:]))
+        if self.cpu:
+            stats['cpu_ms'] = float(np.median(self.cpu[-frames:]))
+        if self.frames:
+            stats['frame_ms'] = float(np.median(self.frames[-frames:]))
+
+    def summary(self):
+        return {'frames': len(self.cpu),
+                'dropped': self.dropped,
+                'gpu_ms': summarize(self.gpu),
+                'cpu_ms': summarize(self.cpu),
+                'frame_ms': summarize(self.frames),
+                'gpu_histogram': histogram(self.gpu),
+                'frame_histogram': histogram(self.frames),
+                'stages': {stage: {'count': len(times), 'total_s': sum(times), 'max_s': max(times)}
+                           for stage, times in self.stages.items()}}
+
+    # info is stored alongside, eg. the scene and camera settings to compare runs by
+    def export(self, path, **info):
+        with open(path, 'w') as f:
+            json.dump({**info, **self.summary()}, f, indent=2)
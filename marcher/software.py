@@ -0,0 +1,206 @@
+# software.py
+# The blueprint's default pipeline on the CPU for machines without a GPU. Tiles of
+# pixels are rendered as NumPy batches of rays by a pool of processes that take the
+# next tile as soon as they finish one and write it straight into a shared frame
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import cpu
+from .march import is_constant, vec
+
+
+def normalize(v):
+    return v / cpu.length(v)[..., None]
+
+
+def dot(a, b):
+    return np.sum(a * b, axis=-1)
+
+
+def mix(a, b, t):
+    return a + (b - a) * t
+
+
+def smoothstep(lo, hi, x):
+    t = np.clip((x - lo) / (hi - lo), 0.0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+
+# Same light as the blueprint's shade
+LIGHT = normalize(np.array([-0.4, 0.7, -0.6]))
+
+
+# Colors of pixels of obj with a camera's settings, as render, supersample and their
+# helpers in the blueprint compute them for one ray per row
+class Renderer:
+    def __init__(self, obj, size, params, time=0.0, mouse=(0.0, 0.0)):
+        self.size = tuple(size)
+        self.params = {}
+        for name in ('AA', 'MAX_STEPS', 'MAX_DISTANCE', 'MIN_DISTANCE', 'TA', 'BACKGROUND', 'MATERIAL'):
+            value = params[name]
+            assert isinstance(value, (int, float)) or is_constant(value), \
+                "%s must be a constant to render on the CPU" % name
+            self.params[name] = np.array(value.floats) if isinstance(value, vec) else float(value)
+        self.aa = int(self.params['AA'])
+        self.mouse = np.asarray(mouse, float)
+        self.scene = cpu.Scene(obj, int(self.params['MAX_STEPS']), self.params['MAX_DISTANCE'],
+                               self.params['MIN_DISTANCE'], iTime=time, iMouse=self.mouse)
+
+    # camera_ray for (N, 2) coordinates in pixels from the bottom left
+    def rays(self, coords):
+        width, height = self.size
+        mx, my = self.mouse / self.size
+        ro = np.array([10 * np.sin(10 * mx), 2 + 20 * (my - 0.5), 10 * np.cos(10 * mx)])
+        cw = normalize(self.params['TA'] - ro)
+        cu = normalize(np.cross(cw, [0.0, 1.0, 0.0]))
+        cv = np.cross(cu, cw)
+        p = (2 * coords - [width, height]) / height
+        local = normalize(np.concatenate([p, np.full((len(p), 1), 2.0)], axis=1))
+        return np.broadcast_to(ro, local.shape), local @ np.stack([cu, cv, cw])
+
+    def occlusion(self, pos, nor):
+        occ = np.zeros(len(pos))
+        sca = 1.0
+        for i in range(5):
+            hr = 0.01 + 0.12 * i / 4.0
+            dd = self.scene.distance(nor * hr + pos)
+            occ += -(dd - hr) * sca
+            sca *= 0.95
+        return np.clip(1.0 - 3.0 * occ, 0.0, 1.0) * (0.5 + 0.5 * nor[:, 1])
+
+    # Rays stop once they are in shadow or past tmax as in the blueprint's loop
+    def softshadow(self, ro, rd, mint, tmax):
+        res = np.ones(len(ro))
+        t = np.full(len(ro), mint)
+        active = np.arange(len(ro))
+        for _ in range(16):
+            if not len(active):
+                break
+            h = self.scene.distance(ro[active] + rd[active] * t[active, None])
+            res[active] = np.minimum(res[active], 8.0 * h / t[active])
+            t[active] += np.clip(h, 0.02, 0.10)
+            active = active[(res[active] >= 0.005) & (t[active] <= tmax)]
+        return np.clip(res, 0.0, 1.0)
+
+    def shade(self, ro, rd, t, nor):
+        col = self.params['BACKGROUND'] + rd[:, 1:2] * 0.8
+        hit = np.nonzero(t < self.params['MAX_DISTANCE'])[0]
+        if not len(hit):
+            return np.clip(col, 0.0, 1.0)
+        ro, rd, t, nor = ro[hit], rd[hit], t[hit], nor[hit]
+        pos = ro + rd * t[:, None]
+        ref = rd - 2.0 * dot(nor, rd)[:, None] * nor
+        occ = self.occlusion(pos, nor)
+        hal = normalize(LIGHT - rd)
+        amb = np.clip(0.5 + 0.5 * nor[:, 1], 0.0, 1.0)
+        dif = np.clip(dot(nor, LIGHT), 0.0, 1.0)
+        back = normalize(np.array([-LIGHT[0], 0.0, -LIGHT[2]]))
+        bac = np.clip(dot(nor, back), 0.0, 1.0) * np.clip(1.0 - pos[:, 1], 0.0, 1.0)
+        dom = smoothstep(-0.2, 0.2, ref[:, 1])
+        fre = np.clip(1.0 + dot(nor, rd), 0.0, 1.0) ** 2.0
+
+        lights = np.broadcast_to(LIGHT, pos.shape)
+        dif *= self.softshadow(pos, lights, 0.02, 2.5)
+        dom *= self.softshadow(pos, ref, 0.02, 2.5)
+
+        spe = (np.clip(dot(nor, hal), 0.0, 1.0) ** 16.0 * dif *
+               (0.04 + 0.96 * np.clip(1.0 + dot(hal, rd), 0.0, 1.0) ** 5.0))
+
+        lin = 1.40 * dif[:, None] * [1.00, 0.80, 0.55]
+        lin += 0.20 * (amb * occ)[:, None] * [0.40, 0.60, 1.00]
+        lin += 0.40 * (dom * occ)[:, None] * [0.40, 0.60, 1.00]
+        lin += 0.50 * (bac * occ)[:, None] * [0.25, 0.25, 0.25]
+        lin += 0.25 * (fre * occ)[:, None] * [1.00, 1.00, 1.00]
+        shaded = self.params['MATERIAL'] * lin + 9.00 * spe[:, None] * [1.00, 0.90, 0.70]
+        shaded = mix(shaded, np.array([0.8, 0.9, 1.0]), (1.0 - np.exp(-0.0002 * t * t * t))[:, None])
+        col[hit] = shaded
+        return np.clip(col, 0.0, 1.0)
+
+    def render(self, ro, rd):
+        t, _ = self.scene.raycast(ro, rd)
+        nor = np.zeros_like(rd)
+        hit = t < self.params['MAX_DISTANCE']
+        nor[hit] = self.scene.normals(ro[hit] + rd[hit] * t[hit, None])
+        return self.shade(ro, rd, t, nor)
+
+    # (height, width, 3) colors of the pixels in rect=(x0, y0, x1, y1), rows from the top
+    def tile(self, rect):
+        x0, y0, x1, y1 = rect
+        x, y = np.meshgrid(np.arange(x0, x1) + 0.5, np.arange(y1 - 1, y0 - 1, -1) + 0.5)
+        coords = np.stack([x.ravel(), y.ravel()], axis=1)
+        # Every sample of every pixel in one batch
+        offsets = [(i / self.aa - 0.5, j / self.aa - 0.5) for i in range(self.aa) for j in range(self.aa)] \
+            if self.aa > 1 else [(0.0, 0.0)]
+        ro, rd = self.rays((coords[None] + np.array(offsets)[:, None]).reshape(-1, 2))
+        total = self.render(np.ascontiguousarray(ro), rd).reshape(len(offsets), -1, 3).mean(axis=0)
+        return total.reshape(y1 - y0, x1 - x0, 3)
+
+
+# (x0, y0, x1, y1) of every tile, from the top row of the frame down
+def tiles(size, tile):
+    width, height = size
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in reversed(range(0, height, tile)) for x in range(0, width, tile)]
+
+
+# Renders tiles into frame, the next one from counter when it is shared between workers
+def work(renderer, rects, frame, counter=None):
+    height = renderer.size[1]
+    index = 0
+    while True:
+        if counter is not None:
+            with counter.get_lock():
+                index = counter.value
+                counter.value += 1
+        if index >= len(rects):
+            break
+        x0, y0, x1, y1 = rects[index]
+        # Unsigned bytes rounded as GL stores normalized colors
+        frame[height - y1:height - y0, x0:x1] = np.round(renderer.tile(rects[index]) * 255)
+        index += 1
+
+
+def worker(renderer, rects, name, counter):
+    memory = shared_memory.SharedMemory(name)
+    try:
+        frame = np.ndarray(renderer.size[::-1] + (3,), np.uint8, memory.buf)
+        work(renderer, rects, frame, counter)
+        del frame
+    finally:
+        memory.close()
+
+
+# (height, width, 3) uint8 frame like Camera.render_to_array. workers processes share
+# the frame and take tiles of tile pixels as they go, so the frame is the same however
+# many there are and a slow tile only holds up the worker drawing it
+def render(renderer, workers=None, tile=32):
+    workers = workers or os.cpu_count()
+    rects = tiles(renderer.size, tile)
+    shape = renderer.size[::-1] + (3,)
+    if workers == 1:
+        frame = np.zeros(shape, np.uint8)
+        work(renderer, rects, frame)
+        return frame
+
+    memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+    try:
+        # Workers inherit the scene, which lives in the registry, by forking
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        counter = context.Value('i', 0)
+        processes = [context.Process(target=worker, args=(renderer, rects, memory.name, counter))
+                     for _ in range(min(workers, len(rects)))]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert all(process.exitcode == 0 for process in processes), "A worker failed rendering"
+        shared = np.ndarray(shape, np.uint8, memory.buf)
+        frame = shared.copy()
+        del shared
+    finally:
+        memory.close()
+        memory.unlink()
+    return frame
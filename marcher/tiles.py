@@ -0,0 +1,322 @@
+# tiles.py
+# Interval bounds of a scene over the frustum of every screen tile, to prove which
+# Union, Intersect and Subtract branches can't change what a ray from the tile hits.
+# Tiles that keep the same branches share a program whose march only evaluates them,
+# shading still sees the whole scene so shadows and occlusion from outside are kept
+import hashlib
+
+import numpy as np
+
+from . import cpu
+from .march import Function, Primitive, Operator, Object, Var, vec, is_constant
+from .optimize import MINMAX
+
+
+def normalize(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+# Boxes around the frustum of every tile between successive depths, same rays as camera_ray
+class Frustums:
+    def __init__(self, size, params, mouse, tile):
+        width, height = size
+        assert is_constant(params['TA']) and is_constant(params['MAX_DISTANCE']), \
+            "Tiles need a constant TA and MAX_DISTANCE"
+        mx, my = mouse[0] / width, mouse[1] / height
+        ro = np.array([10 * np.sin(10 * mx), 2 + 20 * (my - 0.5), 10 * np.cos(10 * mx)])
+        cw = normalize(np.array(params['TA'].floats) - ro)
+        cu = normalize(np.cross(cw, [0.0, 1.0, 0.0]))
+        cv = np.cross(cu, cw)
+
+        x0, y0 = np.meshgrid(np.arange(0, width, tile), np.arange(0, height, tile))
+        self.columns = x0.shape[1]
+        # (x0, y0, x1, y1) in pixels from the bottom left, a row of tiles after another
+        self.rects = np.stack([x0, y0, np.minimum(x0 + tile, width), np.minimum(y0 + tile, height)], -1).reshape(-1, 4)
+        # Supersampling offsets reach half a pixel past the tile
+        xs = self.rects[:, [0, 2, 2, 0]] + [-0.5, 0.5, 0.5, -0.5]
+        ys = self.rects[:, [1, 1, 3, 3]] + [-0.5, -0.5, 0.5, 0.5]
+        px, py = (2 * xs - width) / height, (2 * ys - height) / height
+        corners = normalize(px[..., None] * cu + py[..., None] * cv + 2.0 * cw)
+        center = normalize(corners.mean(axis=1))
+        spread = np.einsum('tcx,tx->tc', corners, center).min(axis=1)
+
+        # Segments about twice as deep as the tile is wide at their distance
+        far = float(params['MAX_DISTANCE'])
+        ratio = 1 + 2.0 * tile / height
+        depths = [0.0, min(1.0, far)]
+        while depths[-1] < far:
+            depths.append(min(depths[-1] * ratio, far))
+        depths = np.array(depths)
+
+        points = ro + corners[:, :, None, :] * depths[None, None, :, None]
+        lo = np.minimum(points[:, :, :-1], points[:, :, 1:]).min(axis=1)
+        hi = np.maximum(points[:, :, :-1], points[:, :, 1:]).max(axis=1)
+        # The sphere cap between the corner rays bulges past them
+        bulge = depths[None, 1:, None] * (1 - spread[:, None, None])
+        self.lo, self.hi = lo - bulge, hi + bulge
+
+
+def translate(p, t):
+    return p[0] - t[0], p[1] - t[1]
+
+
+def mirror(p):
+    lo, hi = p
+    return np.where(lo > 0, lo, np.where(hi < 0, -hi, 0.0)), np.maximum(np.abs(lo), np.abs(hi))
+
+
+def repeat(p, n):
+    lo, hi = p
+    n = n[0]
+    start = np.mod(lo, n) - n * 0.5
+    end = start + (hi - lo)
+    # Anything that crosses a cell boundary can be anywhere in the cell
+    wraps = end > n * 0.5
+    return np.where(wraps, -n * 0.5, start), np.where(wraps, n * 0.5, end)
+
+
+# Interval versions of operators, given the interval of their point and their constants
+operators = {'Translate': translate, 'Mirror': mirror, 'Repeat': repeat}
+
+
+# (lo, hi) of every value over every box, None where it can't be bounded. Primitives
+# are bounded by their value at the center of a box plus or minus half its diagonal,
+# which holds for any distance that doesn't overestimate
+class Intervals:
+    def __init__(self, lo, hi):
+        self.point = (lo, hi)
+        self.shape = lo.shape[:-1]
+        # Per MINMAX call, whether each argument is positive or negative over all the boxes of a tile
+        self.flags = {}
+        self.record = True
+
+    def sign(self, interval):
+        if interval is None:
+            return np.zeros(self.shape[0], bool), np.zeros(self.shape[0], bool)
+        lo, hi = (np.broadcast_to(bound, self.shape) for bound in interval)
+        return (lo > 0).all(axis=1), (hi < 0).all(axis=1)
+
+    # Calls nest as deep as the scene, so they are bounded arguments first with a
+    # stack instead of recursing once per level, as cpu.Evaluator does
+    def value(self, arg, env):
+        values = {}
+        args = {}
+        stack = [arg]
+        while stack:
+            item = stack[-1]
+            if id(item) in values:
+                stack.pop()
+            elif not isinstance(item, Function.Call):
+                stack.pop()
+                values[id(item)] = self.leaf(item, env)
+            elif id(item) not in args:
+                # Kept so the calls get_args makes stay alive with their ids
+                args[id(item)] = item.get_args()
+                stack.extend(arg for arg in args[id(item)] if id(arg) not in values)
+            else:
+                stack.pop()
+                values[id(item)] = self.call(item, [values[id(arg)] for arg in args[id(item)]])
+        return values[id(arg)]
+
+    def leaf(self, arg, env):
+        if isinstance(arg, Var):
+            # Inline expressions such as iTime can be anything
+            return env.get(arg.name)
+        elif isinstance(arg, vec):
+            if not is_constant(arg):
+                return None
+            v = np.array(arg.floats)
+            return v, v
+        return float(arg), float(arg)
+
+    def call(self, call, args):
+        fn = Function.registry[call.name]
+        if isinstance(fn, Object):
+            return self.object(fn, args)
+        if call.name in MINMAX:
+            a, b = args
+            if self.record:
+                self.flags[id(call)] = self.sign(a) + self.sign(b)
+            if a is None or b is None:
+                return None
+            if call.name == 'Union':
+                return np.minimum(a[0], b[0]), np.minimum(a[1], b[1])
+            elif call.name == 'Intersect':
+                return np.maximum(a[0], b[0]), np.maximum(a[1], b[1])
+            return np.maximum(a[0], -b[1]), np.maximum(a[1], -b[0])
+        if None in args:
+            return None
+        if isinstance(fn, Operator):
+            return operators[call.name](*args) if call.name in operators else None
+        kernel = cpu.find(call.name) if isinstance(fn, Primitive) else None
+        if kernel:
+            lo, hi = args[0]
+            center = kernel((lo + hi) / 2, *[arg[0] for arg in args[1:]])
+            radius = cpu.length(hi - lo) / 2
+            return center - radius, center + radius
+        return None
+
+    def object(self, fn, args):
+        fn.evaluate()
+        record, self.record = self.record, False
+        env = dict(zip(fn.params, args))
+        for var, value in fn.lines:
+            env[var.name] = self.value(value, env)
+        self.record = record
+        return env['res']
+
+    def scene(self, obj):
+        obj.evaluate()
+        env = {'p': self.point, 'res': (1e20, 1e20)}
+        for var, value in obj.lines:
+            env[var.name] = self.value(value, env)
+
+
+# Which argument of a MINMAX call a tile can keep alone, 0 for both. Dropping a branch
+# is sound when its surface is nowhere in the tile, the kept one still bounds the
+# distance to the only surface a ray can hit there
+def choose(name, a_positive, a_negative, b_positive, b_negative):
+    if name == 'Union':
+        return 1 if b_positive else 2 if a_positive else 0
+    elif name == 'Intersect':
+        return 1 if b_negative or a_positive else 2 if a_negative or b_positive else 0
+    return 1 if b_positive or a_positive else 0
+
+
+# Primitives evaluated by a value, objects count everything they evaluate. Walked
+# with a stack, only nested objects recurse
+def size(value, sizes):
+    total = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if not isinstance(value, Function.Call):
+            continue
+        fn = Function.registry[value.name]
+        if isinstance(fn, Object):
+            if value.name not in sizes:
+                fn.evaluate()
+                sizes[value.name] = sum(size(line, sizes) for _, line in fn.lines)
+            total += sizes[value.name]
+        else:
+            total += 1 if isinstance(fn, Primitive) else 0
+            stack.extend(value.args)
+    return total
+
+
+class Pruner:
+    def __init__(self, obj, intervals):
+        self.obj = obj
+        self.flags = intervals.flags
+        self.sizes = {}
+
+    # Value with the branches the tiles in mask can drop removed, the choices made and
+    # the subtrees that were kept. Choices are made parents first and left to right with
+    # a stack, calls that keep both branches are rebuilt once both are done
+    def prune(self, value, mask, choices, kept):
+        done = []
+        stack = [(value, False)]
+        while stack:
+            value, rebuild = stack.pop()
+            if rebuild:
+                b, a = done.pop(), done.pop()
+                done.append(value.__class__(value.name, [a, b]))
+            elif not isinstance(value, Function.Call) or id(value) not in self.flags:
+                kept.add(id(value))
+                done.append(value)
+            else:
+                choice = choose(value.name, *[flag[mask].all() for flag in self.flags[id(value)]])
+                choices.append(choice)
+                a, b = value.args
+                if choice:
+                    stack.append((a if choice == 1 else b, False))
+                else:
+                    stack += [(value, True), (b, False), (a, False)]
+        return done[0]
+
+    def lines(self, mask):
+        choices, kept = [], set()
+        lines = []
+        for var, value in self.obj.lines:
+            value = self.prune(value, mask, choices, kept)
+            # res=res
+            if isinstance(value, Var) and value.name == var.name:
+                continue
+            lines.append((var, value))
+        return lines, tuple(choices), kept
+
+    def size(self, lines):
+        return sum(size(value, self.sizes) for _, value in lines)
+
+
+# Neighbouring tiles of a row as one rectangle, rects are in row order
+def runs(rects):
+    merged = [rects[0].copy()]
+    for rect in rects[1:]:
+        last = merged[-1]
+        if rect[0] == last[2] and rect[1] == last[1]:
+            last[2] = rect[2]
+        else:
+            merged.append(rect.copy())
+    return np.array(merged)
+
+
+# An object with the pruned lines, named after them so every view that prunes the same
+# way shares its program. It stays out of the registry, registering would bump
+# Function.generation and throw away every memoized source
+def pruned_object(obj, lines):
+    text = ''.join(str(var) + '=' + str(value) + ';' for var, value in lines)
+    name = '%s_%s' % (obj.name, hashlib.sha256(text.encode()).hexdigest()[:12])
+
+    def pruned(self): pass
+    pruned.__name__ = pruned.__qualname__ = name
+    fn = Object(pruned, ())
+    fn.lines = lines
+    fn.evaluated = True
+    for _, value in lines:
+        fn.dependencies |= value.get_usage()
+    return fn
+
+
+# Groups of tiles of tile pixels and the object each of them marches through, at most
+# programs of them. Tiles that would prune differently are merged into the group they
+# share most primitives with, smallest first, which only keeps more of the scene.
+# stats gets the primitives of the whole scene and the average a tile evaluates when
+# pruned on its own and with its group
+def specialize(obj, size, params, mouse, tile=32, programs=8, stats=None):
+    frustums = Frustums(size, params, mouse, tile)
+    intervals = Intervals(frustums.lo, frustums.hi)
+    intervals.scene(obj)
+    pruner = Pruner(obj, intervals)
+    count = len(frustums.rects)
+
+    groups = {}
+    own = np.empty(count)
+    for i in range(count):
+        mask = np.zeros(count, bool)
+        mask[i] = True
+        lines, choices, kept = pruner.lines(mask)
+        own[i] = pruner.size(lines)
+        groups.setdefault(choices, [lines, kept, []])[2].append(i)
+    groups = list(groups.values())
+
+    while len(groups) > programs:
+        groups.sort(key=lambda group: len(group[2]))
+        _, kept, tiles = groups.pop(0)
+        other = max(groups, key=lambda group: len(kept & group[1]))
+        other[2] += tiles
+        mask = np.zeros(count, bool)
+        mask[other[2]] = True
+        other[:2] = pruner.lines(mask)[::2]
+
+    result = []
+    shared = np.empty(count)
+    for lines, _, tiles in groups:
+        shared[tiles] = pruner.size(lines)
+        result.append((pruned_object(obj, lines), runs(frustums.rects[sorted(tiles)])))
+    if stats is not None:
+        stats['tile_programs'] = len(result)
+        stats['scene_primitives'] = pruner.size(obj.lines)
+        stats['tile_primitives'] = float(own.mean())
+        stats['group_primitives'] = float(shared.mean())
+    return result
@@ -0,0 +1,69 @@
+# video.py
+# Writers that take rendered frames one at a time, so an export never holds more than a few
+import os
+import shutil
+import struct
+import subprocess
+import zlib
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+# frame is a (height, width, 3 or 4) uint8 array, rows top first
+def write_png(path, frame, level=1):
+    height, width, channels = frame.shape
+    color_type = {3: 2, 4: 6}[channels]
+    rows = frame.reshape(height, width * channels)
+    # Filter type 0 in front of every row
+    raw = b''.join(b'\x00' + row.tobytes() for row in rows)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+        f.write(png_chunk(b'IDAT', zlib.compress(raw, level)))
+        f.write(png_chunk(b'IEND', b''))
+
+
+# pattern is formatted with the frame number, eg. 'frames/%05d.png'
+class PNGSequence:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.count = 0
+        directory = os.path.dirname(pattern)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        write_png(self.pattern % self.count, frame[:, :, :3])
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+# Raw RGBA frames piped into ffmpeg, which picks the container from the extension
+class FFmpegPipe:
+    def __init__(self, path, size, fps, options=('-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', '18')):
+        ffmpeg = shutil.which('ffmpeg')
+        assert ffmpeg, "ffmpeg was not found, export to an image sequence such as 'frames/%05d.png' instead"
+        command = [ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '%dx%d' % tuple(size), '-r', str(fps), '-i', '-',
+                   *options, path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        assert self.process.wait() == 0, "ffmpeg failed"
+
+
+# Paths with a % or without an extension become PNG sequences, anything else a video
+def open_writer(path, size, fps):
+    if '%' in path:
+        return PNGSequence(path)
+    if not os.path.splitext(path)[1]:
+        return PNGSequence(os.path.join(path, '%05d.png'))
+    return FFmpegPipe(path, size, fps)
@@ -0,0 +1,79 @@
+# window.py
+# Interactive backend, draws a camera's pipeline into a pygame window every frame
+import os
+import sys
+
+import pygame
+from pygame.locals import *
+from pygame.time import get_ticks
+
+from .gl import *
+
+
+# shader is an Object or the source of a single pass program, eg. from save
+def render(camera, shader, uniforms=None, on_frame=None):
+    pygame.init()
+    size = width, height = camera.size
+    screen_center = (size[0] / 2, size[1] / 2)
+    if camera.fps is None:
+        # Drivers read these when the context is made, Mesa and NVIDIA respectively
+        os.environ.setdefault('vblank_mode', '0')
+        os.environ.setdefault('__GL_SYNC_TO_VBLANK', '0')
+    screen = pygame.display.set_mode(size, DOUBLEBUF | OPENGL)
+    pygame.mouse.set_visible(False)
+    pygame.mouse.set_pos(screen_center)
+
+    clock = pygame.time.Clock()
+
+    if isinstance(shader, str):
+        from .pipeline import SinglePass
+        pipeline = SinglePass(camera.load_program(shader), size)
+    else:
+        pipeline = camera.build_pipeline(shader, interactive=True)
+
+    try:
+        loop(camera, screen, clock, pipeline, uniforms, on_frame)
+    finally:
+        if camera.profiler and isinstance(camera.profile, str):
+            info = {} if isinstance(shader, str) else camera.settings(shader)
+            camera.profiler.export(camera.profile, **info)
+
+
+def loop(camera, screen, clock, pipeline, uniforms, on_frame):
+    width, height = camera.size
+    timer = 0
+    running = True
+    pause = False
+    paused_at = 0
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_p:
+                    pause = not pause
+                    paused_at = get_ticks() / 1000
+                elif event.key == pygame.K_s:
+                    pygame.image.save(screen, 'screenshot.png')
+                elif event.key == pygame.K_ESCAPE:
+                    sys.exit(0)
+        # A paused progressive view keeps adding samples to the frame it stopped at
+        if not pause or camera.progressive:
+            time = paused_at if pause else get_ticks() / 1000
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            if on_frame and not pause:
+                on_frame(uniforms, time)
+            m = pygame.mouse.get_pos()
+            camera.draw(pipeline, time, (m[0], height - m[1]), uniforms)
+            if get_ticks() - timer > 1000:
+                pipeline.report(camera.stats)
+                if camera.profiler:
+                    camera.profiler.report(camera.stats)
+                print('fps', round(clock.get_fps()), *('%s %.2f' % stat for stat in camera.stats.items()))
+                timer = get_ticks()
+            if camera.fps:
+                clock.tick(camera.fps)
+            else:
+                clock.tick()
+
+            pygame.display.flip()
@@ -0,0 +1,33 @@
+# test_bake.py
+import sys
+
+from marcher.bake import dynamic
+from marcher.march import *
+from marcher.optimize import Optimizer, standalone_bounds
+
+
+def chain(name, depth, radius):
+    def scene(self):
+        tree = Sphere(radius).at(vec3(0, 0, 0))
+        for i in range(1, depth):
+            tree = Union(tree, Sphere(0.5).at(vec3(float(i), 0, 0)))
+        self.res(Union, tree)
+    scene.__name__ = scene.__qualname__ = name
+    Object.register()(scene)
+    return Function.registry[name]
+
+
+# Progressive cameras ask this of every scene, however deep its chains nest
+def test_dynamic_deep_chain():
+    depth = sys.getrecursionlimit() + 1000
+    assert not Camera.animated(chain('DeepStill', depth, 0.5))
+    assert Camera.animated(chain('DeepAnimated', depth, Var('0.5 + 0.1 * sin(iTime)')))
+
+
+def test_bake_deep_chain():
+    depth = sys.getrecursionlimit() + 1000
+    fn = chain('DeepBaked', depth, 0.5)
+    lo, hi = standalone_bounds(fn, Optimizer(fn))
+    assert lo == [-0.5] * 3 and hi == [depth - 0.5, 0.5, 0.5]
+    baked = fn._call().bake(resolution=16, cache=False)
+    assert baked.name.startswith('Baked_')
@@ -0,0 +1,25 @@
+# test_cache.py
+from marcher.cache import ShaderCache
+from marcher.march import *
+
+
+@Object.register()
+def CachedScene(self):
+    self.res(Union, Sphere(1.0).at(vec3(0, 1, 0)))
+
+
+# Each cache stands in for a launch, only the directory is shared between them
+def test_source_persists(tmp_path):
+    generated = []
+
+    def generate():
+        generated.append(1)
+        return 'shader %d' % len(generated), None
+
+    obj = Function.registry['CachedScene']
+    assert ShaderCache(str(tmp_path)).source(obj, ('a',), generate) == ('shader 1', None)
+    assert ShaderCache(str(tmp_path)).source(obj, ('a',), generate) == ('shader 1', None)
+    assert len(generated) == 1
+    # Other settings and sources kept in memory only generate again
+    assert ShaderCache(str(tmp_path)).source(obj, ('b',), generate) == ('shader 2', None)
+    assert ShaderCache(str(tmp_path)).source(obj, ('a',), generate, persist=False) == ('shader 3', None)
@@ -0,0 +1,67 @@
+# test_cpu.py
+import sys
+
+import numpy as np
+
+from marcher import cpu
+from marcher.march import *
+
+
+# One Union chain nested deeper than the recursion limit
+def chain(name, depth):
+    def scene(self):
+        tree = Sphere(0.5).at(vec3(0, 0, 0))
+        for i in range(1, depth):
+            tree = Union(tree, Sphere(0.5).at(vec3(float(i), 0, 0)))
+        self.res(Union, tree)
+    scene.__name__ = scene.__qualname__ = name
+    Object.register()(scene)
+    return Function.registry[name]
+
+
+def test_deep_chain():
+    depth = sys.getrecursionlimit() + 1000
+    obj = chain('DeepCpuChain', depth)
+    points = np.array([[0.0, 0.0, 0.0], [depth - 1.0, 2.0, 0.0]])
+    assert np.allclose(cpu.distance(obj, points), [-0.5, 1.5])
+
+
+def test_combinator_tree():
+    tree = Union(Sphere(1.0), Box(vec3(1, 1, 1)).at(vec3(3, 0, 0)))
+    points = np.array([[0.0, 0.0, 0.0], [3.0, 0.0, 0.0], [1.5, 0.0, 0.0]])
+    assert np.allclose(cpu.distance(tree, points), [-1.0, -1.0, 0.5])
+    # Leaves that already have a point keep it
+    assert np.allclose(cpu.distance(tree(Var('p')), points), [-1.0, -1.0, 0.5])
+
+
+# One ray and one point at a time, as the loops in the blueprint do
+def march(scene, origin, direction):
+    direction = direction / np.linalg.norm(direction)
+    t = 0.0
+    for steps in range(1, scene.max_steps + 1):
+        d = float(scene.distance(origin + direction * t))
+        t += d
+        if t > scene.max_distance or d < scene.min_distance:
+            return t, steps
+    return t, scene.max_steps
+
+
+def normal(scene, point, e=0.01):
+    d = float(scene.distance(point))
+    n = np.array([d - float(scene.distance(point - axis)) for axis in np.eye(3) * e])
+    return n / np.linalg.norm(n)
+
+
+def test_scene_matches_loops():
+    scene = cpu.Scene(Union(Sphere(1.0), Box(vec3(0.5, 0.5, 0.5)).at(vec3(1.5, 0, 0))), max_steps=64)
+    random = np.random.RandomState(1)
+    origins = random.uniform(-0.5, 0.5, (50, 3)) + [0.0, 0.0, 4.0]
+    directions = random.uniform(-0.4, 0.4, (50, 3)) + [0.0, 0.0, -1.0]
+    t, steps = scene.raycast(origins, directions)
+    expected = [march(scene, o, d) for o, d in zip(origins, directions)]
+    assert np.allclose(t, [e[0] for e in expected]) and (steps == [e[1] for e in expected]).all()
+
+    hit = t < scene.max_distance
+    assert hit.sum() > 10
+    points = origins[hit] + directions[hit] / np.linalg.norm(directions[hit], axis=1)[:, None] * t[hit, None]
+    assert np.allclose(scene.normals(points), [normal(scene, p) for p in points])
@@ -0,0 +1,66 @@
+# test_glsl.py
+import numpy as np
+
+from marcher import cpu
+from marcher.glsl import translate
+from marcher.march import *
+
+
+@Primitive.register()
+def FoldX(p: vec3, s: float): """
+    vec3 q = p.x > 0.0 ? p : -p;
+    return length(q - vec3(s, 0.0, 0.0)) - 0.5 * s;
+"""
+
+@Primitive.register()
+def Rounded(p: vec3, b: vec3, r: float): """
+    vec3 d = abs(p) - b;
+    float inside = min(max(d.x, max(d.y, d.z)), 0.0);
+    return inside + length(max(d, 0.0)) - r;
+"""
+
+@Primitive.register()
+def Ring(p: vec3, t: vec2): """
+    vec2 q = vec2(length(p.xz) - t.x, p.y);
+    float r = q.y < 0.0 ? 0.5 * t.y : t.y;
+    return length(q) - r;
+"""
+
+
+def fold_x(p, s):
+    q = np.where(p[..., :1] > 0.0, p, -p)
+    return np.linalg.norm(q - [s, 0.0, 0.0], axis=-1) - 0.5 * s
+
+
+def rounded(p, b, r):
+    d = np.abs(p) - b
+    return np.minimum(d.max(axis=-1), 0.0) + np.linalg.norm(np.maximum(d, 0.0), axis=-1) - r
+
+
+def ring(p, t):
+    q = np.stack([np.hypot(p[..., 0], p[..., 2]) - t[0], p[..., 1]], -1)
+    return np.linalg.norm(q, axis=-1) - np.where(q[..., 1] < 0.0, 0.5 * t[1], t[1])
+
+
+def sphere(p, r):
+    return np.linalg.norm(p, axis=-1) - r
+
+
+# Translations of the bodies above and of builtin primitives against the same
+# functions written by hand, three points so vecs and the point axis can't be confused
+def test_against_numpy():
+    points = np.random.RandomState(0).uniform(-2, 2, (3, 3))
+    cases = [('FoldX', fold_x, [0.7]),
+             ('Rounded', rounded, [np.array([0.5, 0.3, 0.8]), 0.1]),
+             ('Ring', ring, [np.array([1.0, 0.25])]),
+             ('Sphere', sphere, [1.2]),
+             ('Box', lambda p, b: rounded(p, b, 0.0), [np.array([0.5, 0.3, 0.8])])]
+    for name, expected, args in cases:
+        kernel = translate(Function.registry[name])
+        assert np.allclose(kernel(points, *args), expected(points, *args)), kernel.source
+
+
+def test_ternary_widens():
+    source = translate(Function.registry['FoldX']).source
+    assert 'np.where(widen(' in source
+    assert cpu.find('FoldX') is not None
@@ -0,0 +1,62 @@
+# test_gradient.py
+import os
+
+import numpy as np
+
+from marcher import gradient
+from marcher.march import *
+
+
+@Combinator.register()
+def SoftUnion(d1: float, d2: float, k: float): """
+    float h = clamp( 0.5 + 0.5*(d2-d1)/k, 0.0, 1.0 );
+    return mix( d2, d1, h ) - k*h*(1.0-h);
+"""
+
+
+@Primitive.register()
+def Branchy(p: vec3, r: float): """
+    if (p.y > 0.0) {
+        return length(p) - r;
+    }
+    return length(p * vec3(1.0, 2.0, 1.0)) - r;
+"""
+
+
+@Object.register()
+def GradientScene(self):
+    self.res(Union, Sphere(1.0))
+    self.res(SoftUnion, Box(vec3(0.5, 0.5, 0.5)).at(vec3(1.2, 0, 0)), 0.2)
+    self.res(Union, Branchy(0.5).at(vec3(-1.5, 0, 0)))
+
+
+def test_differentiated():
+    for name in ('Box', 'SoftUnion'):
+        text = gradient.source(Function.registry[name])
+        assert text.startswith(gradient.signature(Function.registry[name]))
+        assert '(' + name + '(' not in text
+
+
+# Bodies the parser can't read take finite differences of the original and say why
+def test_fallback():
+    text = gradient.source(Function.registry['Branchy'])
+    assert text.startswith("// Unsupported GLSL 'if'")
+    assert 'Branchy(p' in text and 'return _g;' in text
+
+
+def test_object_source():
+    text = gradient.source(Function.registry['GradientScene'])
+    assert 'SoftUnion_grad(res,Box_grad(Translate_grad(p,' in text
+
+
+# Normals from DE_grad shade the same as the ones from differences of the DE
+def test_normals_match():
+    frames = [Camera((64, 48), cache=False, gradient=on).render_to_array(Object.GradientScene).astype(int)
+              for on in (False, True)]
+    assert np.abs(frames[0] - frames[1]).mean() < 1
+
+
+# march.glsl is the blueprint as a file for editors and other tools
+def test_blueprint_file():
+    path = os.path.join(os.path.dirname(gradient.__file__), 'march.glsl')
+    assert open(path).read() == frag_blueprint.lstrip('\n')
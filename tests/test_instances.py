@@ -0,0 +1,58 @@
+# test_instances.py
+import numpy as np
+
+from marcher import cpu
+from marcher.instances import instances
+from marcher.march import *
+
+random = np.random.RandomState(2)
+positions = random.uniform(-2, 2, (40, 3))
+radii = random.uniform(0.1, 0.3, 40)
+scales = random.uniform(0.5, 1.5, 40)
+grid = instances(Sphere, positions, scale=scales, r=radii, name='TestGrid')
+
+
+@Object.register()
+def InstancedScene(self):
+    self.res(Union, grid())
+
+
+@Object.register()
+def UnionScene(self):
+    for position, radius, scale in zip(positions, radii, scales):
+        self.res(Union, Sphere(float(radius * scale)).at(vec3(*map(float, position))))
+
+
+def brute_force(points):
+    return (np.linalg.norm(points[:, None] - positions, axis=-1) - radii * scales).min(axis=1)
+
+
+# Exact wherever the nearest copy is within the margin, never further than it elsewhere
+def test_distance():
+    points = random.uniform(-3, 3, (5000, 3))
+    d, expected = grid.distance(points), brute_force(points)
+    margin = grid.grid[2]
+    assert (d <= expected + 1e-9).all()
+    near = expected < margin
+    assert near.sum() > 100 and np.allclose(d[near], expected[near])
+
+
+def test_update():
+    moved = positions + [0.5, 0.0, 0.0]
+    grid.update(moved)
+    try:
+        points = random.uniform(-3, 3, (2000, 3))
+        expected = (np.linalg.norm(points[:, None] - moved, axis=-1) - radii * scales).min(axis=1)
+        d = cpu.distance(Object.InstancedScene, points)
+        near = expected < grid.grid[2]
+        assert near.sum() > 50 and np.allclose(d[near], expected[near])
+    finally:
+        grid.update(positions)
+
+
+# The shader's grid walk draws the same frame as the spheres one by one
+def test_render():
+    frames = [Camera((64, 48), cache=False).render_to_array(obj).astype(int)
+              for obj in (Object.InstancedScene, Object.UnionScene)]
+    assert np.abs(frames[0] - frames[1]).mean() < 1
+    assert (frames[1] != frames[1][0, 0]).any(axis=-1).mean() > 0.05
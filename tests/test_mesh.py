@@ -0,0 +1,56 @@
+# test_mesh.py
+import numpy as np
+
+from marcher import cpu
+from marcher.march import *
+from marcher.mesh import mesh
+
+
+@Object.register()
+def MeshScene(self):
+    self.res(Union, Sphere(1.0))
+    self.res(Union, Box(vec3(0.4, 0.4, 0.4)).at(vec3(1.2, 0, 0)))
+
+
+@Object.register()
+def MeshBall(self):
+    self.res(Union, Sphere(1.0))
+
+
+def edges(faces):
+    return faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+
+
+# Closed and consistently wound: every edge is used once in each direction
+def test_watertight():
+    vertices, faces = mesh(Object.MeshScene, depth=5, workers=1)
+    directed = edges(faces)
+    assert len(np.unique(directed, axis=0)) == len(directed)
+    forward = set(map(tuple, directed))
+    assert all((b, a) in forward for a, b in forward)
+
+
+def test_normals_point_out():
+    vertices, faces = mesh(Object.MeshScene, depth=5, workers=1)
+    triangles = vertices[faces].astype(float)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    gradients = cpu.Scene(Object.MeshScene).normals(triangles.mean(axis=1))
+    assert (np.sum(normals * gradients, axis=1) > 0).all()
+
+
+# Signed volume of the triangles, positive only when they face out
+def test_volume():
+    vertices, faces = mesh(Object.MeshBall, depth=6, workers=1)
+    triangles = vertices[faces].astype(float)
+    volume = np.sum(triangles[:, 0] * np.cross(triangles[:, 1], triangles[:, 2])) / 6
+    assert abs(volume - 4 / 3 * np.pi) < 0.02 * 4 / 3 * np.pi
+
+
+# Branches come back in a different order, the triangles are the same
+def test_workers():
+    meshes = []
+    for workers in (1, 2):
+        vertices, faces = mesh(Object.MeshScene, depth=5, workers=workers)
+        triangles = vertices[faces].reshape(len(faces), -1)
+        meshes.append(triangles[np.lexsort(triangles.T)])
+    assert np.array_equal(*meshes)
@@ -0,0 +1,21 @@
+# test_progressive.py
+import numpy as np
+
+from marcher.march import *
+
+
+@Object.register()
+def ProgressiveScene(self):
+    self.res(Union, Sphere(1.0))
+    self.res(Union, Box(vec3(0.5, 0.5, 0.5)).at(vec3(1.5, 0, 0)))
+
+
+# Every call starts over, with or without a prepass in front of the samples
+def test_render_samples_prepass():
+    frames = []
+    for prepass in (None, 8):
+        camera = Camera((64, 48), cache=False, prepass=prepass)
+        first = camera.render_samples(Object.ProgressiveScene, 4).copy()
+        assert (camera.render_samples(Object.ProgressiveScene, 4) == first).all()
+        frames.append(first.astype(int))
+    assert np.abs(frames[0] - frames[1]).mean() < 1
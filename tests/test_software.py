@@ -0,0 +1,26 @@
+# test_software.py
+import numpy as np
+
+from marcher.march import *
+
+
+@Object.register()
+def SoftwareScene(self):
+    self.res(Union, Sphere(1.0))
+    self.res(Union, Box(vec3(0.5, 0.5, 0.5)).at(vec3(1.5, 0, 0)))
+    self.res(Union, Plane(at=vec3(0, -1, 0)))
+
+
+# Tiles go to whichever worker asks first, the frame can't depend on it
+def test_workers():
+    camera = Camera((48, 36), cache=False)
+    frames = [camera.render_cpu(Object.SoftwareScene, workers=workers, tile=8) for workers in (1, 2, 3)]
+    assert all((frame == frames[0]).all() for frame in frames[1:])
+    assert (camera.render_cpu(Object.SoftwareScene, workers=2, tile=16) == frames[0]).all()
+
+
+def test_matches_gpu():
+    camera = Camera((48, 36), cache=False)
+    cpu = camera.render_cpu(Object.SoftwareScene, workers=1).astype(int)
+    gpu = camera.render_to_array(Object.SoftwareScene).astype(int)
+    assert np.abs(cpu - gpu).mean() < 0.5
@@ -0,0 +1,47 @@
+# test_tiles.py
+import sys
+
+from marcher.march import *
+from marcher.tiles import specialize
+
+
+@Object.register()
+def TileScene(self):
+    for i in range(-2, 3):
+        self.res(Union, Sphere(0.4).at(vec3(i * 1.5, 0, 0)))
+        self.res(Union, Box(vec3(0.3, 0.3, 0.3)).at(vec3(i * 1.5, 1.0, 0)))
+
+
+# Pruning for new views doesn't register objects, which would invalidate every generated source
+def test_pruned_objects_stay_local():
+    camera = Camera((128, 96), cache=False, tiles=32)
+    count, generation = len(Function.registry), Function.generation
+    for mouse in [(64, 48), (20, 30), (100, 70)]:
+        for pruned, rects in specialize(Object.TileScene, camera.size, camera.params, mouse, 32, 4):
+            shader, _ = camera.generate_shader(Object.TileScene, pruned)
+            assert pruned.name + '(' in shader
+    assert len(Function.registry) == count and Function.generation == generation
+
+
+def chain(name, depth):
+    def scene(self):
+        tree = Sphere(0.5).at(vec3(0, 0, 0))
+        for i in range(1, depth):
+            tree = Union(tree, Sphere(0.5).at(vec3(float(i), 0, 0)))
+        self.res(Union, tree)
+    scene.__name__ = scene.__qualname__ = name
+    Object.register()(scene)
+    return Function.registry[name]
+
+
+# Tiles looking away from most of the chain only keep the spheres in front of them
+def test_deep_chain():
+    depth = sys.getrecursionlimit() + 1000
+    obj = chain('DeepTileChain', depth)
+    camera = Camera((128, 96), cache=False, tiles=32, MAX_DISTANCE=20.0)
+    stats = {}
+    groups = specialize(obj, camera.size, camera.params, camera.default_mouse(), 32, 4, stats)
+    assert stats['scene_primitives'] == depth
+    assert stats['tile_primitives'] < depth
+    for pruned, rects in groups:
+        assert pruned.name + '(' in camera.generate_shader(obj, pruned)[0]
@@ -0,0 +1,37 @@
+# test_uniforms.py
+from marcher.march import *
+
+
+@Object.register()
+def UniformScene(self):
+    self.res(Union, Sphere(1.0).at(vec3(0, 1, 0)))
+    self.res(Union, Box(vec3(0.5, 0.5, 0.5)))
+
+
+# Every compilation's uniforms are freed before the next one starts, which is when
+# CPython hands their id out again
+def test_compile_twice():
+    for _ in range(20):
+        shader, uniforms = Camera((64, 64), cache=False, uniforms=True).generate_shader(Object.UniformScene)
+        assert uniforms.values and 'uniform float iParams[%d];' % len(uniforms.values) in shader
+        del shader, uniforms
+
+
+@Object.register()
+def PlacedScene(self):
+    self.res(Union, Sphere(1.0).at(vec3(0, 0, 0)))
+    self.res(Union, Union(Sphere(1.0), Box(vec3(1, 1, 1))).at(vec3(2, 0, 0)))
+    self.res(Union, Union(Sphere(1.0), Box(vec3(1, 1, 1))).at(vec3(4, 0, 0)))
+
+
+# Every placement keeps constants of its own, even where they would fold or match,
+# so the optimized scene hoists what the plain one does
+def test_placements_stay_uniforms():
+    shaders = []
+    for optimize in (True, False):
+        camera = Camera((64, 64), cache=False, uniforms=True)
+        camera.optimize = optimize
+        shader, uniforms = camera.generate_shader(Object.PlacedScene)
+        shaders.append((shader.count('Translate('), uniforms.names))
+    assert shaders[0] == shaders[1]
+    assert len(shaders[0][1]) == 24